@@ -1,10 +1,16 @@
 # APIServer_Backend/app.py
-from flask import Flask, request, jsonify, render_template, abort
+from flask import Flask, request, jsonify, render_template, abort, Response, stream_with_context, send_file, url_for
 import os
+import io
+import csv
+import json
+import base64
+import hashlib
+import threading
 import configparser
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, date, timezone, timedelta
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager, verify_jwt_in_request
 
@@ -33,29 +39,470 @@ db_host = config.get('Database', 'db_host', fallback='localhost')
 db_port = config.get('Database', 'db_port', fallback='5432')
 db_name = config.get('Database', 'db_name', fallback='farmguard_v2_db')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = (
+# FARMGUARD_DATABASE_URL overrides [Database] (e.g. a scratch database for tests or a one-off `flask db upgrade`)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('FARMGUARD_DATABASE_URL') or (
     f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# The models write naive UTC datetimes into timestamptz columns, and partition windows, since/until
+# filters and ETag floors are naive UTC too; PostgreSQL reads those in the session's time zone, so
+# pin it to UTC whatever the server, database or role default is
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'options': '-c timezone=UTC'}}
 
 app.config["JWT_SECRET_KEY"] = config.get('Server', 'jwt_secret_key', fallback="change-this-super-secret-key-in-config")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=config.getint('Server', 'jwt_expiry_hours', fallback=24))
 
+GUARDIAN_BATCH_MAX_EVENTS = config.getint('Ingestion', 'guardian_batch_max_events', fallback=10000)
+EVENTS_PAGE_DEFAULT_LIMIT = config.getint('Server', 'events_page_default_limit', fallback=100)
+EVENTS_PAGE_MAX_LIMIT = config.getint('Server', 'events_page_max_limit', fallback=1000)
+EXPORT_YIELD_PER = config.getint('Server', 'export_yield_per', fallback=2000)
+ASSETS_PAGE_DEFAULT_LIMIT = config.getint('Server', 'assets_page_default_limit', fallback=500)
+ASSETS_PAGE_MAX_LIMIT = config.getint('Server', 'assets_page_max_limit', fallback=5000)
+EVENT_STREAM_BUFFER_SIZE = config.getint('Server', 'event_stream_buffer_size', fallback=1000)
+EVENT_STREAM_KEEPALIVE_SECONDS = config.getint('Server', 'event_stream_keepalive_seconds', fallback=15)
+EVENT_STREAM_PG_NOTIFY = config.getboolean('Server', 'event_stream_pg_notify', fallback=False)
+EVENT_STREAM_PG_CHANNEL = 'farmguard_events'
+LORAWAN_WEBHOOK_SECRET = config.get('LoRaWAN_Integration', 'webhook_secret', fallback='')
+LORAWAN_SUBUNIT_FPORT = config.getint('LoRaWAN_Integration', 'subunit_fport', fallback=1)
+LORAWAN_UPLINK_MAX_BATCH = config.getint('LoRaWAN_Integration', 'uplink_max_batch', fallback=1000)
+TAG_CACHE_MAX_ENTRIES = config.getint('Ingestion', 'tag_cache_max_entries', fallback=10000)
+TAG_CACHE_TTL_SECONDS = config.getint('Ingestion', 'tag_cache_ttl_seconds', fallback=300)
+TAG_CACHE_NEGATIVE_TTL_SECONDS = config.getint('Ingestion', 'tag_cache_negative_ttl_seconds', fallback=60)
+MEDIA_STORAGE_PATH = os.path.join(os.path.dirname(__file__), config.get('Media', 'storage_path', fallback='media_store'))
+MEDIA_MAX_FILE_BYTES = config.getint('Media', 'max_file_bytes', fallback=1024 * 1024 * 1024)
+MEDIA_CHUNK_MAX_BYTES = config.getint('Media', 'chunk_max_bytes', fallback=16 * 1024 * 1024)
+ALERTS_ENABLED = config.getboolean('Alerts', 'enabled', fallback=True)
+ALERT_WORKERS = config.getint('Alerts', 'workers', fallback=2)
+ALERT_QUEUE_SIZE = config.getint('Alerts', 'queue_size', fallback=10000)
+ALERT_BATCH_SIZE = config.getint('Alerts', 'batch_size', fallback=500)
+ALERT_RULES_REFRESH_SECONDS = config.getint('Alerts', 'rules_refresh_seconds', fallback=60)
+ALERT_SILENT_CHECK_SECONDS = config.getint('Alerts', 'silent_check_seconds', fallback=30)
+ALERT_DEFAULT_RULES = [name.strip() for name in config.get('Alerts', 'default_rules', fallback='unknown_tag,inactive_asset').split(',') if name.strip()]
+ALERT_DEFAULT_SEVERITY = config.get('Alerts', 'default_severity', fallback='medium')
+ALERT_DEFAULT_SUPPRESS_MINUTES = config.getint('Alerts', 'default_suppress_minutes', fallback=60)
+ALERTS_PAGE_DEFAULT_LIMIT = config.getint('Alerts', 'page_default_limit', fallback=100)
+ALERTS_PAGE_MAX_LIMIT = config.getint('Alerts', 'page_max_limit', fallback=1000)
+FSMA_ENABLED = config.getboolean('FSMA', 'enabled', fallback=True)
+FSMA_LOCATIONS = dict(config.items('FSMA_Locations')) if config.has_section('FSMA_Locations') else {}
+PARTITIONING_ENABLED = config.getboolean('Partitioning', 'enabled', fallback=True)
+PARTITION_MONTHS_AHEAD = config.getint('Partitioning', 'months_ahead', fallback=3)
+PARTITION_MAINTENANCE_HOURS = config.getint('Partitioning', 'maintenance_interval_hours', fallback=6)
+EVENT_RETENTION_MONTHS = config.getint('Partitioning', 'retention_months', fallback=0)
+EVENT_RETENTION_ACTION = config.get('Partitioning', 'retention_action', fallback='drop')
+STATS_ROLLUPS_ENABLED = config.getboolean('Stats', 'rollups_enabled', fallback=True)
+STATS_ROLLUP_INTERVAL_SECONDS = config.getint('Stats', 'rollup_interval_seconds', fallback=300)
+STATS_ROLLUP_LAG_SECONDS = config.getint('Stats', 'rollup_lag_seconds', fallback=120)
+STATS_ROLLUP_CHUNK_HOURS = config.getint('Stats', 'rollup_chunk_hours', fallback=24)
+STATS_MAX_BUCKETS = config.getint('Stats', 'max_buckets', fallback=2000)
+NOTIFICATIONS_ENABLED = config.getboolean('Notifications', 'enabled', fallback=False)
+NOTIFY_DIGEST_WINDOW_SECONDS = config.getint('Notifications', 'digest_window_seconds', fallback=60)
+NOTIFY_WORKERS = config.getint('Notifications', 'workers', fallback=4)
+NOTIFY_MAX_ATTEMPTS = config.getint('Notifications', 'max_attempts', fallback=5)
+NOTIFY_MAX_ALERTS_PER_DIGEST = config.getint('Notifications', 'max_alerts_per_digest', fallback=50)
+# Partition maintenance, rollups, alert workers and notification digests; see start_background_services()
+app.config['BACKGROUND_SERVICES'] = config.getboolean('Server', 'background_services', fallback=True)
+
 # --- Initialize Extensions ---
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
+# Partitions of the event tables exist only in the database; keep autogenerate from dropping them
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(__file__), 'migrations'),
+                  include_name=lambda name, type_, parent_names: not (type_ == 'table' and is_event_partition(name)))
 
 # --- Import Models (AFTER db and bcrypt are initialized) ---
-from .models import User, Asset, GuardianEvent, SubUnitEvent
+from .services.event_partitions import EventPartitionManager, is_event_partition, month_start
+from .models import (User, Asset, GuardianEvent, SubUnitEvent, MediaFile, MediaRequest, AlertRule, Alert, FSMARecord, AssetPresence,
+                     EventRollupHourly, EventRollupState)
+from .services.tag_cache import TagAssetCache, TagAsset, MISS
+from .services.event_broadcaster import EventBroadcaster, PgNotifyBridge
+from .services.subunit_payload import decode_subunit_payload
+from .services.media_store import MediaStore, OffsetMismatch, UploadTooLarge, DigestMismatch, SHA256_PATTERN
+from .services.alert_service import AlertService, AlertEvent, make_rule, RULE_TYPES, SEVERITIES, UNIT_SILENT, AFTER_HOURS_EXIT
+from .services.fsma_processor import FSMAService, RECORD_RETENTION_MONTHS, lot_code_error
+from .services.asset_presence import AssetPresenceService, PRESENCE_FIELDS, GATE_DIRECTIONS
+from .services.event_rollups import EventRollupService, BUCKETS, GROUP_BY_FIELDS, floor_bucket, ceil_bucket
+from .services.notification_dispatcher import NotificationDispatcher, SmtpChannel, WebhookChannel, parse_recipients
 
 print("Flask App Initializing with SQLAlchemy, Migrate, Bcrypt, and JWTManager...")
 
+tag_asset_cache = TagAssetCache(max_entries=TAG_CACHE_MAX_ENTRIES, ttl_seconds=TAG_CACHE_TTL_SECONDS,
+                                negative_ttl_seconds=TAG_CACHE_NEGATIVE_TTL_SECONDS)
+event_broadcaster = EventBroadcaster(buffer_size=EVENT_STREAM_BUFFER_SIZE)
+# With pg_notify on, asset writes also reach the tag caches of the other server processes through the bridge
+TAG_CACHE_INVALIDATE = 'tag_cache_invalidate'
+event_notify_bridge = PgNotifyBridge(event_broadcaster, EVENT_STREAM_PG_CHANNEL,
+                                     handlers={TAG_CACHE_INVALIDATE: lambda tag_ids: tag_asset_cache.invalidate(*tag_ids)},
+                                     on_reconnect=tag_asset_cache.clear) \
+    if EVENT_STREAM_PG_NOTIFY else None # on_reconnect: invalidations sent while the listener was down are lost
+media_store = MediaStore(MEDIA_STORAGE_PATH)
+fsma_service = FSMAService(db.session, FSMARecord, FSMA_LOCATIONS) if FSMA_ENABLED else None
+asset_presence_service = AssetPresenceService(db.session, AssetPresence)
+
+# --- Event table partitions (PostgreSQL; see services/event_partitions.py) ---
+EVENT_PARTITION_SOURCES = {'guardian_events': ('guardian', GuardianEvent, 'event_time'),
+                           'subunit_events': ('subunit', SubUnitEvent, 'reported_at_device')}
+
+def event_partition_engine():
+    with app.app_context():
+        return db.engine
+
+def preserve_fsma_records(table, received_from, received_until):
+    """Retention hook: records the KDEs of any tagged event in a partition about to be purged."""
+    if not fsma_service: return
+    source, model, time_column_name = EVENT_PARTITION_SOURCES[table]
+    with app.app_context():
+        added = fsma_service.record_missing(source, model, Asset, time_column_name, received_from, received_until)
+    if added:
+        print(f"FSMA Service: recorded {added} {source} event(s) before purging their partition")
+
+event_partitions = EventPartitionManager(
+    event_partition_engine, {'guardian_events': 'received_at', 'subunit_events': 'received_at_server'},
+    months_ahead=PARTITION_MONTHS_AHEAD,
+    # Without FSMA records the raw events are the traceability record, so they are kept for the required period
+    retention_months=max(EVENT_RETENTION_MONTHS, RECORD_RETENTION_MONTHS) if EVENT_RETENTION_MONTHS and not fsma_service else EVENT_RETENTION_MONTHS,
+    retention_action=EVENT_RETENTION_ACTION, before_drop=preserve_fsma_records,
+    interval_hours=PARTITION_MAINTENANCE_HOURS) if PARTITIONING_ENABLED else None
+
+# --- Hourly event rollups for /api/stats (see services/event_rollups.py) ---
+event_rollups = EventRollupService(
+    event_partition_engine, {'guardian': (GuardianEvent, 'received_at', 'direction'),
+                             'subunit': (SubUnitEvent, 'received_at_server', None)},
+    Asset, EventRollupHourly, EventRollupState, interval_seconds=STATS_ROLLUP_INTERVAL_SECONDS,
+    lag_seconds=STATS_ROLLUP_LAG_SECONDS, chunk_hours=STATS_ROLLUP_CHUNK_HOURS)
+
+# --- Alert engine callbacks (run on the alert service's threads) ---
+def load_alert_rules():
+    rules = [make_rule(None, f"Default {rule_type}", rule_type, severity=ALERT_DEFAULT_SEVERITY,
+                       suppress_minutes=ALERT_DEFAULT_SUPPRESS_MINUTES) for rule_type in ALERT_DEFAULT_RULES]
+    with app.app_context():
+        for rule in AlertRule.query.filter_by(is_active=True).all():
+            rules.append(make_rule(rule.id, rule.name, rule.rule_type, rule.unit_id, rule.asset_id, rule.severity,
+                                   rule.allowed_from, rule.allowed_until, rule.silent_minutes, rule.suppress_minutes))
+    return rules
+
+def persist_alerts(new_alerts, repeats):
+    """Stores a batch from the alert engine: one multi-row INSERT and one executemany UPDATE. Returns the new ids."""
+    with app.app_context():
+        try:
+            alert_ids = []
+            if new_alerts:
+                alert_ids = db.session.execute(db.insert(Alert).returning(Alert.id, sort_by_parameter_order=True),
+                                               new_alerts).scalars().all()
+            if repeats:
+                alerts = Alert.__table__
+                db.session.execute(
+                    db.update(alerts).where(alerts.c.id == db.bindparam('alert_id'))
+                    .values(occurrence_count=alerts.c.occurrence_count + db.bindparam('extra'), last_seen_at=db.bindparam('seen_at')),
+                    [{'alert_id': alert_id, 'extra': extra, 'seen_at': seen_at} for alert_id, extra, seen_at in repeats])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if new_alerts:
+            publish_live_events('alert', [{**{name: json_value(value) for name, value in alert.items()}, 'id': alert_id}
+                                          for alert, alert_id in zip(new_alerts, alert_ids)])
+        return alert_ids
+
+def find_open_alerts(keys):
+    """The open alerts (one tag_id index probe per tag) last seen within their rule's window, for suppression across processes."""
+    windows = dict(keys)
+    age_seconds = db.func.extract('epoch', db.func.now() - Alert.last_seen_at) # The database's clock, whatever the session time zone
+    with app.app_context():
+        rows = db.session.execute(
+            db.select(Alert.id, Alert.rule_id, Alert.alert_type, Alert.tag_id, age_seconds)
+            .where(Alert.status == 'open', Alert.tag_id.in_({tag_id for _, tag_id in windows}),
+                   age_seconds < max(windows.values()))
+            .order_by(Alert.id)).all()
+    found = {}
+    for alert_id, rule_id, alert_type, tag_id, age in rows:
+        key = (rule_id or alert_type, tag_id)
+        if key in windows and age < windows[key]:
+            found[key] = alert_id # The latest one, if several are open
+    return found
+
+def load_unit_activity(unit_ids):
+    """For the unit_silent check: each unit's latest event (one index probe per unit and table) and, per rule, its latest silence alert."""
+    with app.app_context():
+        last_seen = {}
+        for unit_id in unit_ids:
+            seen = [db.session.execute(db.select(db.func.max(received)).where(unit_column == unit_id)).scalar()
+                    for unit_column, received in ((GuardianEvent.unit_id, GuardianEvent.received_at),
+                                                  (SubUnitEvent.unit_id, SubUnitEvent.received_at_server))]
+            seen = [value for value in seen if value is not None]
+            if seen:
+                last_seen[unit_id] = max(seen)
+        last_fired = {(rule_id or alert_type, unit_id): fired_at for rule_id, alert_type, unit_id, fired_at in db.session.execute(
+            db.select(Alert.rule_id, Alert.alert_type, Alert.unit_id, db.func.max(Alert.first_seen_at))
+            .where(Alert.alert_type == UNIT_SILENT, Alert.unit_id.in_(unit_ids))
+            .group_by(Alert.rule_id, Alert.alert_type, Alert.unit_id)).all()}
+    return last_seen, last_fired
+
+def build_notification_dispatcher():
+    channels = {}
+    if config.get('Notifications', 'smtp_host', fallback=''):
+        channels['smtp'] = SmtpChannel(
+            config.get('Notifications', 'smtp_host'), config.getint('Notifications', 'smtp_port', fallback=25),
+            username=config.get('Notifications', 'smtp_username', fallback='') or None,
+            password=config.get('Notifications', 'smtp_password', fallback='') or None,
+            starttls=config.getboolean('Notifications', 'smtp_starttls', fallback=False),
+            from_address=config.get('Notifications', 'smtp_from', fallback='farmguard@localhost'),
+            pool_size=config.getint('Notifications', 'smtp_pool_size', fallback=2),
+            rate_per_minute=config.getint('Notifications', 'smtp_rate_per_minute', fallback=30))
+    channels['webhook'] = WebhookChannel(
+        timeout=config.getint('Notifications', 'webhook_timeout_seconds', fallback=10),
+        pool_size=config.getint('Notifications', 'webhook_pool_size', fallback=4),
+        rate_per_minute=config.getint('Notifications', 'webhook_rate_per_minute', fallback=60))
+    recipients = parse_recipients(config.items('Notification_Recipients')) if config.has_section('Notification_Recipients') else []
+    return NotificationDispatcher(channels, recipients, digest_window_seconds=NOTIFY_DIGEST_WINDOW_SECONDS,
+                                  workers=NOTIFY_WORKERS, max_attempts=NOTIFY_MAX_ATTEMPTS,
+                                  max_alerts_listed=NOTIFY_MAX_ALERTS_PER_DIGEST)
+
+notification_dispatcher = build_notification_dispatcher() if ALERTS_ENABLED and NOTIFICATIONS_ENABLED else None
+
+alert_service = AlertService(load_alert_rules, persist_alerts, workers=ALERT_WORKERS, queue_size=ALERT_QUEUE_SIZE,
+                             batch_size=ALERT_BATCH_SIZE, rules_refresh_seconds=ALERT_RULES_REFRESH_SECONDS,
+                             silent_check_seconds=ALERT_SILENT_CHECK_SECONDS,
+                             notify=notification_dispatcher.enqueue_alerts if notification_dispatcher else None,
+                             load_unit_activity=load_unit_activity, get_engine=event_partition_engine,
+                             find_open_alerts=find_open_alerts) if ALERTS_ENABLED else None
+
+# --- Background threads, started by the first request a process serves ---
+# Not at import: `flask db upgrade`, the CLI commands and tests import this module too, possibly
+# before the schema they work on exists.
+_background_services_lock = threading.Lock()
+_background_services_started = False
+
+def start_background_services():
+    """Starts partition maintenance, rollups, notification digests and the alert workers, once per process."""
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started: return
+        _background_services_started = True
+    if event_partitions:
+        event_partitions.start()
+    if STATS_ROLLUPS_ENABLED:
+        event_rollups.start()
+    if notification_dispatcher:
+        notification_dispatcher.start()
+    if alert_service:
+        alert_service.start()
+    if event_notify_bridge:
+        event_notify_bridge.ensure_started(event_partition_engine()) # Tag cache invalidations, even with no stream open
+
+@app.before_request
+def ensure_background_services():
+    if app.config['BACKGROUND_SERVICES']:
+        start_background_services()
+
 # --- Helper for parsing boolean query parameters ---
 def str_to_bool(s):
     if s is None: return False
     return s.lower() in ['true', '1', 't', 'y', 'yes']
 
+# --- Helpers for parsing query parameters used by list endpoints ---
+def parse_iso_datetime(value):
+    """Parses an ISO 8601 string into a naive UTC datetime (the storage convention of the models)."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_event_time(value):
+    """
+    Parses a unit's event.timestamp_iso into an aware datetime for the timestamptz event_time
+    column, keeping the unit's UTC offset (the after-hours rule reads its wall clock); times sent
+    without an offset are UTC, as in parse_iso_datetime. Raises ValueError when unparseable.
+    """
+    if not isinstance(value, str): raise ValueError("not a string")
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+def parse_limit(value, default, maximum):
+    if value is None: return default
+    limit = int(value)
+    if limit < 1: raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+def json_value(value):
+    """Makes a column value JSON-serializable the same way the models' to_dict() methods do."""
+    if isinstance(value, date): return value.isoformat() # Covers datetime too
+    return value
+
+def encode_cursor(*values):
+    """Opaque keyset cursor: urlsafe base64 of the JSON-encoded sort key of the last row on a page."""
+    raw = json.dumps([json_value(v) for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if not isinstance(values, list): raise ValueError("malformed cursor")
+    return values
+
+# --- Helper for checking event rows against their table before a multi-row INSERT ---
+def column_value_errors(model, row, prefix='event.'):
+    """
+    Messages for the values in row that model's string columns would refuse (not a string, or
+    longer than the column), so one bad item is rejected on its own instead of failing the INSERT
+    for its whole batch. unit_id is named as sent (top level); other fields get prefix.
+    """
+    errors = []
+    for name, value in row.items():
+        column = model.__table__.columns.get(name)
+        if value is None or column is None or not isinstance(column.type, db.String):
+            continue
+        label = name if name == 'unit_id' else prefix + name
+        if not isinstance(value, str):
+            errors.append(f"{label} must be a string")
+        elif column.type.length and len(value) > column.type.length:
+            errors.append(f"{label} is longer than {column.type.length} characters")
+    return errors
+
+# --- Helpers for conditional GET (weak ETags from table watermarks) ---
+def watermark_etag(*watermark):
+    """
+    ETag value for a read whose result only changes when the given watermarks change
+    (e.g. max(updated_at) of a table). The request path and query string are mixed in,
+    so differently filtered/paged reads of the same table get different tags.
+    """
+    key = json.dumps([json_value(v) for v in watermark] + [request.full_path])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def etag_matches(etag):
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified(etag):
+    response = Response(status=304)
+    return with_etag(response, etag)
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate; a 304 costs one watermark query
+    return response
+
+# --- Helper for eager-loading the asset fields used by event to_dict() ---
+def event_asset_info_load(event_model):
+    return db.joinedload(event_model.asset).load_only(Asset.id, Asset.asset_name, Asset.is_active)
+
+# --- Helpers for the live event stream (/api/events/stream) ---
+def asset_info_from_tag_asset(tag_asset):
+    if not tag_asset: return None
+    return {"id": tag_asset.asset_id, "name": tag_asset.asset_name, "is_active": tag_asset.is_active}
+
+def guardian_stream_payload(event_id, received_at, fields, tag_asset):
+    """Same shape as GuardianEvent.to_dict() minus raw_event_payload, built without touching the ORM."""
+    return {
+        'id': event_id, 'unit_id': fields['unit_id'], 'timestamp_iso': fields['timestamp_iso'],
+        'event_time': json_value(fields['event_time']), 'tag_id': fields['tag_id'], 'asset_id': fields['asset_id'], 'asset_info': asset_info_from_tag_asset(tag_asset),
+        'video_url_remote': fields['video_url_remote'], 'thumbnail_url': fields.get('thumbnail_url'),
+        'proxy_url': fields.get('proxy_url'), 'direction': fields['direction'], 'received_at': json_value(received_at)
+    }
+
+def subunit_stream_payload(event_id, received_at_server, fields, tag_asset):
+    """Same shape as SubUnitEvent.to_dict(), built without touching the ORM."""
+    payload = {name: json_value(value) for name, value in fields.items()}
+    payload.update({'id': event_id, 'asset_info': asset_info_from_tag_asset(tag_asset),
+                    'received_at_server': json_value(received_at_server)})
+    return payload
+
+def publish_live_events(event_type, payloads):
+    """
+    Pushes committed events to live stream clients: directly to this process's broadcaster, or via
+    pg_notify so the listener in every server process republishes them. Never fails the caller.
+    """
+    try:
+        if event_notify_bridge:
+            messages = [json.dumps({'type': event_type, 'payload': payload}) for payload in payloads]
+            db.session.execute(db.text("SELECT pg_notify(:channel, message) FROM unnest(CAST(:messages AS text[])) AS message"),
+                               {'channel': EVENT_STREAM_PG_CHANNEL, 'messages': messages})
+            db.session.commit()
+        else:
+            for payload in payloads:
+                event_broadcaster.publish(event_type, payload)
+    except Exception as e:
+        db.session.rollback(); print(f"Error publishing live {event_type} events: {e}")
+
+def queue_alert_evaluation(source, rows, inserted, tag_assets):
+    """Hands committed events to the alert engine; returns immediately (evaluation runs on its workers)."""
+    if not alert_service: return
+    alert_events = []
+    for row, (event_id, received_at) in zip(rows, inserted):
+        tag_asset = tag_assets.get(row.get('tag_id'))
+        alert_events.append(AlertEvent(source, event_id, row['unit_id'], row.get('tag_id'), row.get('asset_id'),
+                                       tag_asset.is_active if tag_asset else None, tag_asset.asset_name if tag_asset else None,
+                                       row.get('direction'), row.get('event_time'), received_at))
+    alert_service.submit(alert_events)
+
+def record_fsma_events(source, rows, inserted, tag_assets):
+    """Adds FSMA KDE records for the events to the current transaction; call before committing the events."""
+    if not fsma_service: return
+    fsma_service.record_events(source, rows, inserted,
+                               {tag_id: tag_asset.asset_name for tag_id, tag_asset in tag_assets.items() if tag_asset})
+
+def record_asset_presence(source, rows, inserted):
+    """Upserts the assets' last sighting in the current transaction; call before committing the events."""
+    if not asset_presence_service: return
+    asset_presence_service.record_sightings(source, rows, inserted)
+
+# --- Helper for linking events to uploaded media ---
+EVENT_MEDIA_FIELDS = (('video_url_remote', 'video_sha256'), ('thumbnail_url', 'thumbnail_sha256'), ('proxy_url', 'proxy_sha256'))
+
+def event_media_urls(event_data):
+    """
+    Guardians name media by SHA-256 (video_sha256, thumbnail_sha256, proxy_sha256) when they
+    queue the event, before the uploads finish; the URLs are derived here so they stay valid
+    wherever the server is hosted. An explicit URL in the event still wins.
+    Returns {'video_url_remote': ..., 'thumbnail_url': ..., 'proxy_url': ...}.
+    """
+    urls = {}
+    for url_field, sha256_field in EVENT_MEDIA_FIELDS:
+        sha256 = event_data.get(sha256_field)
+        if event_data.get(url_field) or not isinstance(sha256, str) or not SHA256_PATTERN.match(sha256):
+            urls[url_field] = event_data.get(url_field)
+        else:
+            urls[url_field] = url_for('get_media', sha256=sha256)
+    return urls
+
+# --- Helper for resolving RFID tags to assets (cached) ---
+def invalidate_tag_assets(*tag_ids):
+    """
+    Drops the tags from the tag cache after an asset write: in this process directly and, with
+    pg_notify on, in every server process through the bridge. Without it other processes keep
+    their entry until its TTL ([Ingestion] tag_cache_ttl_seconds) runs out. Never fails the caller.
+    """
+    tag_asset_cache.invalidate(*tag_ids)
+    tag_ids = [tag_id for tag_id in tag_ids if tag_id]
+    if not event_notify_bridge or not tag_ids: return
+    try:
+        db.session.execute(db.text("SELECT pg_notify(:channel, :message)"),
+                           {'channel': EVENT_STREAM_PG_CHANNEL, 'message': json.dumps({'type': TAG_CACHE_INVALIDATE, 'payload': tag_ids})})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback(); print(f"Error relaying tag cache invalidation: {e}")
+
+def resolve_tag_assets(tag_ids):
+    """
+    Returns {tag_id: TagAsset or None} for the given tags. Cached tags (including cached
+    "no asset" results) skip the database; all remaining tags are resolved with one query.
+    rfid_tag_assigned is unique, so a tag maps to at most one asset, active or inactive.
+    """
+    resolved = {}
+    missing = []
+    for tag_id in set(tag_ids):
+        cached = tag_asset_cache.get(tag_id)
+        if cached is MISS:
+            missing.append(tag_id)
+        else:
+            resolved[tag_id] = cached
+    if missing:
+        asset_rows = db.session.query(Asset.id, Asset.rfid_tag_assigned, Asset.is_active, Asset.asset_name) \
+            .filter(Asset.rfid_tag_assigned.in_(missing)).all()
+        found = {tag: TagAsset(asset_id, is_active, asset_name) for asset_id, tag, is_active, asset_name in asset_rows}
+        for tag_id in missing:
+            resolved[tag_id] = found.get(tag_id)
+            tag_asset_cache.put(tag_id, resolved[tag_id])
+    return resolved
+
 # --- Routes ---
 @app.route('/')
 def index_page():
@@ -155,15 +602,37 @@ def create_asset():
     
     try:
         db.session.add(new_asset); db.session.commit()
+        invalidate_tag_assets(rfid_tag) # Drops a cached "unknown tag" entry
         return jsonify({"status": "success", "message": "Asset created", "asset": new_asset.to_dict()}), 201
     except Exception as e:
         db.session.rollback(); print(f"Error creating asset: {e}")
         return jsonify({"status": "error", "message": f"Could not create asset: {str(e)}"}), 500
 
+# Fields selectable with /api/assets?fields=..., in to_dict() order
+ASSET_LIST_FIELDS = ['id', 'asset_name', 'description', 'rfid_tag_assigned', 'asset_type', 'serial_number',
+                     'purchase_date', 'current_status', 'is_active', 'deleted_at', 'created_at', 'updated_at']
+
+def parse_asset_fields(value):
+    if not value: return list(ASSET_LIST_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in ASSET_LIST_FIELDS]
+    if unknown: raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
 @app.route('/api/assets', methods=['GET'])
 @jwt_required(optional=True) # Allow anonymous access but identify user if token present
 def get_assets():
+    """
+    Assets ordered by name, keyset-paginated on (asset_name, id).
+    Query params: include_deleted, asset_type, current_status, search, fields (comma separated
+    column names), limit, cursor. The next page cursor is returned in the X-Next-Cursor header.
+    """
     try:
+        # Inserts and soft deletes both bump updated_at, so max(updated_at) covers every change
+        etag = watermark_etag(db.session.query(db.func.max(Asset.updated_at)).scalar())
+        if etag_matches(etag):
+            return not_modified(etag)
+
         include_deleted = str_to_bool(request.args.get('include_deleted', 'false'))
         query = Asset.query
         if not include_deleted:
@@ -180,13 +649,68 @@ def get_assets():
         #          query = query.filter_by(is_active=True)
 
 
-        assets_query = query.order_by(Asset.asset_name).all() # Add pagination later
-        assets_list = [asset.to_dict() for asset in assets_query]
-        return jsonify(assets_list), 200
+        if request.args.get('asset_type'):
+            query = query.filter(Asset.asset_type == request.args.get('asset_type'))
+        if request.args.get('current_status'):
+            query = query.filter(Asset.current_status == request.args.get('current_status'))
+        if request.args.get('search'): # Substring match on name, tag or serial (trigram-indexed)
+            pattern = f"%{request.args.get('search')}%"
+            query = query.filter(Asset.asset_name.ilike(pattern) | Asset.rfid_tag_assigned.ilike(pattern) |
+                                 Asset.serial_number.ilike(pattern))
+        if request.args.get('cursor'):
+            cursor_name, cursor_id = decode_cursor(request.args.get('cursor'))
+            query = query.filter(db.tuple_(Asset.asset_name, Asset.id) > (cursor_name, int(cursor_id)))
+
+        # Select only the requested columns (plus the sort key) instead of hydrating full Asset objects
+        fields = parse_asset_fields(request.args.get('fields'))
+        selected_columns = list(dict.fromkeys(fields + ['asset_name', 'id']))
+        limit = parse_limit(request.args.get('limit'), ASSETS_PAGE_DEFAULT_LIMIT, ASSETS_PAGE_MAX_LIMIT)
+        rows = query.with_entities(*[getattr(Asset, name) for name in selected_columns]) \
+            .order_by(Asset.asset_name, Asset.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        assets_list = [{name: json_value(getattr(row, name)) for name in fields} for row in rows]
+        response = jsonify(assets_list)
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_cursor(rows[-1].asset_name, rows[-1].id)
+        return with_etag(response, etag), 200
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
     except Exception as e:
         print(f"Error fetching assets: {e}")
         return jsonify({"status": "error", "message": "Could not fetch assets"}), 500
 
+@app.route('/api/assets/presence', methods=['GET'])
+@jwt_required(optional=True)
+def get_asset_presence():
+    """
+    Current state of the yard: for every asset seen so far, where and when it was last seen
+    and its last gate crossing (last_direction 'egress' = out of the yard), ordered by asset id.
+    Query params: direction (ingress|egress), unit_id, asset_type, include_deleted.
+    Served from asset_presence (maintained at ingest) in one query; no event table is read.
+    """
+    try:
+        etag = watermark_etag(asset_presence_service.watermark(), db.session.query(db.func.max(Asset.updated_at)).scalar())
+        if etag_matches(etag):
+            return not_modified(etag)
+    except Exception as e:
+        print(f"Error fetching asset presence: {e}")
+        return jsonify({"status": "error", "message": "Could not fetch asset presence"}), 500
+
+    direction = request.args.get('direction')
+    if direction and direction not in GATE_DIRECTIONS:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: direction must be one of {', '.join(GATE_DIRECTIONS)}"}), 400
+    try:
+        statement = asset_presence_service.current_state(
+            Asset, direction=direction, unit_id=request.args.get('unit_id'), asset_type=request.args.get('asset_type'),
+            include_deleted=str_to_bool(request.args.get('include_deleted', 'false')))
+        field_names = PRESENCE_FIELDS + ['asset_name', 'asset_type', 'is_active']
+        presence_list = [dict(zip(field_names, map(json_value, row))) for row in db.session.execute(statement)]
+        return with_etag(jsonify(presence_list), etag), 200
+    except Exception as e:
+        print(f"Error fetching asset presence: {e}")
+        return jsonify({"status": "error", "message": "Could not fetch asset presence"}), 500
+
 @app.route('/api/assets/<int:asset_id>', methods=['GET'])
 @jwt_required(optional=True)
 def get_asset(asset_id):
@@ -196,10 +720,18 @@ def get_asset(asset_id):
         if not include_deleted:
             query = query.filter_by(is_active=True)
         
-        asset = query.filter_by(id=asset_id).first()
+        query = query.filter_by(id=asset_id)
+        updated_at_row = query.with_entities(Asset.updated_at).first()
+        if not updated_at_row:
+            return jsonify({"status": "error", "message": "Asset not found or not active"}), 404
+        etag = watermark_etag(asset_id, updated_at_row.updated_at)
+        if etag_matches(etag):
+            return not_modified(etag)
+
+        asset = query.first()
         if not asset:
             return jsonify({"status": "error", "message": "Asset not found or not active"}), 404
-        return jsonify(asset.to_dict()), 200
+        return with_etag(jsonify(asset.to_dict()), etag), 200
     except Exception as e:
         print(f"Error fetching asset {asset_id}: {e}")
         return jsonify({"status": "error", "message": "Could not fetch asset"}), 500
@@ -225,6 +757,7 @@ def update_asset(asset_id):
         if existing_serial:
             return jsonify({"status": "error", "message": f"Serial number {data['serial_number']} already exists."}), 409
 
+    previous_rfid_tag = asset.rfid_tag_assigned
     asset.asset_name = data.get('asset_name', asset.asset_name)
     asset.description = data.get('description', asset.description)
     asset.rfid_tag_assigned = data.get('rfid_tag_assigned', asset.rfid_tag_assigned)
@@ -246,6 +779,7 @@ def update_asset(asset_id):
     
     try:
         db.session.commit()
+        invalidate_tag_assets(previous_rfid_tag, asset.rfid_tag_assigned)
         return jsonify({"status": "success", "message": "Asset updated", "asset": asset.to_dict()}), 200
     except Exception as e:
         db.session.rollback(); print(f"Error updating asset {asset_id}: {e}")
@@ -265,6 +799,7 @@ def delete_asset(asset_id): # Soft delete
         asset.is_active = False
         asset.deleted_at = datetime.now(timezone.utc)
         db.session.commit()
+        invalidate_tag_assets(asset.rfid_tag_assigned)
         return jsonify({"status": "success", "message": "Asset marked as deleted (soft delete)"}), 200
     except Exception as e:
         db.session.rollback(); print(f"Error soft deleting asset {asset_id}: {e}")
@@ -282,56 +817,835 @@ def handle_guardian_event():
     event_data = data.get('event', {})
     timestamp_iso = event_data.get('timestamp_iso')
     tag_id = event_data.get('tag_id')
-    video_url_remote = event_data.get('video_url_remote')
+    media_urls = event_media_urls(event_data)
     direction = event_data.get('direction')
     raw_payload_to_store = event_data
 
     if not all([unit_id, timestamp_iso, tag_id]):
         return jsonify({"status": "error", "message": "Missing required fields: unit_id, event.timestamp_iso, event.tag_id"}), 400
+    try:
+        event_time = parse_event_time(timestamp_iso)
+    except ValueError:
+        return jsonify({"status": "error", "message": "event.timestamp_iso is not an ISO 8601 timestamp"}), 400
+    lot_error = lot_code_error(event_data) if fsma_service else None
+    if lot_error:
+        return jsonify({"status": "error", "message": lot_error}), 400
+    field_errors = column_value_errors(GuardianEvent, {'unit_id': unit_id, 'timestamp_iso': timestamp_iso, 'tag_id': tag_id,
+                                                      'direction': direction, **media_urls})
+    if field_errors:
+        return jsonify({"status": "error", "message": "; ".join(field_errors)}), 400
 
     linked_asset_id = None
-    associated_asset = Asset.query.filter_by(rfid_tag_assigned=tag_id, is_active=True).first() 
-    if associated_asset:
-        linked_asset_id = associated_asset.id
-        print(f"Event for tag {tag_id} linked to active asset ID {linked_asset_id} ({associated_asset.asset_name})")
+    tag_asset = resolve_tag_assets([tag_id])[tag_id]
+    if tag_asset and tag_asset.is_active:
+        linked_asset_id = tag_asset.asset_id
+        print(f"Event for tag {tag_id} linked to active asset ID {linked_asset_id} ({tag_asset.asset_name})")
+    elif tag_asset:
+        linked_asset_id = tag_asset.asset_id # Link to inactive asset
+        print(f"Event for tag {tag_id} linked to INACTIVE asset ID {linked_asset_id} ({tag_asset.asset_name})")
     else:
-        # Optional: Check if an inactive asset has this tag and link if desired, or log differently
-        inactive_asset_with_tag = Asset.query.filter_by(rfid_tag_assigned=tag_id, is_active=False).first()
-        if inactive_asset_with_tag:
-            linked_asset_id = inactive_asset_with_tag.id # Link to inactive asset
-            print(f"Event for tag {tag_id} linked to INACTIVE asset ID {linked_asset_id} ({inactive_asset_with_tag.asset_name})")
-        else:
-            print(f"No asset (active or inactive) found with RFID tag {tag_id}. Event will be unlinked.")
-            # TODO: Trigger "Unknown Tag" alert here via AlertService
+        print(f"No asset (active or inactive) found with RFID tag {tag_id}. Event will be unlinked.")
+        # The "Unknown Tag" alert is raised by the alert engine (unknown_tag rule), off this request
 
     try:
         new_event = GuardianEvent(
-            unit_id=unit_id, timestamp_iso=timestamp_iso, tag_id=tag_id, asset_id=linked_asset_id,
-            video_url_remote=video_url_remote, direction=direction, raw_event_payload=raw_payload_to_store
+            unit_id=unit_id, timestamp_iso=timestamp_iso, event_time=event_time, tag_id=tag_id, asset_id=linked_asset_id,
+            direction=direction, raw_event_payload=raw_payload_to_store, **media_urls
         )
         db.session.add(new_event)
+        db.session.flush() # Assigns id and received_at for the FSMA record, written in the same transaction
+        event_fields = {'unit_id': unit_id, 'timestamp_iso': timestamp_iso, 'event_time': event_time, 'tag_id': tag_id,
+                        'asset_id': linked_asset_id, 'direction': direction, **media_urls}
+        record_fsma_events('guardian', [dict(event_fields, raw_event_payload=raw_payload_to_store)],
+                           [(new_event.id, new_event.received_at)], {tag_id: tag_asset})
+        record_asset_presence('guardian', [event_fields], [(new_event.id, new_event.received_at)])
         db.session.commit()
+        publish_live_events('guardian', [guardian_stream_payload(new_event.id, new_event.received_at, event_fields, tag_asset)])
+        queue_alert_evaluation('guardian', [event_fields], [(new_event.id, new_event.received_at)], {tag_id: tag_asset})
         return jsonify({"status": "success", "message": "Guardian event received and stored", 
                         "event_id": new_event.id, "linked_asset_id": linked_asset_id}), 201
     except Exception as e:
         db.session.rollback(); print(f"Error storing guardian event: {e}")
         return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
 
+@app.route('/api/guardian_events/batch', methods=['POST'])
+@jwt_required(optional=True)
+def handle_guardian_events_batch():
+    """
+    Accepts a JSON array of Guardian events, each shaped like the single-event payload
+    ({"unit_id": ..., "event": {...}}). Tag links are resolved with one query and all valid
+    rows are written in one multi-row INSERT / single transaction. Invalid items are reported
+    per index and do not block the rest of the batch.
+    """
+    data = request.json
+    if not isinstance(data, list):
+        return jsonify({"status": "error", "message": "Expected a JSON array of events"}), 400
+    if not data:
+        return jsonify({"status": "error", "message": "No events provided"}), 400
+    if len(data) > GUARDIAN_BATCH_MAX_EVENTS:
+        return jsonify({"status": "error", "message": f"Batch too large (max {GUARDIAN_BATCH_MAX_EVENTS} events)"}), 413
+
+    results = [None] * len(data)
+    rows = []
+    row_indexes = [] # Index into `data` for each row in `rows`
+    for index, item in enumerate(data):
+        event_data = item.get('event') if isinstance(item, dict) else None
+        if not isinstance(event_data, dict):
+            results[index] = {"index": index, "status": "error", "message": "Missing event object"}
+            continue
+        unit_id = item.get('unit_id')
+        timestamp_iso = event_data.get('timestamp_iso')
+        tag_id = event_data.get('tag_id')
+        if not all([unit_id, timestamp_iso, tag_id]):
+            results[index] = {"index": index, "status": "error",
+                              "message": "Missing required fields: unit_id, event.timestamp_iso, event.tag_id"}
+            continue
+        try:
+            event_time = parse_event_time(timestamp_iso)
+        except ValueError:
+            results[index] = {"index": index, "status": "error", "message": "event.timestamp_iso is not an ISO 8601 timestamp"}
+            continue
+        lot_error = lot_code_error(event_data) if fsma_service else None
+        if lot_error: # Would fail the FSMA insert, and with it the whole batch's transaction
+            results[index] = {"index": index, "status": "error", "message": lot_error}
+            continue
+        row = {
+            'unit_id': unit_id, 'timestamp_iso': timestamp_iso, 'event_time': event_time, 'tag_id': tag_id,
+            'direction': event_data.get('direction'),
+            'raw_event_payload': event_data, **event_media_urls(event_data)
+        }
+        field_errors = column_value_errors(GuardianEvent, row)
+        if field_errors: # Would fail the multi-row INSERT, and with it the whole batch
+            results[index] = {"index": index, "status": "error", "message": "; ".join(field_errors)}
+            continue
+        rows.append(row)
+        row_indexes.append(index)
+
+    if rows:
+        # At most one lookup for every distinct uncached tag in the batch
+        tag_assets = resolve_tag_assets(row['tag_id'] for row in rows)
+        for row in rows:
+            tag_asset = tag_assets[row['tag_id']]
+            row['asset_id'] = tag_asset.asset_id if tag_asset else None
+
+        try:
+            insert_stmt = db.insert(GuardianEvent).returning(GuardianEvent.id, GuardianEvent.received_at,
+                                                             sort_by_parameter_order=True)
+            inserted = db.session.execute(insert_stmt, rows).all()
+            record_fsma_events('guardian', rows, inserted, tag_assets)
+            record_asset_presence('guardian', rows, inserted)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback(); print(f"Error storing guardian event batch: {e}")
+            return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
+
+        for index, row, (event_id, received_at) in zip(row_indexes, rows, inserted):
+            results[index] = {"index": index, "status": "success", "event_id": event_id, "linked_asset_id": row['asset_id']}
+        publish_live_events('guardian', [guardian_stream_payload(event_id, received_at, row, tag_assets[row['tag_id']])
+                                         for row, (event_id, received_at) in zip(rows, inserted)])
+        queue_alert_evaluation('guardian', rows, inserted, tag_assets)
+
+    stored_count = len(rows)
+    print(f"Guardian event batch: {stored_count} stored, {len(data) - stored_count} rejected")
+    if stored_count == len(data): status_code = 201
+    elif stored_count: status_code = 207 # Partial success, see per-item results
+    else: status_code = 400
+    return jsonify({"status": "success" if stored_count else "error", "stored": stored_count,
+                    "rejected": len(data) - stored_count, "results": results}), status_code
+
 @app.route('/api/events', methods=['GET'])
 @jwt_required(optional=True)
 def get_all_events():
+    """
+    Guardian events, newest first, keyset-paginated on (received_at, id).
+    Query params: unit_id, tag_id, asset_id, direction, since/until (ISO 8601, on received_at),
+    event_since/event_until (ISO 8601, on the device's event_time), limit, cursor. The body is the list of events; when more rows exist the cursor for the next
+    page is returned in the X-Next-Cursor header. Each page is an index range scan, so deep
+    pages cost the same as the first one (no OFFSET).
+    """
     try:
-        # TODO: Add filters for asset_id, unit_id, date range, etc.
-        events_query = GuardianEvent.query.order_by(GuardianEvent.received_at.desc()).limit(100).all()
+        # Events are append-only, so max(id) changes whenever a page could; asset_info also
+        # embeds asset fields, so asset changes count too. New events are received now, so only
+        # the current and previous month's partitions need to be looked at for max(id).
+        recent_floor = month_start(datetime.utcnow(), -1)
+        etag = watermark_etag(*db.session.query(
+            db.select(db.func.max(GuardianEvent.id)).where(GuardianEvent.received_at >= recent_floor).scalar_subquery(),
+            db.select(db.func.max(Asset.updated_at)).scalar_subquery()).one())
+        if etag_matches(etag):
+            return not_modified(etag)
+    except Exception as e:
+        print(f"Error fetching events: {e}")
+        return jsonify({"status": "error", "message": "Could not fetch events"}), 500
+
+    try:
+        limit = parse_limit(request.args.get('limit'), EVENTS_PAGE_DEFAULT_LIMIT, EVENTS_PAGE_MAX_LIMIT)
+        # to_dict() reads event.asset; load it in the same SELECT so a page is one query, not 1 + N
+        query = GuardianEvent.query.options(event_asset_info_load(GuardianEvent))
+        for field in ('unit_id', 'tag_id', 'direction'):
+            if request.args.get(field):
+                query = query.filter(getattr(GuardianEvent, field) == request.args.get(field))
+        if request.args.get('asset_id'):
+            query = query.filter(GuardianEvent.asset_id == int(request.args.get('asset_id')))
+        since = parse_iso_datetime(request.args.get('since')) if request.args.get('since') else None
+        until = parse_iso_datetime(request.args.get('until')) if request.args.get('until') else None
+        if since:
+            query = query.filter(GuardianEvent.received_at >= since)
+        if until:
+            query = query.filter(GuardianEvent.received_at < until)
+        if request.args.get('event_since'):
+            query = query.filter(GuardianEvent.event_time >= parse_event_time(request.args.get('event_since')))
+        if request.args.get('event_until'):
+            query = query.filter(GuardianEvent.event_time < parse_event_time(request.args.get('event_until')))
+        if request.args.get('cursor'):
+            cursor_received_at, cursor_id = decode_cursor(request.args.get('cursor'))
+            query = query.filter(db.tuple_(GuardianEvent.received_at, GuardianEvent.id) <
+                                 (datetime.fromisoformat(cursor_received_at), int(cursor_id)))
+            until = min(until, parse_iso_datetime(cursor_received_at) + timedelta(microseconds=1)) if until \
+                else parse_iso_datetime(cursor_received_at) + timedelta(microseconds=1)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+
+    try:
+        # Walk the monthly partitions newest first, one pruned query each, until the page is full.
+        # Fetch one extra row to know whether another page exists.
+        events_query = []
+        windows = event_partitions.time_windows('guardian_events') if event_partitions else [(None, None)]
+        for window_from, window_until in windows:
+            if (since and window_until and window_until <= since) or len(events_query) > limit:
+                break
+            if until and window_from and window_from >= until:
+                continue
+            window_query = query
+            if window_from: window_query = window_query.filter(GuardianEvent.received_at >= window_from)
+            if window_until: window_query = window_query.filter(GuardianEvent.received_at < window_until)
+            events_query += window_query.order_by(GuardianEvent.received_at.desc(), GuardianEvent.id.desc()) \
+                .limit(limit + 1 - len(events_query)).all()
+        has_more = len(events_query) > limit
+        events_query = events_query[:limit]
         event_list = [event.to_dict() for event in events_query]
-        return jsonify(event_list), 200
+        response = jsonify(event_list)
+        if has_more:
+            last_event = events_query[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last_event.received_at, last_event.id)
+        return with_etag(response, etag), 200
     except Exception as e:
         print(f"Error fetching events: {e}")
         return jsonify({"status": "error", "message": "Could not fetch events"}), 500
 
-# TODO: Add SubUnitEvent ingestion endpoint /api/lorawan_uplink
-# TODO: Add Alert endpoints
-# TODO: Add FSMA related endpoints
+@app.route('/api/events/stream', methods=['GET'])
+@jwt_required(optional=True)
+def stream_events():
+    """
+    Server-sent events feed of newly ingested events ('guardian' and 'subunit' event types, data
+    shaped like the /api/events items). All clients are served from one in-process broadcaster, so
+    viewers cost no database queries. Each open stream holds a worker thread/greenlet, so run
+    with a threaded or gevent server for many viewers. Supports Last-Event-ID resume.
+    """
+    if event_notify_bridge:
+        event_notify_bridge.ensure_started(db.engine)
+    last_event_id = request.headers.get('Last-Event-ID')
+    after_seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else event_broadcaster.latest_seq()
+
+    def generate():
+        seq = after_seq
+        event_broadcaster.add_subscriber()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                seq, messages = event_broadcaster.wait_for_messages(seq, EVENT_STREAM_KEEPALIVE_SECONDS)
+                if messages:
+                    yield ''.join(messages)
+                else:
+                    yield ": keepalive\n\n" # Also how a disconnected client gets noticed
+        finally:
+            event_broadcaster.remove_subscriber()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Columns written by /api/events/export, per source table, the (time, id) sort key used for each and the device time column
+EVENT_EXPORT_SOURCES = {
+    'guardian': (GuardianEvent, GuardianEvent.received_at, GuardianEvent.event_time,
+                 ['id', 'unit_id', 'timestamp_iso', 'event_time', 'tag_id', 'asset_id', 'video_url_remote', 'thumbnail_url', 'proxy_url', 'direction',
+                  'raw_event_payload', 'received_at']),
+    'subunit': (SubUnitEvent, SubUnitEvent.received_at_server, SubUnitEvent.reported_at_device,
+                ['id', 'unit_id', 'tag_id', 'asset_id', 'location_description', 'battery_level_mv', 'rssi', 'snr',
+                 'raw_lorawan_payload', 'reported_at_device', 'received_at_server']),
+}
+
+@app.route('/api/events/export', methods=['GET'])
+@jwt_required()
+def export_events():
+    """
+    Streams events as NDJSON (default) or CSV for bulk/audit export.
+    Query params: source=guardian|subunit, format=ndjson|csv, unit_id, tag_id, asset_id, since/until (ISO 8601,
+    on the receive time), event_since/event_until (ISO 8601, on the device time: event_time / reported_at_device).
+    Rows come from a server-side cursor (yield_per) as plain tuples, without ORM hydration, and are
+    written out chunk by chunk, so memory stays flat no matter how many rows match.
+    """
+    source = request.args.get('source', 'guardian')
+    export_format = request.args.get('format', 'ndjson')
+    if source not in EVENT_EXPORT_SOURCES:
+        return jsonify({"status": "error", "message": f"Unknown source '{source}'. Use guardian or subunit."}), 400
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"status": "error", "message": f"Unknown format '{export_format}'. Use ndjson or csv."}), 400
+
+    model, time_column, device_time_column, field_names = EVENT_EXPORT_SOURCES[source]
+    statement = db.select(*[getattr(model, name) for name in field_names])
+    try:
+        for field in ('unit_id', 'tag_id'):
+            if request.args.get(field):
+                statement = statement.where(getattr(model, field) == request.args.get(field))
+        if request.args.get('asset_id'):
+            statement = statement.where(model.asset_id == int(request.args.get('asset_id')))
+        if request.args.get('since'):
+            statement = statement.where(time_column >= parse_iso_datetime(request.args.get('since')))
+        if request.args.get('until'):
+            statement = statement.where(time_column < parse_iso_datetime(request.args.get('until')))
+        if request.args.get('event_since'):
+            statement = statement.where(device_time_column >= parse_event_time(request.args.get('event_since')))
+        if request.args.get('event_until'):
+            statement = statement.where(device_time_column < parse_event_time(request.args.get('event_until')))
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+    statement = statement.order_by(time_column, model.id).execution_options(yield_per=EXPORT_YIELD_PER)
+
+    def generate_rows():
+        result = db.session.execute(statement)
+        try:
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(field_names)
+                for partition in result.partitions():
+                    for row in partition:
+                        writer.writerow([json.dumps(v) if isinstance(v, (dict, list)) else json_value(v) for v in row])
+                    yield buffer.getvalue()
+                    buffer.seek(0); buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                for partition in result.partitions():
+                    yield ''.join(json.dumps(dict(zip(field_names, map(json_value, row)))) + '\n' for row in partition)
+        finally:
+            result.close()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"{source}_events.{'csv' if export_format == 'csv' else 'ndjson'}"
+    return Response(stream_with_context(generate_rows()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/cache/tag_assets', methods=['GET'])
+@jwt_required()
+def get_tag_asset_cache_stats():
+    return jsonify(tag_asset_cache.stats()), 200
+
+@app.route('/api/events/stream/stats', methods=['GET'])
+@jwt_required()
+def get_event_stream_stats():
+    return jsonify(event_broadcaster.stats()), 200
+
+# --- LoRaWAN SubUnit Ingestion ---
+def _parse_ttn_uplink(uplink):
+    """
+    Extracts (unit_id, frm_payload_b64, f_port, rssi, snr, reported_at) from a The Things Stack v3
+    uplink webhook message. RSSI/SNR come from the gateway that heard the frame best.
+    """
+    device_ids = uplink.get('end_device_ids') or {}
+    message = uplink.get('uplink_message') or {}
+    unit_id = device_ids.get('device_id') or device_ids.get('dev_eui')
+    frm_payload = message.get('frm_payload')
+    if not unit_id or not frm_payload:
+        raise ValueError("Missing end_device_ids.device_id or uplink_message.frm_payload")
+    rx_metadata = [rx for rx in message.get('rx_metadata') or [] if rx.get('rssi') is not None]
+    best_rx = max(rx_metadata, key=lambda rx: rx['rssi']) if rx_metadata else {}
+    reported_at = None
+    network_time = message.get('received_at') or uplink.get('received_at')
+    if network_time:
+        try: reported_at = parse_iso_datetime(network_time)
+        except ValueError: pass
+    return unit_id, frm_payload, message.get('f_port'), best_rx.get('rssi'), best_rx.get('snr'), reported_at
+
+@app.route('/api/lorawan_uplink', methods=['POST'])
+def handle_lorawan_uplink():
+    """
+    Network server webhook for SubUnit uplinks. Accepts one TTS v3 uplink message or an array of
+    them. Each binary payload is decoded (services/subunit_payload.py) into one SubUnitEvent per tag
+    read, or a single tagless row for a heartbeat. Tags are resolved to assets in bulk and all rows
+    are written with one multi-row INSERT. Returns per-uplink results.
+    """
+    if LORAWAN_WEBHOOK_SECRET and request.headers.get('X-Webhook-Secret') != LORAWAN_WEBHOOK_SECRET:
+        return jsonify({"status": "error", "message": "Invalid webhook secret"}), 401
+    data = request.json
+    uplinks = data if isinstance(data, list) else [data] if isinstance(data, dict) else None
+    if not uplinks:
+        return jsonify({"status": "error", "message": "No uplink data provided"}), 400
+    if len(uplinks) > LORAWAN_UPLINK_MAX_BATCH:
+        return jsonify({"status": "error", "message": f"Batch too large (max {LORAWAN_UPLINK_MAX_BATCH} uplinks)"}), 413
+
+    results = [None] * len(uplinks)
+    rows = []
+    rows_per_uplink = [] # (uplink index, number of rows) in `rows` order
+    for index, uplink in enumerate(uplinks):
+        try:
+            if not isinstance(uplink, dict): raise ValueError("Uplink must be an object")
+            unit_id, frm_payload, f_port, rssi, snr, reported_at = _parse_ttn_uplink(uplink)
+            if f_port != LORAWAN_SUBUNIT_FPORT:
+                results[index] = {"index": index, "status": "ignored", "message": f"f_port {f_port} is not a SubUnit port"}
+                continue
+            decoded = decode_subunit_payload(base64.b64decode(frm_payload, validate=True))
+        except (ValueError, TypeError) as e: # PayloadDecodeError and binascii.Error are ValueErrors
+            results[index] = {"index": index, "status": "error", "message": str(e)}
+            continue
+        common = {'unit_id': unit_id, 'location_description': None, 'battery_level_mv': decoded.battery_mv,
+                  'rssi': rssi, 'snr': snr, 'raw_lorawan_payload': frm_payload, 'reported_at_device': reported_at}
+        tag_ids = [tag.tag_id for tag in decoded.tags] or [None] # A tagless uplink is a heartbeat/battery report
+        rows.extend(dict(common, tag_id=tag_id) for tag_id in tag_ids)
+        rows_per_uplink.append((index, len(tag_ids)))
+
+    if rows:
+        tag_assets = resolve_tag_assets(row['tag_id'] for row in rows if row['tag_id'])
+        for row in rows:
+            tag_asset = tag_assets.get(row['tag_id'])
+            row['asset_id'] = tag_asset.asset_id if tag_asset else None
+        try:
+            insert_stmt = db.insert(SubUnitEvent).returning(SubUnitEvent.id, SubUnitEvent.received_at_server,
+                                                            sort_by_parameter_order=True)
+            inserted = db.session.execute(insert_stmt, rows).all()
+            record_fsma_events('subunit', rows, inserted, tag_assets)
+            record_asset_presence('subunit', rows, inserted)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback(); print(f"Error storing LoRaWAN uplinks: {e}")
+            return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
+
+        position = 0
+        for index, row_count in rows_per_uplink:
+            event_ids = [event_id for event_id, _ in inserted[position:position + row_count]]
+            results[index] = {"index": index, "status": "success", "event_ids": event_ids}
+            position += row_count
+        publish_live_events('subunit', [subunit_stream_payload(event_id, received_at, row, tag_assets.get(row['tag_id']))
+                                        for row, (event_id, received_at) in zip(rows, inserted)])
+        queue_alert_evaluation('subunit', rows, inserted, tag_assets)
+
+    stored_count = sum(1 for result in results if result['status'] == 'success')
+    failed_count = sum(1 for result in results if result['status'] == 'error')
+    print(f"LoRaWAN uplinks: {stored_count} stored ({len(rows)} events), {failed_count} rejected")
+    if not failed_count: status_code = 201
+    elif stored_count: status_code = 207 # Partial success, see per-uplink results
+    else: status_code = 400
+    return jsonify({"status": "error" if failed_count and not stored_count else "success", "stored": stored_count,
+                    "rejected": failed_count, "events_stored": len(rows), "results": results}), status_code
+
+# --- Media Upload API Endpoints ---
+# Resumable, content-addressed uploads: POST declares the file (by SHA-256) and returns the
+# offset to continue from (or that the server already has it), PATCH appends one chunk at
+# Upload-Offset, HEAD reports the current offset. See services/media_store.py.
+def media_upload_response(media_file, offset, deduplicated=False):
+    complete = media_file.status == 'complete'
+    response = jsonify({"status": "success", "upload_id": media_file.sha256, "offset": media_file.size_bytes if complete else offset,
+                        "size_bytes": media_file.size_bytes, "complete": complete, "deduplicated": deduplicated,
+                        "media_url": url_for('get_media', sha256=media_file.sha256) if complete else None})
+    response.headers['Upload-Offset'] = str(media_file.size_bytes if complete else offset)
+    return response
+
+@app.route('/api/media/uploads', methods=['POST'])
+@jwt_required(optional=True) # Guardians post unauthenticated, like events
+def create_media_upload():
+    data = request.json
+    if not data: return jsonify({"status": "error", "message": "No data provided"}), 400
+    sha256 = str(data.get('sha256', '')).lower()
+    size_bytes = data.get('size_bytes')
+    if not SHA256_PATTERN.match(sha256):
+        return jsonify({"status": "error", "message": "sha256 must be 64 hex characters"}), 400
+    if not isinstance(size_bytes, int) or size_bytes <= 0:
+        return jsonify({"status": "error", "message": "size_bytes must be a positive integer"}), 400
+    if size_bytes > MEDIA_MAX_FILE_BYTES:
+        return jsonify({"status": "error", "message": f"File too large (max {MEDIA_MAX_FILE_BYTES} bytes)"}), 413
+
+    media_file = MediaFile.query.filter_by(sha256=sha256).first()
+    if media_file and media_file.status == 'complete':
+        return media_upload_response(media_file, media_file.size_bytes, deduplicated=True), 200
+    if media_file and media_file.size_bytes != size_bytes:
+        return jsonify({"status": "error", "message": "An upload with this sha256 and a different size is in progress"}), 409
+    if not media_file:
+        try:
+            media_file = MediaFile(sha256=sha256, size_bytes=size_bytes, unit_id=data.get('unit_id'),
+                                   content_type=data.get('content_type'), original_filename=data.get('filename'))
+            db.session.add(media_file)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback() # Another request created it first; resume that upload
+            print(f"Media upload {sha256} created concurrently: {e}")
+            media_file = MediaFile.query.filter_by(sha256=sha256).first()
+            if not media_file:
+                return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
+    return media_upload_response(media_file, media_store.partial_size(sha256)), 200
+
+@app.route('/api/media/uploads/<sha256>', methods=['HEAD'])
+def get_media_upload_offset(sha256):
+    media_file = MediaFile.query.filter_by(sha256=sha256).first()
+    if not media_file: abort(404)
+    response = Response(status=200)
+    response.headers['Upload-Offset'] = str(media_file.size_bytes if media_file.status == 'complete' else media_store.partial_size(sha256))
+    response.headers['Upload-Length'] = str(media_file.size_bytes)
+    return response
+
+@app.route('/api/media/uploads/<sha256>', methods=['PATCH'])
+@jwt_required(optional=True)
+def append_media_upload(sha256):
+    """
+    Appends the raw request body (application/offset+octet-stream) at the Upload-Offset header.
+    The body is streamed to disk block by block, never held in memory as a whole.
+    409 means the offset is stale (a previous chunk did land); the body carries the real offset.
+    """
+    media_file = MediaFile.query.filter_by(sha256=sha256).first()
+    if not media_file:
+        return jsonify({"status": "error", "message": "Unknown upload; POST /api/media/uploads first"}), 404
+    if media_file.status == 'complete':
+        return media_upload_response(media_file, media_file.size_bytes, deduplicated=True), 200
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Missing or invalid Upload-Offset header"}), 400
+    if request.content_length is None:
+        return jsonify({"status": "error", "message": "Content-Length is required"}), 411
+    if request.content_length > MEDIA_CHUNK_MAX_BYTES:
+        return jsonify({"status": "error", "message": f"Chunk too large (max {MEDIA_CHUNK_MAX_BYTES} bytes)"}), 413
+
+    try:
+        new_offset = media_store.append_chunk(sha256, offset, request.stream, media_file.size_bytes)
+    except OffsetMismatch as e:
+        response = jsonify({"status": "error", "message": str(e), "offset": e.offset})
+        response.headers['Upload-Offset'] = str(e.offset)
+        return response, 409
+    except UploadTooLarge as e:
+        return jsonify({"status": "error", "message": str(e)}), 413
+    if new_offset < media_file.size_bytes:
+        return media_upload_response(media_file, new_offset), 200
+
+    try:
+        extension = os.path.splitext(media_file.original_filename or '')[1].lower()[:10]
+        media_file.storage_path = media_store.finalize(sha256, extension)
+        media_file.status = 'complete'
+        media_file.completed_at = datetime.utcnow()
+        db.session.commit()
+    except DigestMismatch as e:
+        db.session.rollback()
+        print(f"Media upload {sha256} failed verification: {e}")
+        return jsonify({"status": "error", "message": f"{e}. Upload discarded; start again from offset 0", "offset": 0}), 422
+    except Exception as e:
+        db.session.rollback(); print(f"Error completing media upload {sha256}: {e}")
+        return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
+    print(f"Media upload complete: {sha256} ({media_file.size_bytes} bytes) from {media_file.unit_id}")
+    try:
+        MediaRequest.query.filter_by(sha256=sha256).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback(); print(f"Error clearing media request for {sha256}: {e}")
+    return media_upload_response(media_file, new_offset), 201
+
+@app.route('/api/media/<sha256>', methods=['GET'])
+@jwt_required(optional=True)
+def get_media(sha256):
+    media_file = MediaFile.query.filter_by(sha256=sha256, status='complete').first()
+    if not media_file: abort(404)
+    # conditional=True answers Range requests, so the dashboard's video player can seek
+    return send_file(media_store.full_path(media_file.storage_path), mimetype=media_file.content_type,
+                     conditional=True, max_age=31536000) # Content-addressed, so it never changes
+
+@app.route('/api/media/<sha256>/request', methods=['POST'])
+@jwt_required(optional=True)
+def request_media_upload(sha256):
+    """
+    Asks the Guardian unit that recorded a clip to upload its full-resolution original now,
+    instead of waiting for an idle link. Body: {"unit_id": ...}.
+    """
+    if not SHA256_PATTERN.match(sha256):
+        return jsonify({"status": "error", "message": "Invalid sha256"}), 400
+    if MediaFile.query.filter_by(sha256=sha256, status='complete').first():
+        return jsonify({"status": "success", "message": "Already uploaded", "media_url": url_for('get_media', sha256=sha256)}), 200
+    unit_id = (request.get_json(silent=True) or {}).get('unit_id')
+    if not unit_id:
+        return jsonify({"status": "error", "message": "Missing required field: unit_id"}), 400
+    try:
+        if not db.session.get(MediaRequest, sha256):
+            db.session.add(MediaRequest(sha256=sha256, unit_id=unit_id))
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback(); print(f"Error requesting media {sha256}: {e}")
+        return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
+    return jsonify({"status": "success", "message": f"Upload requested from {unit_id}"}), 202
+
+@app.route('/api/media/requests', methods=['GET'])
+@jwt_required(optional=True)
+def get_media_requests():
+    """Polled by Guardian units: SHA-256s of originals users are waiting for."""
+    unit_id = request.args.get('unit_id')
+    if not unit_id:
+        return jsonify({"status": "error", "message": "Missing required parameter: unit_id"}), 400
+    requested = db.session.execute(db.select(MediaRequest.sha256).filter_by(unit_id=unit_id)
+                                   .order_by(MediaRequest.requested_at)).scalars().all()
+    return jsonify({"status": "success", "sha256": requested}), 200
+
+# --- Alert API Endpoints ---
+@app.route('/api/alerts', methods=['GET'])
+@jwt_required(optional=True)
+def get_alerts():
+    """
+    Alerts, newest first, keyset-paginated on id.
+    Query params: status, alert_type, severity, unit_id, tag_id, asset_id, limit, cursor (X-Next-Cursor header).
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'), ALERTS_PAGE_DEFAULT_LIMIT, ALERTS_PAGE_MAX_LIMIT)
+        query = Alert.query
+        for field in ('status', 'alert_type', 'severity', 'unit_id', 'tag_id'):
+            if request.args.get(field):
+                query = query.filter(getattr(Alert, field) == request.args.get(field))
+        if request.args.get('asset_id'):
+            query = query.filter(Alert.asset_id == int(request.args.get('asset_id')))
+        if request.args.get('cursor'):
+            cursor_id, = decode_cursor(request.args.get('cursor'))
+            query = query.filter(Alert.id < int(cursor_id))
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+    try:
+        alerts = query.order_by(Alert.id.desc()).limit(limit + 1).all()
+        response = jsonify([alert.to_dict() for alert in alerts[:limit]])
+        if len(alerts) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(alerts[limit - 1].id)
+        return response, 200
+    except Exception as e:
+        print(f"Error fetching alerts: {e}")
+        return jsonify({"status": "error", "message": "Could not fetch alerts"}), 500
+
+@app.route('/api/alerts/<int:alert_id>/acknowledge', methods=['POST'])
+@jwt_required()
+def acknowledge_alert(alert_id):
+    alert = db.session.get(Alert, alert_id)
+    if not alert:
+        return jsonify({"status": "error", "message": "Alert not found"}), 404
+    if alert.status == 'acknowledged':
+        return jsonify({"status": "info", "message": "Alert was already acknowledged", "alert": alert.to_dict()}), 200
+    try:
+        identity = get_jwt_identity()
+        alert.status = 'acknowledged'
+        alert.acknowledged_by = int(identity) if str(identity).isdigit() else None
+        alert.acknowledged_at = datetime.utcnow()
+        db.session.commit()
+        return jsonify({"status": "success", "message": "Alert acknowledged", "alert": alert.to_dict()}), 200
+    except Exception as e:
+        db.session.rollback(); print(f"Error acknowledging alert {alert_id}: {e}")
+        return jsonify({"status": "error", "message": f"Could not acknowledge alert: {str(e)}"}), 500
+
+def apply_alert_rule_fields(rule, data):
+    """Validates and copies rule fields from a request body onto an AlertRule. Raises ValueError."""
+    for field in ('name', 'rule_type', 'unit_id', 'asset_id', 'severity', 'silent_minutes', 'suppress_minutes', 'is_active'):
+        if field in data:
+            setattr(rule, field, data[field])
+    for field in ('allowed_from', 'allowed_until'):
+        if field in data:
+            setattr(rule, field, datetime.strptime(data[field], '%H:%M').time() if data[field] else None)
+    if not rule.name:
+        raise ValueError("name is required")
+    if rule.rule_type not in RULE_TYPES:
+        raise ValueError(f"rule_type must be one of {', '.join(RULE_TYPES)}")
+    if (rule.severity or 'medium') not in SEVERITIES:
+        raise ValueError(f"severity must be one of {', '.join(SEVERITIES)}")
+    if rule.rule_type == AFTER_HOURS_EXIT and (rule.allowed_from is None or rule.allowed_until is None):
+        raise ValueError("after_hours_exit rules need allowed_from and allowed_until (HH:MM)")
+    if rule.rule_type == UNIT_SILENT and (not rule.unit_id or not rule.silent_minutes or rule.silent_minutes < 1):
+        raise ValueError("unit_silent rules need unit_id and a positive silent_minutes")
+
+@app.route('/api/alert_rules', methods=['GET'])
+@jwt_required()
+def get_alert_rules():
+    rules = AlertRule.query.order_by(AlertRule.id).all()
+    return jsonify([rule.to_dict() for rule in rules]), 200
+
+@app.route('/api/alert_rules', methods=['POST'])
+@jwt_required()
+def create_alert_rule():
+    data = request.json
+    if not data: return jsonify({"status": "error", "message": "No data provided"}), 400
+    rule = AlertRule()
+    try:
+        apply_alert_rule_fields(rule, data)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid rule: {str(e)}"}), 400
+    try:
+        db.session.add(rule); db.session.commit()
+    except Exception as e:
+        db.session.rollback(); print(f"Error creating alert rule: {e}")
+        return jsonify({"status": "error", "message": f"Could not create alert rule: {str(e)}"}), 500
+    if alert_service: alert_service.reload_rules()
+    return jsonify({"status": "success", "message": "Alert rule created", "rule": rule.to_dict()}), 201
+
+@app.route('/api/alert_rules/<int:rule_id>', methods=['PUT'])
+@jwt_required()
+def update_alert_rule(rule_id):
+    rule = db.session.get(AlertRule, rule_id)
+    if not rule: return jsonify({"status": "error", "message": "Alert rule not found"}), 404
+    data = request.json
+    if not data: return jsonify({"status": "error", "message": "No data provided"}), 400
+    try:
+        apply_alert_rule_fields(rule, data)
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": f"Invalid rule: {str(e)}"}), 400
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback(); print(f"Error updating alert rule {rule_id}: {e}")
+        return jsonify({"status": "error", "message": f"Could not update alert rule: {str(e)}"}), 500
+    if alert_service: alert_service.reload_rules()
+    return jsonify({"status": "success", "message": "Alert rule updated", "rule": rule.to_dict()}), 200
+
+@app.route('/api/alert_rules/<int:rule_id>', methods=['DELETE'])
+@jwt_required()
+def delete_alert_rule(rule_id):
+    rule = db.session.get(AlertRule, rule_id)
+    if not rule: return jsonify({"status": "error", "message": "Alert rule not found"}), 404
+    try:
+        db.session.delete(rule); db.session.commit() # Its alerts keep their history (rule_id is set to NULL)
+    except Exception as e:
+        db.session.rollback(); print(f"Error deleting alert rule {rule_id}: {e}")
+        return jsonify({"status": "error", "message": f"Could not delete alert rule: {str(e)}"}), 500
+    if alert_service: alert_service.reload_rules()
+    return jsonify({"status": "success", "message": "Alert rule deleted"}), 200
+
+@app.route('/api/alerts/engine/stats', methods=['GET'])
+@jwt_required()
+def get_alert_engine_stats():
+    if not alert_service:
+        return jsonify({"status": "info", "message": "Alert engine is disabled ([Alerts] enabled = false)"}), 200
+    return jsonify(alert_service.stats()), 200
+
+@app.route('/api/notifications/stats', methods=['GET'])
+@jwt_required()
+def get_notification_stats():
+    if not notification_dispatcher:
+        return jsonify({"status": "info", "message": "Notifications are disabled ([Notifications] enabled = false)"}), 200
+    return jsonify(notification_dispatcher.stats()), 200
+
+@app.route('/api/events/partitions', methods=['GET'])
+@jwt_required()
+def get_event_partitions():
+    if not event_partitions:
+        return jsonify({"status": "info", "message": "Partition maintenance is disabled ([Partitioning] enabled = false)"}), 200
+    return jsonify(event_partitions.stats()), 200
+
+@app.cli.command('event-partitions')
+def event_partitions_command():
+    """Creates upcoming event partitions and applies retention once (e.g. from cron), then lists them."""
+    if not event_partitions:
+        print("Partition maintenance is disabled ([Partitioning] enabled = false).")
+        return
+    event_partitions.run_maintenance()
+    print(json.dumps(event_partitions.stats(), indent=2))
+
+# --- Event statistics ---
+@app.route('/api/stats', methods=['GET'])
+@jwt_required()
+def get_stats():
+    """
+    Event counts per hour or day (UTC, by receive time), grouped by source and optionally by
+    unit_id, asset_type and/or direction.
+    Query params: bucket=hour|day (default hour), group_by (comma separated), source=guardian|subunit
+    (default both), since/until (ISO 8601, widened to whole buckets; default the last 24 hours or
+    30 days). Served from the hourly rollups; only events received since the last rollup
+    (rolled_up_until in the response) are counted from the event tables.
+    """
+    bucket = request.args.get('bucket', 'hour')
+    group_by = [name.strip() for name in request.args.get('group_by', '').split(',') if name.strip()]
+    source = request.args.get('source')
+    if bucket not in BUCKETS:
+        return jsonify({"status": "error", "message": f"Unknown bucket '{bucket}'. Use hour or day."}), 400
+    if any(name not in GROUP_BY_FIELDS for name in group_by):
+        return jsonify({"status": "error", "message": f"group_by must be made of {', '.join(GROUP_BY_FIELDS)}"}), 400
+    if source and source not in event_rollups.sources:
+        return jsonify({"status": "error", "message": f"Unknown source '{source}'. Use guardian or subunit."}), 400
+    try:
+        until = ceil_bucket(parse_iso_datetime(request.args.get('until')) if request.args.get('until') else datetime.now(timezone.utc), bucket)
+        since = floor_bucket(parse_iso_datetime(request.args.get('since')) if request.args.get('since')
+                             else until - (timedelta(hours=24) if bucket == 'hour' else timedelta(days=30)), bucket)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+    if since >= until:
+        return jsonify({"status": "error", "message": "since must be before until"}), 400
+    if (until - since) / (timedelta(days=1) if bucket == 'day' else timedelta(hours=1)) > STATS_MAX_BUCKETS:
+        return jsonify({"status": "error", "message": f"Range too large (max {STATS_MAX_BUCKETS} {bucket} buckets)"}), 400
+
+    try:
+        group_by = list(dict.fromkeys(group_by))
+        totals, rolled_up = event_rollups.counts(db.session, bucket, since, until, [source] if source else None, group_by)
+        buckets = [{'bucket_start': json_value(key[0]), 'source': key[1], **dict(zip(group_by, key[2:])), 'count': count}
+                   for key, count in sorted(totals.items(), key=lambda item: tuple('' if value is None else value for value in item[0]))]
+        return jsonify({"bucket": bucket, "since": json_value(since), "until": json_value(until), "group_by": group_by,
+                        "rolled_up_until": {name: json_value(value) for name, value in rolled_up.items()},
+                        "buckets": buckets}), 200
+    except Exception as e:
+        db.session.rollback(); print(f"Error computing stats: {e}")
+        return jsonify({"status": "error", "message": "Could not compute stats"}), 500
+
+@app.cli.command('event-rollups')
+def event_rollups_command():
+    """Rolls event counts up to the last complete hour once (e.g. from cron when [Stats] rollups_enabled = false)."""
+    print(f"Rolled up {event_rollups.run_once()} hour(s).")
+    print(json.dumps(event_rollups.stats(), indent=2))
+
+# --- FSMA 204 Traceability ---
+@app.route('/api/fsma/traceability_report', methods=['GET'])
+@jwt_required()
+def get_fsma_traceability_report():
+    """
+    Streams the KDE/CTE records for one traceability lot, tag or asset as a sortable spreadsheet
+    (CSV, default) or NDJSON, oldest first. Query params: exactly one of lot_code, tag_id, asset_id;
+    since/until (ISO 8601, on the event time); format=csv|ndjson. Reads only fsma_traceability_log,
+    one index range scan, from a server-side cursor.
+    """
+    if not fsma_service:
+        return jsonify({"status": "error", "message": "FSMA recording is disabled ([FSMA] enabled = false)"}), 404
+    report_format = request.args.get('format', 'csv')
+    if report_format not in ('csv', 'ndjson'):
+        return jsonify({"status": "error", "message": f"Unknown format '{report_format}'. Use csv or ndjson."}), 400
+    try:
+        asset_id = int(request.args['asset_id']) if request.args.get('asset_id') else None
+        since = parse_iso_datetime(request.args['since']) if request.args.get('since') else None
+        until = parse_iso_datetime(request.args['until']) if request.args.get('until') else None
+        statement = fsma_service.generate_traceability_report(
+            lot_code=request.args.get('lot_code') or None, tag_id=request.args.get('tag_id') or None,
+            asset_id=asset_id, since=since, until=until).execution_options(yield_per=EXPORT_YIELD_PER)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+
+    def generate_report():
+        result = db.session.execute(statement)
+        try:
+            if report_format == 'csv':
+                yield from fsma_service.iter_report_csv(result)
+            else:
+                field_names = list(result.keys())
+                for partition in result.partitions():
+                    yield ''.join(json.dumps(dict(zip(field_names, map(json_value, row)))) + '\n' for row in partition)
+        finally:
+            result.close()
+
+    key = request.args.get('lot_code') or request.args.get('tag_id') or f"asset_{asset_id}"
+    filename = f"fsma_traceability_{''.join(c if c.isalnum() or c in '-_' else '_' for c in key)}.{report_format}"
+    return Response(stream_with_context(generate_report()),
+                    mimetype='text/csv' if report_format == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.cli.command('fsma-backfill')
+def fsma_backfill_command():
+    """Records FSMA KDEs for events stored before fsma_traceability_log existed (resumable)."""
+    if not fsma_service:
+        print("FSMA recording is disabled ([FSMA] enabled = false); nothing to backfill.")
+        return
+    for source, model, time_column_name in (('guardian', GuardianEvent, 'event_time'),
+                                            ('subunit', SubUnitEvent, 'reported_at_device')):
+        added = fsma_service.backfill(source, model, Asset, time_column_name)
+        print(f"FSMA backfill: {added} {source} event(s) recorded.")
 
 # --- Main Block ---
 if __name__ == '__main__':
@@ -0,0 +1,762 @@
+# APIServer_Backend/benchmarks.py
+"""
+Ad-hoc performance benchmarks for the API server.
+These run against the database configured in config_server.ini through Flask's test client,
+so point it at a scratch database - benchmarks insert synthetic rows and delete them afterwards.
+
+Usage (from the repository root):
+    python -m APIServer_Backend.benchmarks ingest
+    python -m APIServer_Backend.benchmarks event_pagination
+    python -m APIServer_Backend.benchmarks event_time_range
+    python -m APIServer_Backend.benchmarks query_counts
+    python -m APIServer_Backend.benchmarks export_memory
+    python -m APIServer_Backend.benchmarks lorawan_uplink
+    python -m APIServer_Backend.benchmarks media_upload
+    python -m APIServer_Backend.benchmarks alerts
+    python -m APIServer_Backend.benchmarks fsma_report
+    python -m APIServer_Backend.benchmarks asset_presence
+    python -m APIServer_Backend.benchmarks stats
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+import requests
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, text
+
+from werkzeug.serving import make_server
+
+from . import app as app_module
+from .app import app, db, media_store, LORAWAN_SUBUNIT_FPORT, LORAWAN_WEBHOOK_SECRET
+from .models import Asset, GuardianEvent, SubUnitEvent, MediaFile, Alert, FSMARecord, AssetPresence, EventRollupHourly, EventRollupState
+from .services.alert_service import (AlertService, AlertEvent, CompiledRules, make_rule, rule_matches,
+                                     UNKNOWN_TAG, INACTIVE_ASSET, AFTER_HOURS_EXIT, UNIT_SILENT)
+from .services.subunit_payload import encode_subunit_payload
+
+BENCH_UNIT_ID = 'BENCH_GUARDIAN'
+
+
+def _synthetic_guardian_payloads(count, distinct_tags=300):
+    now_iso = datetime.now(timezone.utc).isoformat()
+    return [
+        {"unit_id": BENCH_UNIT_ID,
+         "event": {"timestamp_iso": now_iso, "tag_id": f"BENCH{i % distinct_tags:08X}", "direction": "unknown"}}
+        for i in range(count)
+    ]
+
+
+def _cleanup_bench_events():
+    with app.app_context():
+        GuardianEvent.query.filter_by(unit_id=BENCH_UNIT_ID).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def bench_guardian_ingest(sizes=(1, 100, 10000)):
+    """Compares events/sec of the single-event path against /api/guardian_events/batch."""
+    client = app.test_client()
+    print(f"{'events':>8} {'single ev/s':>14} {'batch ev/s':>14} {'speedup':>9}")
+    for size in sizes:
+        payloads = _synthetic_guardian_payloads(size)
+
+        start = time.perf_counter()
+        for payload in payloads:
+            response = client.post('/api/guardian_event', json=payload)
+            assert response.status_code == 201, response.get_json()
+        single_rate = size / (time.perf_counter() - start)
+        _cleanup_bench_events()
+
+        start = time.perf_counter()
+        response = client.post('/api/guardian_events/batch', json=payloads)
+        assert response.status_code == 201, response.get_json()
+        batch_rate = size / (time.perf_counter() - start)
+        _cleanup_bench_events()
+
+        print(f"{size:>8} {single_rate:>14.1f} {batch_rate:>14.1f} {batch_rate / single_rate:>8.1f}x")
+
+
+def _seed_synthetic_guardian_events(row_count):
+    """Bulk-generates row_count guardian_events server side (16 units, 5000 tags, ~1 row/second)."""
+    with app.app_context():
+        db.session.execute(text("""
+            INSERT INTO guardian_events (unit_id, timestamp_iso, event_time, tag_id, direction, received_at)
+            SELECT :unit_id || '_' || (n % 16), to_char(ts AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'), ts,
+                   'BENCH' || lpad(to_hex(n % 5000), 8, '0'),
+                   (ARRAY['ingress', 'egress', 'unknown'])[1 + n % 3], ts
+            FROM (SELECT n, now() - make_interval(secs => n) AS ts
+                  FROM generate_series(1, :row_count) AS n) AS series
+        """), {'unit_id': BENCH_UNIT_ID, 'row_count': row_count})
+        db.session.commit()
+        db.session.execute(text("ANALYZE guardian_events"))
+
+
+def _bench_auth_headers():
+    with app.app_context():
+        return {'Authorization': f"Bearer {create_access_token(identity='benchmark')}"}
+
+
+def _current_rss_mb():
+    """Resident set size of this process (Linux /proc)."""
+    with open('/proc/self/statm') as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _delete_seeded_guardian_events():
+    with app.app_context():
+        db.session.execute(text("DELETE FROM guardian_events WHERE unit_id LIKE :prefix"), {'prefix': BENCH_UNIT_ID + '%'})
+        db.session.commit()
+
+
+def _page_params(page_size, cursor):
+    return {'limit': page_size, 'cursor': cursor} if cursor else {'limit': page_size}
+
+
+def bench_event_pagination(row_count=5_000_000, page_size=100, depths=(1, 100, 1000, 10000)):
+    """
+    Latency of fetching page N with keyset cursors (full /api/events request) versus the
+    equivalent OFFSET query alone. Keyset latency stays flat; OFFSET grows with depth.
+    """
+    print(f"Seeding {row_count} synthetic guardian_events rows...")
+    _seed_synthetic_guardian_events(row_count)
+    client = app.test_client()
+    try:
+        print(f"{'page':>7} {'keyset ms':>10} {'offset ms':>10}")
+        cursor = None
+        page = 0
+        for depth in depths:
+            # Walk cursors up to the target page; only the request for the target page is timed.
+            while page < depth - 1:
+                response = client.get('/api/events', query_string=_page_params(page_size, cursor))
+                cursor = response.headers.get('X-Next-Cursor')
+                page += 1
+            start = time.perf_counter()
+            response = client.get('/api/events', query_string=_page_params(page_size, cursor))
+            keyset_ms = (time.perf_counter() - start) * 1000
+            cursor = response.headers.get('X-Next-Cursor')
+            page += 1
+
+            with app.app_context():
+                start = time.perf_counter()
+                GuardianEvent.query.order_by(GuardianEvent.received_at.desc(), GuardianEvent.id.desc()) \
+                    .offset((depth - 1) * page_size).limit(page_size).all()
+                offset_ms = (time.perf_counter() - start) * 1000
+            print(f"{depth:>7} {keyset_ms:>10.2f} {offset_ms:>10.2f}")
+    finally:
+        _delete_seeded_guardian_events()
+
+
+def bench_event_time_range(row_count=2_000_000, widths=(timedelta(minutes=10), timedelta(hours=6), timedelta(days=3))):
+    """
+    Device-time range counts on event_time (timestamptz, index range scan) versus the string
+    comparison on timestamp_iso it replaces. A quarter of the units report with a +02:00 offset,
+    so the string comparison also counts the wrong rows.
+    """
+    print(f"Seeding {row_count} synthetic guardian_events rows...")
+    _seed_synthetic_guardian_events(row_count)
+    client = app.test_client()
+    try:
+        with app.app_context():
+            db.session.execute(text("""
+                UPDATE guardian_events
+                SET timestamp_iso = to_char((event_time + interval '2 hours') AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+02:00"')
+                WHERE unit_id IN (:unit_id || '_0', :unit_id || '_1', :unit_id || '_2', :unit_id || '_3')
+            """), {'unit_id': BENCH_UNIT_ID})
+            db.session.commit()
+            until = datetime.now(timezone.utc) - timedelta(hours=1)
+            print(f"{'range':>16} {'event_time rows':>16} {'ms':>8} {'string rows':>12} {'ms':>8}")
+            for width in widths:
+                since = until - width
+                start = time.perf_counter()
+                typed_rows = db.session.query(db.func.count(GuardianEvent.id)) \
+                    .filter(GuardianEvent.event_time >= since, GuardianEvent.event_time < until).scalar()
+                typed_ms = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                string_rows = db.session.query(db.func.count(GuardianEvent.id)) \
+                    .filter(GuardianEvent.timestamp_iso >= since.strftime('%Y-%m-%dT%H:%M:%S'),
+                            GuardianEvent.timestamp_iso < until.strftime('%Y-%m-%dT%H:%M:%S')).scalar()
+                string_ms = (time.perf_counter() - start) * 1000
+                print(f"{str(width):>16} {typed_rows:>16} {typed_ms:>8.1f} {string_rows:>12} {string_ms:>8.1f}")
+        start = time.perf_counter()
+        response = client.get('/api/events', query_string={'event_since': (until - widths[0]).isoformat(),
+                                                            'event_until': until.isoformat(), 'limit': 100})
+        print(f"/api/events?event_since&event_until ({widths[0]}): {len(response.get_json())} rows, "
+              f"{(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        _delete_seeded_guardian_events()
+
+
+def bench_export_memory(row_count=1_000_000, export_format='ndjson'):
+    """Streams /api/events/export over row_count rows, sampling RSS; it should stay flat as rows go by."""
+    print(f"Seeding {row_count} synthetic guardian_events rows...")
+    _seed_synthetic_guardian_events(row_count)
+    client = app.test_client()
+    try:
+        baseline_rss = _current_rss_mb()
+        start = time.perf_counter()
+        response = client.get('/api/events/export', headers=_bench_auth_headers(), buffered=False,
+                              query_string={'format': export_format})
+        assert response.status_code == 200
+        bytes_out = 0
+        peak_rss = baseline_rss
+        print(f"{'MB streamed':>12} {'RSS MB':>8}")
+        next_report = 0
+        for chunk in response.response:
+            bytes_out += len(chunk)
+            peak_rss = max(peak_rss, _current_rss_mb())
+            if bytes_out >= next_report:
+                print(f"{bytes_out / 1e6:>12.1f} {_current_rss_mb():>8.1f}")
+                next_report += 20_000_000
+        response.close()
+        elapsed = time.perf_counter() - start
+        print(f"Streamed {bytes_out / 1e6:.1f} MB in {elapsed:.1f}s; RSS baseline {baseline_rss:.1f} MB, peak {peak_rss:.1f} MB")
+    finally:
+        _delete_seeded_guardian_events()
+
+
+def fake_ttn_uplink(device_id, f_cnt, payload, rssi=-90, snr=7.5):
+    """Local stand-in for a The Things Stack v3 uplink webhook message carrying a SubUnit payload."""
+    received_at = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    return {
+        "end_device_ids": {"device_id": device_id, "application_ids": {"application_id": "farmguard-bench"}},
+        "received_at": received_at,
+        "uplink_message": {
+            "f_port": LORAWAN_SUBUNIT_FPORT, "f_cnt": f_cnt,
+            "frm_payload": base64.b64encode(payload).decode('ascii'),
+            "rx_metadata": [{"gateway_ids": {"gateway_id": "bench-gw-1"}, "rssi": rssi, "snr": snr},
+                            {"gateway_ids": {"gateway_id": "bench-gw-2"}, "rssi": rssi - 12, "snr": snr - 3}],
+            "received_at": received_at
+        }
+    }
+
+
+def bench_lorawan_uplink(batch_sizes=(1, 100, 1000), tags_per_uplink=8):
+    """Uplinks/sec and SubUnitEvent rows/sec through /api/lorawan_uplink for growing webhook batches."""
+    client = app.test_client()
+    headers = {'X-Webhook-Secret': LORAWAN_WEBHOOK_SECRET} if LORAWAN_WEBHOOK_SECRET else {}
+    print(f"{'uplinks':>8} {'uplinks/s':>10} {'rows/s':>10}")
+    try:
+        for batch_size in batch_sizes:
+            uplinks = []
+            for i in range(batch_size):
+                tags = [(f"04{(i * tags_per_uplink + t) % 5000:012x}", 1 + t) for t in range(tags_per_uplink)]
+                uplinks.append(fake_ttn_uplink(f"{BENCH_UNIT_ID}_SUB_{i % 50}", i, encode_subunit_payload(3600, i, tags)))
+            start = time.perf_counter()
+            response = client.post('/api/lorawan_uplink', json=uplinks, headers=headers)
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 201, response.get_json()
+            print(f"{batch_size:>8} {batch_size / elapsed:>10.1f} {response.get_json()['events_stored'] / elapsed:>10.1f}")
+    finally:
+        with app.app_context():
+            SubUnitEvent.query.filter(SubUnitEvent.unit_id.like(BENCH_UNIT_ID + '%')).delete(synchronize_session=False)
+            db.session.commit()
+
+
+@contextmanager
+def count_queries(engine):
+    """Collects the SQL statements sent through engine inside the block (also used by the tests)."""
+    statements = []
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+
+
+def bench_event_list_query_counts(page_sizes=(10, 100, 1000)):
+    """Asserts /api/events issues the same number of queries for every page size (no per-row asset loads)."""
+    with app.app_context():
+        assets = [Asset(asset_name=f"Bench asset {i}", rfid_tag_assigned=f"BENCHQC{i:06d}") for i in range(max(page_sizes))]
+        db.session.add_all(assets)
+        db.session.commit()
+        asset_ids = [asset.id for asset in assets]
+        db.session.execute(db.insert(GuardianEvent), [
+            {'unit_id': BENCH_UNIT_ID, 'timestamp_iso': datetime.now(timezone.utc).isoformat(),
+             'event_time': datetime.now(timezone.utc), 'tag_id': f"BENCHQC{i:06d}", 'asset_id': asset_id}
+            for i, asset_id in enumerate(asset_ids)
+        ])
+        db.session.commit()
+    client = app.test_client()
+    try:
+        with app.app_context():
+            engine = db.engine
+        counts = {}
+        for page_size in page_sizes:
+            with count_queries(engine) as statements:
+                response = client.get('/api/events', query_string={'unit_id': BENCH_UNIT_ID, 'limit': page_size})
+            assert response.status_code == 200
+            assert all(event_dict['asset_info'] for event_dict in response.get_json())
+            counts[page_size] = len(statements)
+            print(f"page_size={page_size:>5}: {len(statements)} queries")
+        assert len(set(counts.values())) == 1, f"Query count depends on page size: {counts}"
+        print("OK: query count is independent of page size.")
+    finally:
+        _cleanup_bench_events()
+        with app.app_context():
+            Asset.query.filter(Asset.id.in_(asset_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+class _LocalServer:
+    """The Flask app on a real socket in a background thread, for clients that speak HTTP (the Guardian's DataUploader)."""
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _guardian_uploader(port, bandwidth_kbps, chunk_bytes):
+    """A GuardianUnit_RPi DataUploader pointed at the local server."""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'GuardianUnit_RPi'))
+    from data_uploader import DataUploader
+    config_path = os.path.join(tempfile.mkdtemp(), 'config_guardian.ini')
+    with open(config_path, 'w') as config_file:
+        config_file.write(f"[General]\napi_server_url = http://127.0.0.1:{port}/api\nguardian_unit_id = {BENCH_UNIT_ID}\n"
+                          f"[Uploader]\nrequest_timeout_seconds = 30\nmedia_chunk_bytes = {chunk_bytes}\n"
+                          f"media_bandwidth_kbps = {bandwidth_kbps}\n")
+    return DataUploader(config_path=config_path)
+
+
+class _LinkDropLimiter:
+    """Wraps a BandwidthLimiter and fails the upload once, after drop_after_bytes, like a backhaul dropping mid-chunk."""
+    def __init__(self, limiter, drop_after_bytes):
+        self.limiter = limiter
+        self.remaining = drop_after_bytes
+
+    def consume(self, nbytes):
+        self.limiter.consume(nbytes)
+        self.remaining -= nbytes
+        if self.remaining < 0:
+            self.remaining = float('inf')
+            raise requests.exceptions.ConnectionError("Simulated link drop")
+
+
+def bench_media_upload(file_mb=10, bandwidth_kbps=16000, chunk_bytes=1024 * 1024):
+    """
+    Uploads a synthetic clip through a local server with the Guardian's DataUploader: capped
+    throughput, resume after the link drops mid-chunk, dedup of a second upload, and an uncapped run.
+    """
+    clip_path = os.path.join(tempfile.mkdtemp(), 'BENCH_CLIP.h264')
+    with open(clip_path, 'wb') as clip:
+        clip.write(os.urandom(file_mb * 1024 * 1024))
+    server = _LocalServer()
+    uploader = _guardian_uploader(server.port, bandwidth_kbps, chunk_bytes)
+    from data_uploader import file_sha256
+    sha256 = file_sha256(clip_path)
+    try:
+        limiter = uploader.bandwidth_limiter
+        uploader.bandwidth_limiter = _LinkDropLimiter(limiter, int(file_mb * 1024 * 1024 * 0.4)) # Drop 40% of the way in
+        start = time.perf_counter()
+        first_attempt = uploader.upload_media_file(clip_path, sha256, 'video/h264')
+        offset_after_drop = media_store.partial_size(sha256)
+        uploader.bandwidth_limiter = limiter
+        media_url = uploader.upload_media_file(clip_path, sha256, 'video/h264')
+        elapsed = time.perf_counter() - start
+        assert first_attempt is None and media_url, (first_attempt, media_url)
+        print(f"Capped at {bandwidth_kbps} kbps: link dropped, server kept {offset_after_drop / 1048576:.1f} MB, resumed; "
+              f"{file_mb} MB in {elapsed:.1f}s = {file_mb * 8 * 1048.576 / elapsed:,.0f} kbps")
+
+        with app.app_context():
+            media_file = MediaFile.query.filter_by(sha256=sha256).one()
+            stored_sha256 = file_sha256(media_store.full_path(media_file.storage_path))
+        print(f"Server copy {'matches' if stored_sha256 == sha256 else 'DOES NOT match'} the clip's SHA-256 ({media_url})")
+
+        start = time.perf_counter()
+        assert uploader.upload_media_file(clip_path, sha256, 'video/h264') == media_url
+        print(f"Second upload of the same clip (dedup by hash): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        _delete_bench_media(sha256)
+        uncapped = _guardian_uploader(server.port, 0, chunk_bytes)
+        start = time.perf_counter()
+        assert uncapped.upload_media_file(clip_path, sha256, 'video/h264')
+        elapsed = time.perf_counter() - start
+        print(f"Uncapped: {file_mb} MB in {elapsed:.2f}s = {file_mb * 8 * 1048.576 / elapsed:,.0f} kbps")
+        uncapped.close()
+    finally:
+        uploader.close()
+        server.stop()
+        _delete_bench_media(sha256)
+        os.remove(clip_path)
+
+
+def _delete_bench_media(sha256):
+    with app.app_context():
+        media_file = MediaFile.query.filter_by(sha256=sha256).first()
+        if media_file:
+            if media_file.storage_path and os.path.exists(media_store.full_path(media_file.storage_path)):
+                os.remove(media_store.full_path(media_file.storage_path))
+            db.session.delete(media_file)
+            db.session.commit()
+    media_store.discard(sha256)
+
+
+def _synthetic_alert_events(count, assets=5000, units=50, unknown_share=0.05, unknown_tags=50):
+    """Events as the ingest endpoints hand them to the alert engine; a few unknown tags keep reappearing."""
+    events = []
+    now = datetime.utcnow()
+    for event_id in range(count):
+        unit_id = f"{BENCH_UNIT_ID}_{event_id % units}"
+        direction = random.choice(('ingress', 'egress', 'unknown'))
+        event_time = datetime(2024, 5, 1, random.randrange(24), random.randrange(60), tzinfo=timezone.utc)
+        if random.random() < unknown_share: # E.g. a stray tag parked near a gate
+            events.append(AlertEvent('guardian', event_id, unit_id, f"BENCHUNK{random.randrange(unknown_tags):04X}",
+                                     None, None, None, direction, event_time, now))
+        else:
+            asset_id = random.randrange(1, assets + 1)
+            events.append(AlertEvent('guardian', event_id, unit_id, f"BENCH{asset_id:08X}", asset_id, asset_id % 50 != 0,
+                                     f"Bench asset {asset_id}", direction, event_time, now))
+    return events
+
+
+def _synthetic_alert_rules(assets=5000, units=50):
+    """Built-in defaults plus a realistic rule set: per-asset working hours, per-unit rules and silence checks."""
+    rules = [make_rule(None, 'Default unknown_tag', UNKNOWN_TAG), make_rule(None, 'Default inactive_asset', INACTIVE_ASSET)]
+    rule_id = 0
+    for asset_id in range(1, assets + 1):
+        rule_id += 1
+        start_hour = 5 + asset_id % 3
+        rules.append(make_rule(rule_id, f"Hours {asset_id}", AFTER_HOURS_EXIT, asset_id=asset_id, severity='high',
+                               allowed_from=datetime(2000, 1, 1, start_hour).time(), allowed_until=datetime(2000, 1, 1, 19).time()))
+    for unit in range(units):
+        for rule_type, extra in ((UNKNOWN_TAG, {'severity': 'high'}), (UNIT_SILENT, {'silent_minutes': 30})):
+            rule_id += 1
+            rules.append(make_rule(rule_id, f"{rule_type} {unit}", rule_type, unit_id=f"{BENCH_UNIT_ID}_{unit}", **extra))
+    return rules
+
+
+def bench_alert_engine(event_count=200_000, db_batch_size=10000):
+    """
+    1. Rule matching: compiled lookup tables versus testing every rule per event.
+    2. Engine throughput with an in-memory sink: caller-side submit() cost and events/s evaluated,
+       and how many hits the suppression window folds into existing alerts.
+    3. Through the database: /api/guardian_events/batch latency with the engine on and off, and the
+       alerts it stores.
+    """
+    rules = _synthetic_alert_rules()
+    event_rules = [rule for rule in rules if rule.rule_type != UNIT_SILENT]
+    events = _synthetic_alert_events(event_count)
+    compiled = CompiledRules(rules)
+    sample = events[:20000]
+    start = time.perf_counter()
+    linear_hits = sum(1 for event in sample for rule in event_rules if rule_matches(rule, event))
+    linear_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled_hits = sum(len(compiled.evaluate(event)) for event in sample)
+    compiled_seconds = time.perf_counter() - start
+    assert linear_hits == compiled_hits, (linear_hits, compiled_hits)
+    print(f"{len(rules)} rules, {len(sample)} events, {compiled_hits} hits")
+    print(f"  linear scan     {linear_seconds / len(sample) * 1e6:9.1f} us/event ({len(sample) / linear_seconds:>10,.0f} events/s)")
+    print(f"  compiled tables {compiled_seconds / len(sample) * 1e6:9.1f} us/event ({len(sample) / compiled_seconds:>10,.0f} events/s), "
+          f"{linear_seconds / compiled_seconds:.0f}x faster")
+
+    stored = {'new': 0, 'repeats': 0}
+    def memory_sink(new_alerts, repeats):
+        stored['new'] += len(new_alerts)
+        stored['repeats'] += sum(extra for _, extra, _ in repeats)
+        first_id = stored['new'] - len(new_alerts)
+        return list(range(first_id, stored['new']))
+    service = AlertService(lambda: rules, memory_sink, workers=2, queue_size=event_count)
+    service.send_alerts = lambda alerts: None # Keep the console quiet
+    service.start()
+    while service.stats()['rules'] == 0:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    for offset in range(0, event_count, 100): # As the batch endpoint would hand them over
+        service.submit(events[offset:offset + 100])
+    submit_seconds = time.perf_counter() - start
+    service.wait_until_idle()
+    total_seconds = time.perf_counter() - start
+    stats = service.stats()
+    print(f"Engine, {event_count} events: submit() {submit_seconds / event_count * 1e6:.2f} us/event on the ingest thread; "
+          f"evaluated and stored in {total_seconds:.2f}s ({event_count / total_seconds:,.0f} events/s)")
+    print(f"  {stats['alerts_created']} alerts created, {stats['alerts_suppressed']} hits folded into open alerts "
+          f"({stats['alerts_suppressed'] / max(1, stats['alerts_created'] + stats['alerts_suppressed']):.1%} suppressed), "
+          f"{stats['dropped']} dropped")
+
+    payloads = [{"unit_id": f"{BENCH_UNIT_ID}_{i % 8}",
+                 "event": {"timestamp_iso": f"2024-05-01T{i % 24:02d}:00:00", "direction": "egress",
+                           "tag_id": f"BENCHUNK{i % 50:04X}"}} # 50 unregistered tags, seen over and over
+                for i in range(db_batch_size)]
+    client = app.test_client()
+    engine = app_module.alert_service
+    try:
+        for label, alert_service in (("engine off", None), ("engine on", engine)):
+            app_module.alert_service = alert_service
+            start = time.perf_counter()
+            response = client.post('/api/guardian_events/batch', json=payloads)
+            assert response.status_code == 201, response.get_json()
+            request_seconds = time.perf_counter() - start
+            if alert_service:
+                alert_service.wait_until_idle()
+            drained_seconds = time.perf_counter() - start
+            print(f"  batch of {db_batch_size}, {label:<10}: request {request_seconds * 1000:7.1f} ms"
+                  + (f", alerts stored {drained_seconds * 1000:7.1f} ms after the request started" if alert_service else ""))
+            _cleanup_bench_events()
+        with app.app_context():
+            alert_rows = Alert.query.filter(Alert.unit_id.like(BENCH_UNIT_ID + '%')).all()
+            print(f"  {len(alert_rows)} alert rows for {db_batch_size} unknown-tag events "
+                  f"(occurrence_count total {sum(alert.occurrence_count for alert in alert_rows)})")
+    finally:
+        app_module.alert_service = engine
+        with app.app_context():
+            Alert.query.filter(Alert.unit_id.like(BENCH_UNIT_ID + '%')).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def bench_fsma_report(asset_events=100_000, other_events=100_000, batch_size=10000):
+    """
+    Traceability report for one asset with asset_events reads among other_events reads of other tags,
+    all ingested through /api/guardian_events/batch, so the KDE records are written the production way.
+    Compares the streamed CSV report from fsma_traceability_log with the equivalent query over the raw
+    event tables, and measures what writing the KDE records adds to batch ingest.
+    """
+    with app.app_context():
+        asset = Asset(asset_name='BENCH FSMA bin', rfid_tag_assigned='BENCHFSMA0001')
+        db.session.add(asset)
+        db.session.commit()
+        asset_id = asset.id
+    app_module.tag_asset_cache.clear()
+    total = asset_events + other_events
+    started_at = datetime(2023, 1, 1)
+    def payloads(first, count, unit_id=BENCH_UNIT_ID, include_asset=True):
+        return [{"unit_id": f"{unit_id}_{i % 8}",
+                 "event": {"timestamp_iso": (started_at + timedelta(seconds=i * 60)).isoformat(), "direction": ('ingress', 'egress')[i % 2],
+                           # asset_events of the reads, spread evenly, are the benchmark asset's
+                           "tag_id": 'BENCHFSMA0001' if include_asset and i * asset_events // total != (i + 1) * asset_events // total
+                                     else f"BENCHFSMA{i % 5000 + 2:04d}"}}
+                for i in range(first, first + count)]
+    client = app.test_client()
+    headers = _bench_auth_headers()
+    service = app_module.fsma_service
+    try:
+        for offset in range(0, total, batch_size):
+            response = client.post('/api/guardian_events/batch', json=payloads(offset, min(batch_size, total - offset)))
+            assert response.status_code == 201, response.get_json()
+        for label, fsma_service in (("without KDE records", None), ("with KDE records", service)):
+            app_module.fsma_service = fsma_service
+            batch = payloads(0, batch_size, unit_id=BENCH_UNIT_ID + '_OVERHEAD', include_asset=False)
+            start = time.perf_counter()
+            assert client.post('/api/guardian_events/batch', json=batch).status_code == 201
+            print(f"Batch of {batch_size} {label}: {(time.perf_counter() - start) / batch_size * 1e6:.1f} us/event")
+        app_module.fsma_service = service
+        with app.app_context():
+            print(f"Ingested {total} events, {FSMARecord.query.filter_by(asset_id=asset_id).count()} recorded for the benchmark asset")
+
+        for label, query in (("asset", {'asset_id': asset_id}), ("lot", {'lot_code': 'BENCHFSMA0001'}),
+                             ("asset, one week", {'asset_id': asset_id, 'since': '2023-02-01T00:00:00', 'until': '2023-02-08T00:00:00'})):
+            start = time.perf_counter()
+            response = client.get('/api/fsma/traceability_report', headers=headers, buffered=False, query_string=query)
+            assert response.status_code == 200
+            chunks = iter(response.response)
+            body = next(chunks)
+            first_byte_ms = (time.perf_counter() - start) * 1000
+            body += b''.join(chunks)
+            response.close()
+            row_count = body.count(b'\n') - 1
+            print(f"  report by {label:<16}: {row_count:>7} rows, {len(body) / 1e6:5.1f} MB CSV, "
+                  f"first byte {first_byte_ms:7.1f} ms, complete {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+        with app.app_context(): # What a report has to do without the KDE table, before writing any CSV
+            start = time.perf_counter()
+            guardian_rows = db.session.query(GuardianEvent.id, GuardianEvent.unit_id, GuardianEvent.tag_id, GuardianEvent.asset_id,
+                                             GuardianEvent.direction, GuardianEvent.event_time, Asset.asset_name) \
+                .join(Asset, Asset.id == GuardianEvent.asset_id).filter(GuardianEvent.asset_id == asset_id).all()
+            subunit_rows = db.session.query(SubUnitEvent.id, SubUnitEvent.unit_id, SubUnitEvent.tag_id, SubUnitEvent.asset_id,
+                                            SubUnitEvent.reported_at_device, Asset.asset_name) \
+                .join(Asset, Asset.id == SubUnitEvent.asset_id).filter(SubUnitEvent.asset_id == asset_id).all()
+            records = [service.process_event_for_fsma('guardian', row.id, row._asdict(), None, row.asset_name) for row in guardian_rows]
+            records += [service.process_event_for_fsma('subunit', row.id, row._asdict(), None, row.asset_name) for row in subunit_rows]
+            records.sort(key=lambda record: record['event_time'])
+            print(f"  raw events, join + sort   : {len(records):>7} rows, {(time.perf_counter() - start) * 1000:8.1f} ms")
+    finally:
+        app_module.fsma_service = service
+        with app.app_context():
+            FSMARecord.query.filter(FSMARecord.location_id.like(BENCH_UNIT_ID + '%')).delete(synchronize_session=False)
+            db.session.commit()
+        _delete_seeded_guardian_events()
+        with app.app_context():
+            Asset.query.filter_by(id=asset_id).delete()
+            db.session.commit()
+        app_module.tag_asset_cache.clear()
+
+
+def bench_asset_presence(asset_count=50_000, event_count=50_000_000, batch_size=1000):
+    """
+    Whole-yard state from /api/assets/presence (one query on asset_presence) versus the
+    scan-based equivalent over the event tables: per asset, the newest Guardian and SubUnit
+    sighting and the newest gate crossing. event_count reads (80% Guardian, 20% SubUnit) are
+    spread over asset_count assets. Also measures what the presence upsert adds to batch ingest.
+    """
+    guardian_count = event_count * 4 // 5
+    print(f"Seeding {asset_count} assets, {guardian_count} guardian_events and {event_count - guardian_count} subunit_events rows...")
+    with app.app_context():
+        db.session.execute(text("""
+            INSERT INTO assets (asset_name, rfid_tag_assigned, is_active, current_status)
+            SELECT 'Bench presence asset ' || n, 'BENCHP' || lpad(to_hex(n), 8, '0'), true, 'unknown'
+            FROM generate_series(1, :asset_count) AS n
+        """), {'asset_count': asset_count})
+        db.session.commit()
+        # One multi-row INSERT, so the ids are consecutive
+        first_asset_id = db.session.execute(text("SELECT min(id) FROM assets WHERE rfid_tag_assigned LIKE 'BENCHP%'")).scalar()
+        # From the start of the current month onwards, where partitions are guaranteed to exist
+        series = """(SELECT n, 1 + (n * 7919) % :asset_count AS asset_n,
+                            (date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') + make_interval(secs => n * 0.01) AS ts
+                     FROM generate_series(1, :row_count) AS n) AS series"""
+        db.session.execute(text(f"""
+            INSERT INTO guardian_events (unit_id, timestamp_iso, event_time, tag_id, asset_id, direction, received_at)
+            SELECT :unit_id || '_' || (n % 16), to_char(ts AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'), ts,
+                   'BENCHP' || lpad(to_hex(asset_n), 8, '0'), :first_asset_id + asset_n - 1,
+                   (ARRAY['ingress', 'egress', 'unknown'])[1 + n % 3], ts
+            FROM {series}
+        """), {'unit_id': BENCH_UNIT_ID, 'asset_count': asset_count, 'row_count': guardian_count, 'first_asset_id': first_asset_id})
+        db.session.execute(text(f"""
+            INSERT INTO subunit_events (unit_id, tag_id, asset_id, rssi, location_description, reported_at_device, received_at_server)
+            SELECT :unit_id || '_SUB_' || (n % 64), 'BENCHP' || lpad(to_hex(asset_n), 8, '0'), :first_asset_id + asset_n - 1,
+                   -40 - n % 80, 'Field ' || (n % 64), ts, ts
+            FROM {series}
+        """), {'unit_id': BENCH_UNIT_ID, 'asset_count': asset_count, 'row_count': event_count - guardian_count,
+               'first_asset_id': first_asset_id})
+        db.session.commit()
+        db.session.execute(text("ANALYZE assets")); db.session.execute(text("ANALYZE guardian_events"))
+        db.session.execute(text("ANALYZE subunit_events")); db.session.commit()
+    client = app.test_client()
+    service = app_module.asset_presence_service
+    try:
+        with app.app_context(): # What /api/assets/presence would have to do without asset_presence
+            start = time.perf_counter()
+            scanned = db.session.execute(text("""
+                SELECT a.id, a.asset_name, g.unit_id, g.seen_at, s.unit_id, s.seen_at, s.rssi, s.location_description,
+                       c.direction, c.crossed_at
+                FROM assets AS a
+                LEFT JOIN LATERAL (SELECT unit_id, coalesce(event_time, received_at) AS seen_at FROM guardian_events
+                                   WHERE asset_id = a.id ORDER BY coalesce(event_time, received_at) DESC LIMIT 1) AS g ON true
+                LEFT JOIN LATERAL (SELECT direction, coalesce(event_time, received_at) AS crossed_at FROM guardian_events
+                                   WHERE asset_id = a.id AND direction IN ('ingress', 'egress')
+                                   ORDER BY coalesce(event_time, received_at) DESC LIMIT 1) AS c ON true
+                LEFT JOIN LATERAL (SELECT unit_id, coalesce(reported_at_device, received_at_server) AS seen_at, rssi, location_description
+                                   FROM subunit_events WHERE asset_id = a.id
+                                   ORDER BY coalesce(reported_at_device, received_at_server) DESC LIMIT 1) AS s ON true
+                WHERE a.is_active AND (g.seen_at IS NOT NULL OR s.seen_at IS NOT NULL)
+            """)).all()
+            print(f"Scan of the event tables      : {len(scanned):>7} assets, {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+            # Fill asset_presence with the same state (in production, ingest keeps it current)
+            AssetPresence.query.delete()
+            for offset in range(0, len(scanned), 5000):
+                rows, inserted = [], []
+                for asset_id, _, guardian_unit, guardian_seen, subunit_unit, subunit_seen, rssi, location, direction, crossed_at \
+                        in scanned[offset:offset + 5000]:
+                    if crossed_at:
+                        rows.append({'asset_id': asset_id, 'tag_id': 'BENCH', 'unit_id': guardian_unit, 'direction': direction,
+                                     'event_time': crossed_at}); inserted.append((0, crossed_at))
+                    if guardian_seen:
+                        rows.append({'asset_id': asset_id, 'tag_id': 'BENCH', 'unit_id': guardian_unit, 'event_time': guardian_seen})
+                        inserted.append((0, guardian_seen))
+                    if subunit_seen and (not guardian_seen or subunit_seen > guardian_seen):
+                        rows.append({'asset_id': asset_id, 'tag_id': 'BENCH', 'unit_id': subunit_unit, 'event_time': subunit_seen,
+                                     'rssi': rssi, 'location_description': location}); inserted.append((0, subunit_seen))
+                service.record_sightings('guardian', rows, inserted)
+            db.session.commit()
+            db.session.execute(text("ANALYZE asset_presence")); db.session.commit()
+
+        for label, query in (("whole yard", {}), ("out of the yard", {'direction': 'egress'})):
+            start = time.perf_counter()
+            response = client.get('/api/assets/presence', query_string=query)
+            assert response.status_code == 200
+            print(f"/api/assets/presence ({label:<15}): {len(response.get_json()):>7} assets, {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+        app_module.tag_asset_cache.clear()
+        for label, presence_service in (("without presence upsert", None), ("with presence upsert", service)):
+            app_module.asset_presence_service = presence_service
+            batch = [{"unit_id": f"{BENCH_UNIT_ID}_OVERHEAD",
+                      "event": {"timestamp_iso": datetime.now(timezone.utc).isoformat(), "direction": ('ingress', 'egress')[i % 2],
+                                "tag_id": f"BENCHP{1 + (i * 7919) % asset_count:08x}"}}
+                     for i in range(batch_size)]
+            client.post('/api/guardian_events/batch', json=batch) # Warms the tag cache
+            start = time.perf_counter()
+            assert client.post('/api/guardian_events/batch', json=batch).status_code == 201
+            print(f"Batch of {batch_size} {label}: {(time.perf_counter() - start) / batch_size * 1e6:.1f} us/event")
+    finally:
+        app_module.asset_presence_service = service
+        with app.app_context():
+            db.session.execute(text("DELETE FROM subunit_events WHERE unit_id LIKE :prefix"), {'prefix': BENCH_UNIT_ID + '%'})
+            db.session.commit()
+        _delete_seeded_guardian_events()
+        with app.app_context():
+            db.session.execute(text("DELETE FROM assets WHERE rfid_tag_assigned LIKE 'BENCHP%'")) # Cascades to asset_presence
+            db.session.commit()
+        app_module.tag_asset_cache.clear()
+
+
+def bench_stats(row_count=5_000_000, ranges=(timedelta(hours=24), timedelta(days=7), timedelta(days=30))):
+    """
+    /api/stats over ranges of increasing width, counted from the raw events (no rollups yet) and
+    then from the hourly rollups. Seeds row_count guardian_events (~1 row/second back from now).
+    The rollup tables are cleared before and after; the next periodic run rebuilds them.
+    """
+    def clear_rollups():
+        with app.app_context():
+            EventRollupHourly.query.delete(); EventRollupState.query.delete()
+            db.session.commit()
+
+    print(f"Seeding {row_count} guardian_events rows...")
+    _seed_synthetic_guardian_events(row_count)
+    client = app.test_client()
+    headers = _bench_auth_headers()
+    now = datetime.now(timezone.utc)
+    try:
+        for label in ("raw scan", "rollups"):
+            if label == "rollups":
+                start = time.perf_counter()
+                hours = app_module.event_rollups.run_once()
+                print(f"Rolled up {hours} hours in {time.perf_counter() - start:.1f} s")
+            else:
+                clear_rollups()
+            for width in ranges:
+                for bucket, group_by in (('hour', ''), ('day', 'unit_id,direction')):
+                    query = {'bucket': bucket, 'group_by': group_by, 'source': 'guardian', 'since': (now - width).isoformat()}
+                    start = time.perf_counter()
+                    response = client.get('/api/stats', query_string=query, headers=headers)
+                    elapsed = time.perf_counter() - start
+                    assert response.status_code == 200, response.get_json()
+                    buckets = response.get_json()['buckets']
+                    print(f"{label:<8} {str(width):>16} {bucket:<4} {group_by or '-':<17}: {len(buckets):>6} rows, "
+                          f"{sum(row['count'] for row in buckets):>9} events, {elapsed * 1000:9.1f} ms")
+    finally:
+        _delete_seeded_guardian_events()
+        clear_rollups()
+
+
+BENCHMARKS = {
+    'ingest': bench_guardian_ingest,
+    'event_pagination': bench_event_pagination,
+    'event_time_range': bench_event_time_range,
+    'query_counts': bench_event_list_query_counts,
+    'export_memory': bench_export_memory,
+    'lorawan_uplink': bench_lorawan_uplink,
+    'media_upload': bench_media_upload,
+    'alerts': bench_alert_engine,
+    'fsma_report': bench_fsma_report,
+    'asset_presence': bench_asset_presence,
+    'stats': bench_stats,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FarmGuard API server benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark]()
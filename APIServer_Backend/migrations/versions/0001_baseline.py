@@ -0,0 +1,26 @@
+"""Baseline: the schema as it was before migrations were introduced
+
+Databases created from Database/schema_postgres.sql (or db.create_all()) before this point
+are at this revision; mark them with `flask --app APIServer_Backend.app db stamp 0001_baseline`
+and then `db upgrade`. A database created from the current schema_postgres.sql is already at
+head: `db stamp head`.
+
+Revision ID: 0001_baseline
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
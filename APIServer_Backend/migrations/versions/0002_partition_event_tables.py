@@ -0,0 +1,113 @@
+"""Partition guardian_events and subunit_events by month on their receive time
+
+The existing table is not copied. It becomes the <table>_legacy partition, covering everything
+up to the first of a month after the migration runs, and new months get their own partitions
+from there on (the API server keeps creating upcoming ones). The full-table passes, which
+validate the range and build the (id, receive time) primary key and the parent's indexes, run
+before the swap in autocommit (CREATE INDEX CONCURRENTLY) without blocking writes. Under the lock
+the swap changes only the catalog: ATTACH PARTITION links the legacy table's matching indexes
+instead of building them.
+
+Revision ID: 0002_partition_event_tables
+Revises: 0001_baseline
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_partition_event_tables'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+# table, partition column, indexes created on the partitioned parent (and so on every partition)
+EVENT_TABLES = [
+    ('guardian_events', 'received_at', [
+        ('idx_guardian_events_timestamp_iso', 'timestamp_iso'),
+        ('idx_guardian_events_received_at_id', 'received_at, id'),
+        ('idx_guardian_events_unit_received_at_id', 'unit_id, received_at, id'),
+        ('idx_guardian_events_tag_received_at_id', 'tag_id, received_at, id'),
+        ('idx_guardian_events_asset_received_at_id', 'asset_id, received_at, id'),
+        ('idx_guardian_events_direction_received_at_id', 'direction, received_at, id'),
+    ]),
+    ('subunit_events', 'received_at_server', [
+        ('idx_subunit_events_tag_id', 'tag_id'),
+        ('idx_subunit_events_asset_id', 'asset_id'),
+        ('idx_subunit_events_received_at_server', 'received_at_server'),
+    ]),
+]
+
+
+def _next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _utc_literal(value):
+    return f"'{value:%Y-%m-%d %H:%M:%S}+00'"
+
+
+def upgrade():
+    bind = op.get_bind()
+    for table, column, indexes in EVENT_TABLES:
+        if bind.execute(sa.text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+                        {'table': table}).first():
+            continue # Created from the partitioned schema_postgres.sql
+
+        # Everything received so far, plus a couple of days of slack for the rest of the migration,
+        # stays in the legacy partition; it ends on a month boundary so monthly partitions follow on.
+        op.execute(f"UPDATE {table} SET {column} = now() WHERE {column} IS NULL")
+        newest = bind.execute(sa.text(f"SELECT greatest(max({column}), now() + interval '2 days') AT TIME ZONE 'UTC' FROM {table}")).scalar()
+        legacy_until = _next_month(newest)
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_legacy_range "
+                   f"CHECK ({column} IS NOT NULL AND {column} < {_utc_literal(legacy_until)}) NOT VALID")
+
+        with op.get_context().autocommit_block(): # Long scans; reads and writes carry on
+            op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_legacy_range")
+            op.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_legacy_pkey_idx ON {table} (id, {column})")
+            existing = bind.execute(sa.text("SELECT indexdef FROM pg_indexes WHERE tablename = :table"), {'table': table}).scalars().all()
+            for index_name, columns in indexes: # One the table already has (any name) is attached as it is
+                if not any(definition.startswith('CREATE INDEX ') and definition.endswith(f" USING btree ({columns})")
+                           for definition in existing):
+                    op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+        # The swap: catalog changes only. SET NOT NULL and ATTACH PARTITION rely on the validated
+        # CHECK instead of scanning, and the indexes built above and the foreign key are attached as they are.
+        op.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+        primary_key = bind.execute(sa.text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"),
+                                   {'table': table}).scalar()
+        sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}).scalar()
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {primary_key}")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_legacy_pkey PRIMARY KEY USING INDEX {table}_legacy_pkey_idx")
+        for (index_name,) in bind.execute(sa.text("SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname <> :pkey"),
+                                          {'table': table, 'pkey': f"{table}_legacy_pkey"}).all():
+            op.execute(f"ALTER INDEX {index_name} RENAME TO {index_name[:56]}_legacy")
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+
+        op.execute(f"CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE ({column})")
+        op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {column})")
+        op.execute(f"ALTER TABLE {table} ADD FOREIGN KEY (asset_id) REFERENCES assets(id) ON DELETE SET NULL")
+        if sequence:
+            op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+        for index_name, columns in indexes:
+            op.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+        op.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO ({_utc_literal(legacy_until)})")
+        op.execute(f"ALTER TABLE {table}_legacy DROP CONSTRAINT {table}_legacy_range") # Implied by the partition bound now
+
+        month = legacy_until
+        for _ in range(MONTHS_AHEAD):
+            op.execute(f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+                       f"FOR VALUES FROM ({_utc_literal(month)}) TO ({_utc_literal(_next_month(month))})")
+            month = _next_month(month)
+
+
+def downgrade():
+    # Going back means rewriting every event into one table; do that deliberately, not as a side effect
+    raise NotImplementedError("0002_partition_event_tables cannot be downgraded automatically")
@@ -0,0 +1,102 @@
+"""Store Guardian device time as timestamptz (guardian_events.event_time)
+
+Adds the nullable event_time column (a catalog change) and a BEFORE INSERT trigger that parses
+timestamp_iso into it whenever the inserting code did not, so rows written by API servers that
+predate the column are covered too. Existing rows are then converted in id ranges of
+BATCH_SIZE, each committed on its own: every batch holds row locks on at most BATCH_SIZE rows
+for a moment and ingest carries on. Timestamps that cannot be parsed stay NULL (the string is
+still in timestamp_iso and raw_event_payload). The (event_time, id) index is built partition by
+partition with CREATE INDEX CONCURRENTLY and attached to the parent, replacing the text index on
+timestamp_iso. Needs PostgreSQL 13+ (BEFORE triggers on partitioned tables).
+
+Revision ID: 0003_guardian_event_time
+Revises: 0002_partition_event_tables
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+import time
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_guardian_event_time'
+down_revision = '0002_partition_event_tables'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+BATCH_PAUSE_SECONDS = 0.05 # Lets autovacuum and replicas keep up between batches
+INDEX_NAME = 'idx_guardian_events_event_time_id'
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.execute("ALTER TABLE guardian_events ADD COLUMN IF NOT EXISTS event_time TIMESTAMP WITH TIME ZONE")
+    op.execute("""
+        CREATE OR REPLACE FUNCTION parse_device_time(value TEXT)
+        RETURNS TIMESTAMP WITH TIME ZONE AS $$
+        BEGIN
+          RETURN value::TIMESTAMP WITH TIME ZONE;
+        EXCEPTION WHEN others THEN
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql STABLE SET timezone TO 'UTC'
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION trigger_set_event_time()
+        RETURNS TRIGGER AS $$
+        BEGIN
+          NEW.event_time = parse_device_time(NEW.timestamp_iso);
+          RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("DROP TRIGGER IF EXISTS set_guardian_events_event_time ON guardian_events")
+    op.execute("""
+        CREATE TRIGGER set_guardian_events_event_time
+        BEFORE INSERT ON guardian_events
+        FOR EACH ROW WHEN (NEW.event_time IS NULL)
+        EXECUTE FUNCTION trigger_set_event_time()
+    """)
+    # The parent index starts out invalid and covers nothing; partitions created from here on get theirs automatically
+    op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY guardian_events (event_time, id)")
+
+    with op.get_context().autocommit_block(): # From here every statement commits on its own
+        # Rows inserted after this point get event_time from the API server or the trigger
+        first_id, last_id = bind.execute(sa.text("SELECT min(id), max(id) FROM guardian_events")).one()
+        converted = 0
+        if first_id is not None:
+            for batch, lower in enumerate(range(first_id - 1, last_id, BATCH_SIZE), 1):
+                converted += bind.execute(sa.text("""
+                    UPDATE guardian_events SET event_time = parse_device_time(timestamp_iso)
+                    WHERE id > :lower AND id <= :upper AND event_time IS NULL
+                """), {'lower': lower, 'upper': lower + BATCH_SIZE}).rowcount
+                if batch % 100 == 0:
+                    print(f"0003_guardian_event_time: converted {converted} row(s), up to id {lower + BATCH_SIZE} of {last_id}")
+                time.sleep(BATCH_PAUSE_SECONDS)
+        print(f"0003_guardian_event_time: converted {converted} row(s)")
+
+        # Built after the backfill so the updates above don't have to maintain it
+        partitions = bind.execute(sa.text("""
+            SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = CAST('guardian_events' AS regclass)
+        """)).scalars().all()
+        for partition in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_event_time_id_idx ON {partition} (event_time, id)")
+            op.execute(f"ALTER INDEX {INDEX_NAME} ATTACH PARTITION {partition}_event_time_id_idx") # Valid once all are attached
+
+        # Dropping a partitioned index can't be done concurrently, but it is a catalog change
+        op.execute("SET lock_timeout = '10s'")
+        op.execute("DROP INDEX IF EXISTS idx_guardian_events_timestamp_iso")
+        op.execute("RESET lock_timeout")
+
+
+def downgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS idx_guardian_events_timestamp_iso ON guardian_events (timestamp_iso)")
+    op.execute("DROP TRIGGER IF EXISTS set_guardian_events_event_time ON guardian_events")
+    op.execute("DROP FUNCTION IF EXISTS trigger_set_event_time()")
+    op.execute("DROP FUNCTION IF EXISTS parse_device_time(TEXT)")
+    op.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+    op.execute("ALTER TABLE guardian_events DROP COLUMN IF EXISTS event_time")
@@ -0,0 +1,87 @@
+"""Add asset_presence, the per-asset last-seen state, and fill it from the event tables
+
+The backfill walks assets in id ranges of BATCH_ASSETS, committing each range, and finds each
+asset's newest Guardian and SubUnit sighting through the (asset_id, ...) indexes. It uses the
+same forward-only upsert as ingest (services/asset_presence.py), so it is safe to run while API
+servers are already upserting and can be re-run; sightings ingested by servers still on the
+previous release are picked up the next time those assets are seen.
+
+Revision ID: 0004_asset_presence
+Revises: 0003_guardian_event_time
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_asset_presence'
+down_revision = '0003_guardian_event_time'
+branch_labels = None
+depends_on = None
+
+BATCH_ASSETS = 1000
+
+SIGHTING_COLUMNS = ['tag_id', 'last_source', 'last_event_id', 'last_unit_id', 'last_seen_at', 'last_received_at',
+                    'last_rssi', 'last_location_description']
+CROSSING_COLUMNS = ['last_direction', 'last_crossed_at']
+NEWER = "asset_presence.last_seen_at <= EXCLUDED.last_seen_at"
+CROSSED = ("EXCLUDED.last_crossed_at IS NOT NULL AND "
+           "(asset_presence.last_crossed_at IS NULL OR asset_presence.last_crossed_at <= EXCLUDED.last_crossed_at)")
+UPSERT = (f"INSERT INTO asset_presence (asset_id, {', '.join(SIGHTING_COLUMNS + CROSSING_COLUMNS)}) {{select}} "
+          f"ON CONFLICT (asset_id) DO UPDATE SET "
+          + ', '.join([f"{name} = CASE WHEN {NEWER} THEN EXCLUDED.{name} ELSE asset_presence.{name} END" for name in SIGHTING_COLUMNS]
+                      + [f"{name} = CASE WHEN {CROSSED} THEN EXCLUDED.{name} ELSE asset_presence.{name} END" for name in CROSSING_COLUMNS])
+          + f" WHERE ({NEWER}) OR ({CROSSED})")
+
+# Newest sighting per asset in the range, then its newest gate crossing (one index probe per asset)
+GUARDIAN_SELECT = """
+    SELECT seen.asset_id, seen.tag_id, 'guardian', seen.id, seen.unit_id, seen.seen_at, seen.received_at, NULL, NULL,
+           crossing.direction, crossing.crossed_at
+    FROM (SELECT DISTINCT ON (asset_id) asset_id, tag_id, id, unit_id, coalesce(event_time, received_at) AS seen_at, received_at
+          FROM guardian_events WHERE asset_id >= :lower AND asset_id < :upper
+          ORDER BY asset_id, coalesce(event_time, received_at) DESC, id DESC) AS seen
+    LEFT JOIN LATERAL (SELECT direction, coalesce(event_time, received_at) AS crossed_at
+                       FROM guardian_events
+                       WHERE asset_id = seen.asset_id AND direction IN ('ingress', 'egress')
+                       ORDER BY coalesce(event_time, received_at) DESC, id DESC LIMIT 1) AS crossing ON true
+"""
+SUBUNIT_SELECT = """
+    SELECT DISTINCT ON (asset_id) asset_id, tag_id, 'subunit', id, unit_id, coalesce(reported_at_device, received_at_server),
+           received_at_server, rssi, location_description, NULL, NULL
+    FROM subunit_events WHERE asset_id >= :lower AND asset_id < :upper
+    ORDER BY asset_id, coalesce(reported_at_device, received_at_server) DESC, id DESC
+"""
+
+
+def upgrade():
+    op.create_table(
+        'asset_presence',
+        sa.Column('asset_id', sa.Integer(), sa.ForeignKey('assets.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('tag_id', sa.String(length=100), nullable=False),
+        sa.Column('last_source', sa.String(length=20), nullable=False),
+        sa.Column('last_event_id', sa.Integer(), nullable=False),
+        sa.Column('last_unit_id', sa.String(length=50), nullable=False),
+        sa.Column('last_seen_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_received_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_rssi', sa.Integer(), nullable=True),
+        sa.Column('last_location_description', sa.String(length=255), nullable=True),
+        sa.Column('last_direction', sa.String(length=20), nullable=True),
+        sa.Column('last_crossed_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('idx_asset_presence_direction_asset_id', 'asset_presence', ['last_direction', 'asset_id'])
+    op.create_index('idx_asset_presence_unit_asset_id', 'asset_presence', ['last_unit_id', 'asset_id'])
+    op.create_index('idx_asset_presence_received_at', 'asset_presence', ['last_received_at'])
+
+    bind = op.get_bind()
+    with op.get_context().autocommit_block(): # One short transaction per range of assets
+        last_asset_id = bind.execute(sa.text("SELECT max(id) FROM assets")).scalar() or 0
+        for lower in range(0, last_asset_id + 1, BATCH_ASSETS):
+            for select in (GUARDIAN_SELECT, SUBUNIT_SELECT):
+                bind.execute(sa.text(UPSERT.format(select=select)), {'lower': lower, 'upper': lower + BATCH_ASSETS})
+        print(f"0004_asset_presence: {bind.execute(sa.text('SELECT count(*) FROM asset_presence')).scalar()} asset(s) placed")
+
+
+def downgrade():
+    op.drop_table('asset_presence')
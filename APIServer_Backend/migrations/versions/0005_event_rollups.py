@@ -0,0 +1,43 @@
+"""Add event_rollups_hourly and event_rollup_state for /api/stats
+
+Only creates the (empty) tables. The API server's rollup job fills them, working through the
+existing events a chunk of hours at a time; until it has caught up, /api/stats counts the
+remaining range from the event tables.
+
+Revision ID: 0005_event_rollups
+Revises: 0004_asset_presence
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_event_rollups'
+down_revision = '0004_asset_presence'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'event_rollups_hourly',
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('source', sa.String(length=20), nullable=False),
+        sa.Column('unit_id', sa.String(length=50), nullable=False),
+        sa.Column('asset_type', sa.String(length=100), nullable=False),
+        sa.Column('direction', sa.String(length=20), nullable=False),
+        sa.Column('event_count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_start', 'source', 'unit_id', 'asset_type', 'direction'),
+    )
+    op.create_table(
+        'event_rollup_state',
+        sa.Column('source', sa.String(length=20), primary_key=True),
+        sa.Column('rolled_up_until', sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('event_rollup_state')
+    op.drop_table('event_rollups_hourly')
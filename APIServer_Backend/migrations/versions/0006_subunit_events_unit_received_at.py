@@ -0,0 +1,40 @@
+"""Index subunit_events on (unit_id, received_at_server)
+
+The unit_silent check reads each watched unit's latest event from the event tables;
+guardian_events already has (unit_id, received_at, id). The index is built partition by
+partition with CREATE INDEX CONCURRENTLY and attached to the parent, so ingest carries on.
+
+Revision ID: 0006_subunit_events_unit_received_at
+Revises: 0005_event_rollups
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_subunit_events_unit_received_at'
+down_revision = '0005_event_rollups'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'idx_subunit_events_unit_received_at'
+
+
+def upgrade():
+    bind = op.get_bind()
+    # The parent index starts out invalid and covers nothing; partitions created from here on get theirs automatically
+    op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY subunit_events (unit_id, received_at_server)")
+    with op.get_context().autocommit_block():
+        partitions = bind.execute(sa.text("""
+            SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = CAST('subunit_events' AS regclass)
+        """)).scalars().all()
+        for partition in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_unit_received_at_idx ON {partition} (unit_id, received_at_server)")
+            op.execute(f"ALTER INDEX {INDEX_NAME} ATTACH PARTITION {partition}_unit_received_at_idx") # Valid once all are attached
+
+
+def downgrade():
+    op.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
@@ -1,6 +1,7 @@
 # APIServer_Backend/models.py
 from .app import db, bcrypt # Import db and bcrypt instance from app.py
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -13,8 +14,8 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    # Example: Relationship for who acknowledged alerts (add if you have Alert model later)
-    # acknowledged_alerts = db.relationship('Alert', backref='acknowledged_by_user', lazy='dynamic')
+    # Alerts this user acknowledged
+    acknowledged_alerts = db.relationship('Alert', backref='acknowledged_by_user', lazy='dynamic')
 
     def __init__(self, username, email, password, role='viewer', is_active=True):
         self.username = username
@@ -46,6 +47,16 @@ class User(db.Model):
 
 class Asset(db.Model):
     __tablename__ = 'assets'
+    # Keyset pagination for /api/assets (ordered by name, id) with the supported filters, plus
+    # trigram indexes so ?search= substring matches don't scan the table (requires pg_trgm).
+    __table_args__ = (
+        db.Index('idx_assets_active_name_id', 'is_active', 'asset_name', 'id'),
+        db.Index('idx_assets_type_name_id', 'asset_type', 'asset_name', 'id'),
+        db.Index('idx_assets_status_name_id', 'current_status', 'asset_name', 'id'),
+        db.Index('idx_assets_name_trgm', 'asset_name', postgresql_using='gin', postgresql_ops={'asset_name': 'gin_trgm_ops'}),
+        db.Index('idx_assets_rfid_tag_trgm', 'rfid_tag_assigned', postgresql_using='gin', postgresql_ops={'rfid_tag_assigned': 'gin_trgm_ops'}),
+        db.Index('idx_assets_serial_trgm', 'serial_number', postgresql_using='gin', postgresql_ops={'serial_number': 'gin_trgm_ops'}),
+    )
     id = db.Column(db.Integer, primary_key=True)
     asset_name = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -55,11 +66,11 @@ class Asset(db.Model):
     purchase_date = db.Column(db.Date, nullable=True)
     current_status = db.Column(db.String(50), nullable=True, default='unknown')
     
-    is_active = db.Column(db.Boolean, default=True, nullable=False, index=True) # Soft delete
+    is_active = db.Column(db.Boolean, default=True, nullable=False) # Soft delete
     deleted_at = db.Column(db.DateTime, nullable=True) # Soft delete timestamp
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True) # ETag watermark
 
     # Relationships (relying on ondelete='SET NULL' on the FK side)
     guardian_events = db.relationship('GuardianEvent', backref='asset', lazy='dynamic')
@@ -87,21 +98,40 @@ class Asset(db.Model):
 
 class GuardianEvent(db.Model):
     __tablename__ = 'guardian_events'
+    # On PostgreSQL the table is partitioned by month on received_at, with primary key
+    # (id, received_at); it is created by Database/schema_postgres.sql or the migrations, not
+    # create_all(). Keyset pagination indexes: newest-first listing on (received_at, id),
+    # optionally narrowed by an equality filter. They also cover plain lookups on their leading column.
+    __table_args__ = (
+        db.Index('idx_guardian_events_received_at_id', 'received_at', 'id'),
+        db.Index('idx_guardian_events_unit_received_at_id', 'unit_id', 'received_at', 'id'),
+        db.Index('idx_guardian_events_tag_received_at_id', 'tag_id', 'received_at', 'id'),
+        db.Index('idx_guardian_events_asset_received_at_id', 'asset_id', 'received_at', 'id'),
+        db.Index('idx_guardian_events_direction_received_at_id', 'direction', 'received_at', 'id'),
+        # Device-time range queries (?event_since/?event_until)
+        db.Index('idx_guardian_events_event_time_id', 'event_time', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     unit_id = db.Column(db.String(50), nullable=False)
-    timestamp_iso = db.Column(db.String(50), nullable=False)
-    tag_id = db.Column(db.String(100), nullable=False, index=True)
-    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='SET NULL'), nullable=True, index=True)
+    timestamp_iso = db.Column(db.String(50), nullable=False) # As sent by the unit (also kept in raw_event_payload)
+    # Device time parsed once at ingest (see parse_event_time in app.py). NULL only for legacy rows
+    # whose timestamp_iso could not be parsed by the backfill.
+    event_time = db.Column(db.DateTime(timezone=True), nullable=True)
+    tag_id = db.Column(db.String(100), nullable=False)
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='SET NULL'), nullable=True)
     video_url_remote = db.Column(db.String(512), nullable=True)
+    thumbnail_url = db.Column(db.String(512), nullable=True) # JPEG keyframe, uploaded ahead of the video
+    proxy_url = db.Column(db.String(512), nullable=True) # Low-bitrate preview clip, uploaded ahead of the original
     direction = db.Column(db.String(20), nullable=True)
-    raw_event_payload = db.Column(db.JSONB, nullable=True)
-    received_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    raw_event_payload = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False) # Partition key
 
     def __repr__(self):
         return f"<GuardianEvent {self.id} - Unit {self.unit_id} - Tag {self.tag_id}>"
     
     def to_dict(self):
         asset_info = None
+        # List endpoints eager-load self.asset (see event_asset_info_load in app.py); otherwise this is a lazy SELECT
         if self.asset: # Check if asset relationship is loaded (due to backref) and not None (due to SET NULL)
             asset_info = { 
                 "id": self.asset.id, 
@@ -112,10 +142,13 @@ class GuardianEvent(db.Model):
             'id': self.id,
             'unit_id': self.unit_id,
             'timestamp_iso': self.timestamp_iso,
+            'event_time': self.event_time.isoformat() if self.event_time else None,
             'tag_id': self.tag_id,
             'asset_id': self.asset_id,
             'asset_info': asset_info,
             'video_url_remote': self.video_url_remote,
+            'thumbnail_url': self.thumbnail_url,
+            'proxy_url': self.proxy_url,
             'direction': self.direction,
             'raw_event_payload': self.raw_event_payload,
             'received_at': self.received_at.isoformat() if self.received_at else None
@@ -123,6 +156,10 @@ class GuardianEvent(db.Model):
 
 class SubUnitEvent(db.Model):
     __tablename__ = 'subunit_events'
+    # Partitioned by month on received_at_server on PostgreSQL, like guardian_events
+    __table_args__ = (
+        db.Index('idx_subunit_events_unit_received_at', 'unit_id', 'received_at_server'), # Latest event per unit (unit_silent)
+    )
     id = db.Column(db.Integer, primary_key=True)
     unit_id = db.Column(db.String(50), nullable=False) 
     tag_id = db.Column(db.String(100), nullable=True, index=True) 
@@ -133,13 +170,14 @@ class SubUnitEvent(db.Model):
     snr = db.Column(db.Float, nullable=True)
     raw_lorawan_payload = db.Column(db.Text, nullable=True) 
     reported_at_device = db.Column(db.DateTime, nullable=True) 
-    received_at_server = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    received_at_server = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True) # Partition key
 
     def __repr__(self):
         return f"<SubUnitEvent {self.id} - Unit {self.unit_id}>"
 
     def to_dict(self):
         asset_info = None
+        # List endpoints eager-load self.asset (see event_asset_info_load in app.py); otherwise this is a lazy SELECT
         if self.asset: # Check if asset relationship is loaded and not None
             asset_info = { 
                 "id": self.asset.id, 
@@ -161,4 +199,211 @@ class SubUnitEvent(db.Model):
             'received_at_server': self.received_at_server.isoformat() if self.received_at_server else None
         }
 
-print("models.py loaded with User, Asset, GuardianEvent, SubUnitEvent models.")
+class MediaFile(db.Model):
+    __tablename__ = 'media_files'
+    # Content-addressed: one row (and one file on disk) per distinct SHA-256, however many
+    # events or retries reference it. status is 'uploading' until every byte has arrived and
+    # the digest has been verified, then 'complete'.
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    original_filename = db.Column(db.String(255), nullable=True)
+    unit_id = db.Column(db.String(50), nullable=True) # First unit that uploaded it
+    status = db.Column(db.String(20), nullable=False, default='uploading')
+    storage_path = db.Column(db.String(512), nullable=True) # Relative to the media storage root, set when complete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<MediaFile {self.sha256[:12]} ({self.status})>"
+
+    def to_dict(self):
+        return {
+            'sha256': self.sha256,
+            'size_bytes': self.size_bytes,
+            'content_type': self.content_type,
+            'original_filename': self.original_filename,
+            'unit_id': self.unit_id,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class MediaRequest(db.Model):
+    __tablename__ = 'media_requests'
+    # Originals that a dashboard user asked for; the owning Guardian polls for these and uploads
+    # them ahead of its idle-time backlog. Deleted when the upload completes.
+    sha256 = db.Column(db.String(64), primary_key=True)
+    unit_id = db.Column(db.String(50), nullable=False, index=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<MediaRequest {self.sha256[:12]} from {self.unit_id}>"
+
+class AlertRule(db.Model):
+    __tablename__ = 'alert_rules'
+    # Evaluated by services/alert_service.py; unit_id/asset_id narrow a rule's scope (NULL = any).
+    # after_hours_exit uses allowed_from/allowed_until (wrapping past midnight when from > until),
+    # unit_silent uses silent_minutes and needs a unit_id.
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(150), nullable=False)
+    rule_type = db.Column(db.String(50), nullable=False) # 'unknown_tag', 'inactive_asset', 'after_hours_exit', 'unit_silent'
+    unit_id = db.Column(db.String(50), nullable=True)
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='CASCADE'), nullable=True)
+    severity = db.Column(db.String(20), nullable=False, default='medium')
+    allowed_from = db.Column(db.Time, nullable=True)
+    allowed_until = db.Column(db.Time, nullable=True)
+    silent_minutes = db.Column(db.Integer, nullable=True)
+    suppress_minutes = db.Column(db.Integer, nullable=False, default=60) # Repeats within this window fold into one alert
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<AlertRule {self.id}: {self.rule_type} {self.name}>"
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'rule_type': self.rule_type,
+            'unit_id': self.unit_id,
+            'asset_id': self.asset_id,
+            'severity': self.severity,
+            'allowed_from': self.allowed_from.strftime('%H:%M') if self.allowed_from else None,
+            'allowed_until': self.allowed_until.strftime('%H:%M') if self.allowed_until else None,
+            'silent_minutes': self.silent_minutes,
+            'suppress_minutes': self.suppress_minutes,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class Alert(db.Model):
+    __tablename__ = 'alerts'
+    # One row per distinct alert; repeats inside the rule's suppression window only bump
+    # occurrence_count and last_seen_at. event_id is the triggering event (from event_source's
+    # table) and deliberately not a foreign key, so old events can be archived independently.
+    __table_args__ = (
+        db.Index('idx_alerts_status_id', 'status', 'id'),
+        db.Index('idx_alerts_unit_id_id', 'unit_id', 'id'),
+        db.Index('idx_alerts_tag_id_id', 'tag_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rules.id', ondelete='SET NULL'), nullable=True) # NULL for built-in defaults
+    alert_type = db.Column(db.String(50), nullable=False)
+    severity = db.Column(db.String(20), nullable=False)
+    unit_id = db.Column(db.String(50), nullable=True)
+    tag_id = db.Column(db.String(100), nullable=True)
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='SET NULL'), nullable=True)
+    event_source = db.Column(db.String(20), nullable=True) # 'guardian' or 'subunit'
+    event_id = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    occurrence_count = db.Column(db.Integer, nullable=False, default=1)
+    first_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), nullable=False, default='open') # 'open' or 'acknowledged'
+    acknowledged_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    acknowledged_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Alert {self.id}: {self.alert_type} ({self.status})>"
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'rule_id': self.rule_id,
+            'alert_type': self.alert_type,
+            'severity': self.severity,
+            'unit_id': self.unit_id,
+            'tag_id': self.tag_id,
+            'asset_id': self.asset_id,
+            'event_source': self.event_source,
+            'event_id': self.event_id,
+            'message': self.message,
+            'occurrence_count': self.occurrence_count,
+            'first_seen_at': self.first_seen_at.isoformat() if self.first_seen_at else None,
+            'last_seen_at': self.last_seen_at.isoformat() if self.last_seen_at else None,
+            'status': self.status,
+            'acknowledged_by': self.acknowledged_by,
+            'acknowledged_at': self.acknowledged_at.isoformat() if self.acknowledged_at else None
+        }
+
+class FSMARecord(db.Model):
+    __tablename__ = 'fsma_traceability_log'
+    # One Critical Tracking Event per tag read, with its Key Data Elements, written at ingest
+    # by services/fsma_processor.py. Traceability reports are range scans on one of the
+    # (key, event_time, id) indexes. product_description is the asset name at the time of the
+    # event, kept as recorded. event_id points into event_source's table without a foreign key,
+    # so raw events can be archived while the traceability records are retained.
+    __table_args__ = (
+        db.Index('idx_fsma_lot_event_time_id', 'traceability_lot_code', 'event_time', 'id'),
+        db.Index('idx_fsma_tag_event_time_id', 'tag_id', 'event_time', 'id'),
+        db.Index('idx_fsma_asset_event_time_id', 'asset_id', 'event_time', 'id'),
+        db.Index('idx_fsma_source_event_id', 'event_source', 'event_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    traceability_lot_code = db.Column(db.String(100), nullable=False)
+    product_description = db.Column(db.String(150), nullable=True)
+    cte_type = db.Column(db.String(30), nullable=False) # 'shipping', 'receiving', 'observation'
+    event_time = db.Column(db.DateTime(timezone=True), nullable=False) # Device time of the read
+    location_id = db.Column(db.String(50), nullable=False) # Guardian/SubUnit unit_id
+    location_description = db.Column(db.String(255), nullable=True)
+    tag_id = db.Column(db.String(100), nullable=False)
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='SET NULL'), nullable=True)
+    event_source = db.Column(db.String(20), nullable=False) # 'guardian' or 'subunit'
+    event_id = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FSMARecord {self.id}: {self.cte_type} {self.traceability_lot_code}>"
+
+class AssetPresence(db.Model):
+    __tablename__ = 'asset_presence'
+    # Where each asset was last seen, one row per asset, upserted at ingest by
+    # services/asset_presence.py. "Which assets are out of the yard" is an index range scan on
+    # last_direction; max(last_received_at) is the ETag watermark.
+    __table_args__ = (
+        db.Index('idx_asset_presence_direction_asset_id', 'last_direction', 'asset_id'),
+        db.Index('idx_asset_presence_unit_asset_id', 'last_unit_id', 'asset_id'),
+        db.Index('idx_asset_presence_received_at', 'last_received_at'),
+    )
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.String(100), nullable=False) # Tag of the last sighting
+    last_source = db.Column(db.String(20), nullable=False) # 'guardian' or 'subunit'
+    last_event_id = db.Column(db.Integer, nullable=False) # Row in last_source's event table
+    last_unit_id = db.Column(db.String(50), nullable=False)
+    last_seen_at = db.Column(db.DateTime(timezone=True), nullable=False) # Device time of the last sighting
+    last_received_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_rssi = db.Column(db.Integer, nullable=True) # SubUnit reads only
+    last_location_description = db.Column(db.String(255), nullable=True)
+    last_direction = db.Column(db.String(20), nullable=True) # Last gate crossing: 'ingress' or 'egress'
+    last_crossed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<AssetPresence {self.asset_id}: {self.last_direction or 'seen'} at {self.last_unit_id}>"
+
+class EventRollupHourly(db.Model):
+    __tablename__ = 'event_rollups_hourly'
+    # Events per UTC hour of receipt, maintained by services/event_rollups.py for /api/stats.
+    # The primary key leads with bucket_start, so a stats range is one index range scan.
+    # '' stands for "no asset type" / "no direction" (key columns can't be NULL).
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    source = db.Column(db.String(20), primary_key=True) # 'guardian' or 'subunit'
+    unit_id = db.Column(db.String(50), primary_key=True)
+    asset_type = db.Column(db.String(100), primary_key=True)
+    direction = db.Column(db.String(20), primary_key=True)
+    event_count = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<EventRollupHourly {self.bucket_start} {self.source} {self.unit_id}: {self.event_count}>"
+
+class EventRollupState(db.Model):
+    __tablename__ = 'event_rollup_state'
+    # Per source, everything received before rolled_up_until is in event_rollups_hourly
+    source = db.Column(db.String(20), primary_key=True)
+    rolled_up_until = db.Column(db.DateTime(timezone=True), nullable=False)
+
+print("models.py loaded with User, Asset, GuardianEvent, SubUnitEvent, MediaFile, MediaRequest, AlertRule, Alert, FSMARecord, "
+      "AssetPresence, EventRollupHourly, EventRollupState models.")
@@ -1,33 +1,395 @@
 # APIServer_Backend/services/alert_service.py
 """
-Handles alert generation and notifications.
+Alert rule engine, evaluated off the ingestion path.
+
+Ingest endpoints hand committed events to AlertService.submit(), which only puts them on an
+in-process queue; worker threads evaluate the rules and persist the resulting alerts in batches,
+so a request never waits for rule evaluation or alert writes. Rules are compiled into lookup
+tables keyed by asset and by unit, so an event is tested only against the rules that can apply
+to it, not against every rule. Repeats of an open alert within its suppression window (the same
+rule firing again for the same tag, e.g. a tag parked at a gate) are folded into that alert's
+occurrence_count instead of creating new alerts. Each worker remembers the alerts it opened; the
+first hit for a (rule, tag) it has not seen is also looked up among the stored open alerts, so
+another worker process (or this one before a restart) that already opened it gets the repeat.
+
+Rule types:
+    unknown_tag       a tag that is not assigned to any asset is seen
+    inactive_asset    a tag assigned to a deactivated (soft deleted) asset is seen
+    after_hours_exit  an asset leaves (direction 'egress') outside [allowed_from, allowed_until)
+                      on the reporting unit's clock
+    unit_silent       a unit has sent nothing for silent_minutes (judged from the event tables, by one
+                      server process at a time, so every process and restart agrees on it)
 """
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+UNKNOWN_TAG = 'unknown_tag'
+INACTIVE_ASSET = 'inactive_asset'
+AFTER_HOURS_EXIT = 'after_hours_exit'
+UNIT_SILENT = 'unit_silent'
+RULE_TYPES = (UNKNOWN_TAG, INACTIVE_ASSET, AFTER_HOURS_EXIT, UNIT_SILENT)
+SEVERITIES = ('low', 'medium', 'high', 'critical')
+SILENCE_LOCK_KEY = 7262019 # pg_try_advisory_lock key: one server process checks for silent units at a time
+
+# What the engine needs to know about an ingested event; built from data the endpoint already holds
+AlertEvent = namedtuple('AlertEvent', ['source', 'event_id', 'unit_id', 'tag_id', 'asset_id', 'asset_active',
+                                       'asset_name', 'direction', 'event_time', 'received_at'])
+
+# A rule as the engine sees it. rule_id is None for built-in defaults ([Alerts] default_rules).
+# The allowed window is in minutes after midnight; it wraps past midnight when from > until.
+Rule = namedtuple('Rule', ['rule_id', 'name', 'rule_type', 'unit_id', 'asset_id', 'severity',
+                           'allowed_from_minute', 'allowed_until_minute', 'silent_minutes', 'suppress_seconds'])
+
+
+def make_rule(rule_id, name, rule_type, unit_id=None, asset_id=None, severity='medium', allowed_from=None,
+              allowed_until=None, silent_minutes=None, suppress_minutes=60):
+    """Builds a Rule from model/config values (allowed_from/allowed_until are datetime.time or None)."""
+    return Rule(rule_id, name, rule_type, unit_id, asset_id, severity,
+                allowed_from.hour * 60 + allowed_from.minute if allowed_from else None,
+                allowed_until.hour * 60 + allowed_until.minute if allowed_until else None,
+                silent_minutes, (suppress_minutes or 0) * 60)
+
+
+def _as_naive_utc(moment):
+    """Naive UTC, the engine's convention, from either a naive-UTC or an aware datetime (timestamptz columns)."""
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _event_minute_of_day(event):
+    """Minute of day on the unit's own clock (event_time keeps the offset it was sent with), else server receive time."""
+    moment = event.event_time or event.received_at or datetime.utcnow()
+    return moment.hour * 60 + moment.minute
+
+
+def rule_matches(rule, event):
+    """Whether an event triggers the rule, scope included. Returns the alert message or None."""
+    if rule.unit_id is not None and rule.unit_id != event.unit_id:
+        return None
+    if rule.asset_id is not None and rule.asset_id != event.asset_id:
+        return None
+    if not event.tag_id:
+        return None # Heartbeats only count towards unit_silent
+    if rule.rule_type == UNKNOWN_TAG:
+        if event.asset_id is None:
+            return f"Unknown tag {event.tag_id} seen by {event.unit_id}"
+    elif rule.rule_type == INACTIVE_ASSET:
+        if event.asset_id is not None and event.asset_active is False:
+            return f"Inactive asset {event.asset_name or event.asset_id} (tag {event.tag_id}) seen by {event.unit_id}"
+    elif rule.rule_type == AFTER_HOURS_EXIT:
+        if event.direction == 'egress' and event.asset_id is not None and rule.allowed_from_minute is not None:
+            minute = _event_minute_of_day(event)
+            start, end = rule.allowed_from_minute, rule.allowed_until_minute
+            allowed = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if not allowed:
+                return (f"Asset {event.asset_name or event.asset_id} left via {event.unit_id} at "
+                        f"{minute // 60:02d}:{minute % 60:02d}, outside {start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}")
+    return None
+
+
+class CompiledRules:
+    """
+    Event rules indexed by scope: asset-scoped rules under their asset_id, the rest under their
+    unit_id (None = every unit). An event looks at three short lists instead of the whole rule set.
+    unit_silent rules are kept separately, per unit, for the silence check.
+    """
+    def __init__(self, rules):
+        self.count = len(rules)
+        self.by_asset = {}
+        self.by_unit = {}
+        self.silent_by_unit = {}
+        for rule in rules:
+            if rule.rule_type == UNIT_SILENT:
+                if rule.unit_id and rule.silent_minutes:
+                    self.silent_by_unit.setdefault(rule.unit_id, []).append(rule)
+            elif rule.asset_id is not None:
+                self.by_asset.setdefault(rule.asset_id, []).append(rule)
+            else:
+                self.by_unit.setdefault(rule.unit_id, []).append(rule)
+
+    def candidates(self, event):
+        return self.by_asset.get(event.asset_id, ()), self.by_unit.get(event.unit_id, ()), self.by_unit.get(None, ())
+
+    def evaluate(self, event):
+        """Returns [(rule, message)] for every rule the event triggers."""
+        hits = []
+        for rules in self.candidates(event):
+            for rule in rules:
+                message = rule_matches(rule, event)
+                if message:
+                    hits.append((rule, message))
+        return hits
+
+
 class AlertService:
-    def __init__(self):
-        print("Alert Service Initialized (placeholder).")
+    """
+    load_rules() -> [Rule] is called at start, every rules_refresh_seconds and on reload_rules().
+    persist_alerts(new_alerts, repeats) -> [alert id, ...] stores one batch: new_alerts are row dicts
+    (in order; one id is returned for each), repeats are (alert_id, extra_occurrences, last_seen_at).
+    Both run on the service's threads. Events are sharded across workers by tag, so all
+    occurrences of a tag are deduplicated by the same worker, lock-free. Tagless events (SubUnit
+    heartbeats) are not evaluated.
+    load_unit_activity(unit_ids) -> ({unit_id: latest event's receive time}, {(rule key, unit_id):
+    when its latest unit_silent alert was raised}) reads both from the database (naive UTC, or aware
+    as timestamptz columns return them), for the silence check; without it unit_silent rules are not checked. get_engine() returns the
+    SQLAlchemy engine whose advisory lock keeps the check to one server process at a time.
+    submit() hands each worker its share of a request's events as one list. When queue_size events
+    are already waiting, the new ones are counted as dropped instead; submit() never blocks.
+    New alerts (not repeats) are passed to notify(), which must not block either.
+    find_open_alerts([((rule key, tag_id), suppress_seconds), ...]) -> {(rule key, tag_id): alert_id}
+    returns the stored open alerts last seen within their window, for hits this worker has no open
+    alert for; without it suppression only holds within one process. Two processes that see a tag's
+    first occurrence in the same instant can still both open an alert.
+    """
+    def __init__(self, load_rules, persist_alerts, workers=2, queue_size=10000, batch_size=500,
+                 rules_refresh_seconds=60, silent_check_seconds=30, notify=None, load_unit_activity=None, get_engine=None,
+                 find_open_alerts=None):
+        self.load_rules = load_rules
+        self.persist_alerts = persist_alerts
+        self.notify = notify # notify([alert dict, ...]) for each batch of new alerts, e.g. NotificationDispatcher.enqueue_alerts
+        self.load_unit_activity = load_unit_activity
+        self.get_engine = get_engine
+        self.find_open_alerts = find_open_alerts
+        self.batch_size = batch_size
+        self.rules_refresh_seconds = rules_refresh_seconds
+        self.silent_check_seconds = silent_check_seconds
+        self._rules = CompiledRules([])
+        self.queue_size = queue_size
+        self._queues = [queue.Queue() for _ in range(workers)] # Lists of events, bounded by queue_size in total
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, args=(q,), name=f'alert-worker-{i}', daemon=True)
+                         for i, q in enumerate(self._queues)]
+        self._timer = threading.Thread(target=self._run_timer, name='alert-timer', daemon=True)
+        self._reload = threading.Event()
+        self.submitted = 0
+        self.dropped = 0
+        self.evaluated = 0
+        self.alerts_created = 0
+        self.alerts_suppressed = 0
+        self.persist_errors = 0
+        self.silence_checks = 0 # Run by this process (the others skip while it holds the lock)
+        self.rules_loaded_at = None
+        print(f"Alert Service Initialized ({workers} worker(s), queue_size={queue_size}).")
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        self._timer.start()
+
+    def submit(self, events):
+        """Called by ingest endpoints after commit; a few hundred nanoseconds per event and never blocks."""
+        shards = [[] for _ in self._queues]
+        for event in events:
+            if event.tag_id:
+                shards[hash(event.tag_id) % len(shards)].append(event)
+        count = sum(len(shard) for shard in shards)
+        with self._lock:
+            if self._pending + count > self.queue_size:
+                self.dropped += count
+                return
+            self._pending += count
+            self.submitted += count
+        for events_queue, shard in zip(self._queues, shards):
+            if shard:
+                events_queue.put(shard)
+
+    def reload_rules(self):
+        """Recompiles the rules soon (after a rule was created, changed or deleted)."""
+        self._reload.set()
+
+    def _load_rules(self):
+        try:
+            self._rules = CompiledRules(self.load_rules())
+            self.rules_loaded_at = datetime.utcnow()
+        except Exception as e:
+            print(f"Alert Service: error loading rules (keeping {self._rules.count} compiled rules): {e}")
+
+    def _work(self, events):
+        recent = {} # (rule key, tag_id) -> [last occurrence (monotonic), alert id]; owned by this worker
+        while True:
+            batch = list(events.get())
+            lists_taken = 1
+            while len(batch) < self.batch_size:
+                try:
+                    batch.extend(events.get_nowait())
+                    lists_taken += 1
+                except queue.Empty:
+                    break
+            try:
+                rules = self._rules # One consistent rule set per batch, even if a reload swaps it
+                hits = []
+                for event in batch:
+                    for rule, message in rules.evaluate(event):
+                        hits.append(((rule.rule_id or rule.rule_type, event.tag_id), rule, event, message))
+                if hits:
+                    self._record(hits, recent)
+            except Exception as e: # Keep the worker alive and the queue accounting right, whatever the batch held
+                print(f"Alert Service: error evaluating {len(batch)} event(s): {e}")
+            finally:
+                with self._lock:
+                    self._pending -= len(batch)
+                    self.evaluated += len(batch)
+                for _ in range(lists_taken):
+                    events.task_done()
 
-    def check_for_alerts(self, event_data):
+    def _record(self, hits, recent):
+        """Turns hits into new alerts or repeats of open ones, then persists them in one call."""
+        now = time.monotonic()
+        now_dt = datetime.utcnow()
+        new_alerts, new_keys, repeats = {}, [], {}
+        for key, rule, event, message in hits:
+            if key in new_alerts: # Fired earlier in this same batch
+                new_alerts[key]['occurrence_count'] += 1
+                new_alerts[key]['last_seen_at'] = now_dt
+                continue
+            state = recent.get(key)
+            if state and now - state[0] < rule.suppress_seconds:
+                state[0] = now # Sliding window: a tag that keeps showing up stays on one alert
+                repeat = repeats.setdefault(state[1], [state[1], 0, now_dt])
+                repeat[1] += 1
+                continue
+            new_alerts[key] = self._alert_row(rule, event.unit_id, event, message, now_dt)
+            new_keys.append((key, rule.suppress_seconds))
+        opened_elsewhere = self._find_open_alerts(new_keys) if new_keys and self.find_open_alerts else {}
+        for key, alert_id in opened_elsewhere.items(): # Another process (or this one before a restart) has it open
+            repeats[alert_id] = [alert_id, new_alerts.pop(key)['occurrence_count'], now_dt]
+            recent[key] = [now, alert_id]
+        new_keys = [key for key, _ in new_keys if key not in opened_elsewhere]
+        try:
+            alert_ids = self.persist_alerts([new_alerts[key] for key in new_keys], [tuple(r) for r in repeats.values()])
+        except Exception as e:
+            self.persist_errors += 1
+            print(f"Alert Service: error storing {len(new_keys)} alert(s): {e}")
+            return
+        for key, alert_id in zip(new_keys, alert_ids):
+            recent[key] = [now, alert_id]
+            new_alerts[key]['id'] = alert_id
+        self.send_alerts([new_alerts[key] for key in new_keys])
+        self.alerts_created += len(new_keys)
+        self.alerts_suppressed += len(hits) - len(new_keys)
+        if len(recent) > 100000: # Forget keys whose windows have long closed
+            for key in [key for key, state in recent.items() if now - state[0] > 86400]:
+                del recent[key]
+
+    def _find_open_alerts(self, keys):
+        try:
+            return self.find_open_alerts(keys)
+        except Exception as e: # A duplicate alert is better than a lost one
+            print(f"Alert Service: error looking up open alerts (opening {len(keys)} new): {e}")
+            return {}
+
+    @staticmethod
+    def _alert_row(rule, unit_id, event, message, now_dt):
+        return {
+            'rule_id': rule.rule_id, 'alert_type': rule.rule_type, 'severity': rule.severity, 'unit_id': unit_id,
+            'tag_id': event.tag_id if event else None, 'asset_id': event.asset_id if event else None,
+            'event_source': event.source if event else None, 'event_id': event.event_id if event else None,
+            'message': message, 'occurrence_count': 1, 'first_seen_at': now_dt, 'last_seen_at': now_dt, 'status': 'open'
+        }
+
+    def _run_timer(self):
+        self._load_rules()
+        next_refresh = time.monotonic() + self.rules_refresh_seconds
+        while True:
+            if self._reload.wait(self.silent_check_seconds) or time.monotonic() >= next_refresh:
+                self._reload.clear()
+                self._load_rules()
+                next_refresh = time.monotonic() + self.rules_refresh_seconds
+            try:
+                self.check_silent_units()
+            except Exception as e:
+                print(f"Alert Service: error checking silent units: {e}")
+
+    def check_silent_units(self):
+        """Runs the silence check, in one server process at a time on PostgreSQL (the others skip it)."""
+        if not self.load_unit_activity or not self._rules.silent_by_unit:
+            return
+        engine = self.get_engine() if self.get_engine else None
+        if engine is None or engine.dialect.name != 'postgresql':
+            self._check_silent_units()
+            return
+        with engine.connect() as connection:
+            locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': SILENCE_LOCK_KEY}).scalar()
+            connection.commit()
+            if not locked:
+                return
+            try:
+                self._check_silent_units() # Its alerts are committed before the lock is released
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': SILENCE_LOCK_KEY})
+                connection.commit()
+
+    def _check_silent_units(self):
         """
-        Checks if an event triggers any predefined alerts.
-        e.g., asset leaving at an unauthorized time, unknown tag detected.
+        One alert per silence: it fires once a unit is quiet for silent_minutes, and re-arms when the
+        unit reports. Both facts come from the database, so a restart neither re-fires nor forgets.
         """
-        tag_id = event_data.get('event', {}).get('tag_id', 'N/A')
-        print(f"Alert Service: Checking for alerts for event with tag {tag_id} (placeholder).")
-        # TODO: Implement alert logic
-        # if unauthorized_condition_met:
-        #     self.send_alert("High", f"Asset {tag_id} left at unauthorized time.")
-        pass
-
-    def send_alert(self, severity, message):
+        now_dt = datetime.utcnow()
+        silent_by_unit = self._rules.silent_by_unit
+        last_seen, last_fired = self.load_unit_activity(sorted(silent_by_unit))
+        self.silence_checks += 1
+        new_alerts = []
+        for unit_id, rules in silent_by_unit.items():
+            seen_at = _as_naive_utc(last_seen.get(unit_id))
+            for rule in rules:
+                fired_at = _as_naive_utc(last_fired.get((rule.rule_id or rule.rule_type, unit_id)))
+                if fired_at is not None and (seen_at is None or seen_at <= fired_at):
+                    continue # Already alerted for this silence
+                if seen_at is None:
+                    message = f"Unit {unit_id} has not reported yet"
+                elif now_dt - seen_at >= timedelta(minutes=rule.silent_minutes):
+                    message = f"Unit {unit_id} has been silent for {(now_dt - seen_at).total_seconds() / 60:.0f} minutes"
+                else:
+                    continue
+                new_alerts.append(self._alert_row(rule, unit_id, None, message, now_dt))
+        if new_alerts:
+            try:
+                alert_ids = self.persist_alerts(new_alerts, [])
+            except Exception as e:
+                self.persist_errors += 1
+                print(f"Alert Service: error storing {len(new_alerts)} silence alert(s): {e}")
+                return
+            for alert, alert_id in zip(new_alerts, alert_ids):
+                alert['id'] = alert_id
+            self.send_alerts(new_alerts)
+            self.alerts_created += len(new_alerts)
+
+    def wait_until_idle(self):
+        """Blocks until every submitted event has been evaluated and its alerts stored (benchmarks)."""
+        for events in self._queues:
+            events.join()
+
+    def stats(self):
+        return {
+            'rules': self._rules.count,
+            'rules_loaded_at': self.rules_loaded_at.isoformat() if self.rules_loaded_at else None,
+            'queued': self._pending,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'evaluated': self.evaluated,
+            'alerts_created': self.alerts_created,
+            'alerts_suppressed': self.alerts_suppressed,
+            'persist_errors': self.persist_errors,
+            'silence_checks': self.silence_checks
+        }
+
+    def send_alerts(self, alerts):
         """
-        Sends an alert (e.g., email, SMS, push notification).
+        Hands newly created alerts to the notifier (email/webhook digests, see notification_dispatcher.py).
         """
-        print(f"ALERT! [{severity.upper()}] - {message} (Placeholder - implement actual notification)")
-        # TODO: Integrate with email/SMS services (e.g., SendGrid, Twilio)
-        pass
-
-if __name__ == '__main__':
-    # alert_service = AlertService()
-    # test_event_data = {"event": {"tag_id": "ALERT_TEST_TAG"}}
-    # alert_service.check_for_alerts(test_event_data)
-    pass
\ No newline at end of file
+        if not alerts:
+            return
+        for alert in alerts:
+            print(f"ALERT! [{alert['severity'].upper()}] - {alert['message']}")
+        if self.notify:
+            try:
+                self.notify(alerts)
+            except Exception as e:
+                print(f"Alert Service: error queueing {len(alerts)} notification(s): {e}")
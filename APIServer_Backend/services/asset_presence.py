@@ -0,0 +1,129 @@
+# APIServer_Backend/services/asset_presence.py
+"""
+Current whereabouts of every asset, materialized in asset_presence (one row per asset).
+
+Ingest upserts the newest sighting of each asset in a request with one INSERT ... ON CONFLICT
+DO UPDATE, in the same transaction as the events, so "where is asset X" and "which assets are
+out of the yard" are answered from this small table instead of scanning guardian_events and
+subunit_events per asset. A row only moves forward in device time: events that arrive late
+(a Guardian outbox catching up after an outage) never overwrite a newer sighting.
+
+last_direction/last_crossed_at are the last gate crossing (ingress or egress); reads without a
+direction (SubUnit reads, 'unknown') update where the asset was seen but keep the crossing.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+GATE_DIRECTIONS = ('ingress', 'egress')
+DEVICE_TIME_FIELDS = {'guardian': 'event_time', 'subunit': 'reported_at_device'}
+SIGHTING_COLUMNS = ['tag_id', 'last_source', 'last_event_id', 'last_unit_id', 'last_seen_at', 'last_received_at',
+                    'last_rssi', 'last_location_description']
+CROSSING_COLUMNS = ['last_direction', 'last_crossed_at']
+
+# asset_presence columns returned by /api/assets/presence
+PRESENCE_FIELDS = ['asset_id', 'tag_id', 'last_direction', 'last_crossed_at', 'last_seen_at', 'last_unit_id',
+                   'last_source', 'last_event_id', 'last_rssi', 'last_location_description', 'last_received_at']
+
+
+def as_utc(value):
+    """Aware UTC datetime for the timestamptz columns; naive values are UTC (the models' convention)."""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def newest_sightings(source, rows, inserted):
+    """
+    Per asset, the newest sighting and the newest gate crossing among freshly inserted events
+    (rows as written to the event table, inserted as [(event_id, received_at)]), as
+    asset_presence rows ordered by asset_id: one statement can't update a row twice, and a fixed
+    lock order keeps concurrent ingests from deadlocking.
+    """
+    newest = {}
+    time_field = DEVICE_TIME_FIELDS[source]
+    for row, (event_id, received_at) in zip(rows, inserted):
+        asset_id = row.get('asset_id')
+        if asset_id is None:
+            continue # Unknown tags and heartbeats
+        seen_at = as_utc(row.get(time_field) or received_at)
+        direction = row.get('direction') if row.get('direction') in GATE_DIRECTIONS else None
+        current = newest.get(asset_id)
+        if current is None or current['last_seen_at'] <= seen_at:
+            crossing = (current['last_direction'], current['last_crossed_at']) if current else (None, None)
+            newest[asset_id] = current = {
+                'asset_id': asset_id,
+                'tag_id': row['tag_id'],
+                'last_source': source,
+                'last_event_id': event_id,
+                'last_unit_id': row['unit_id'],
+                'last_seen_at': seen_at,
+                'last_received_at': as_utc(received_at),
+                'last_rssi': row.get('rssi'),
+                'last_location_description': row.get('location_description'),
+                'last_direction': crossing[0],
+                'last_crossed_at': crossing[1],
+            }
+        if direction and (current['last_crossed_at'] is None or current['last_crossed_at'] <= seen_at):
+            current['last_direction'], current['last_crossed_at'] = direction, seen_at
+    return [newest[asset_id] for asset_id in sorted(newest)]
+
+
+class AssetPresenceService:
+    """presence_model is the AssetPresence model (asset_presence)."""
+    def __init__(self, db_session, presence_model):
+        self.db = db_session
+        self.model = presence_model
+        self.upsert_statement = self._build_upsert()
+        print("Asset Presence Service Initialized.")
+
+    def _build_upsert(self):
+        model = self.model
+        statement = insert(model)
+        excluded = statement.excluded
+        # Where it was seen and where it last crossed a gate move forward independently, so a
+        # late crossing still counts when a newer plain read has already been recorded
+        newer = model.last_seen_at <= excluded.last_seen_at
+        crossed = and_(excluded.last_crossed_at.isnot(None),
+                       or_(model.last_crossed_at.is_(None), model.last_crossed_at <= excluded.last_crossed_at))
+        set_ = {name: case((newer, getattr(excluded, name)), else_=getattr(model, name)) for name in SIGHTING_COLUMNS}
+        set_.update({name: case((crossed, getattr(excluded, name)), else_=getattr(model, name)) for name in CROSSING_COLUMNS})
+        return statement.on_conflict_do_update(index_elements=[model.asset_id], set_=set_, where=or_(newer, crossed))
+
+    def record_sightings(self, source, rows, inserted):
+        """Adds the upsert to the current transaction (one executemany); the caller commits it with the events."""
+        presence_rows = newest_sightings(source, rows, inserted)
+        if presence_rows:
+            self.db.execute(self.upsert_statement, presence_rows)
+        return len(presence_rows)
+
+    def current_state(self, asset_model, direction=None, unit_id=None, asset_type=None, include_deleted=False):
+        """SELECT of PRESENCE_FIELDS plus asset_name/asset_type/is_active, one row per asset seen, by asset id."""
+        statement = (select(*[getattr(self.model, name) for name in PRESENCE_FIELDS],
+                            asset_model.asset_name, asset_model.asset_type, asset_model.is_active)
+                     .join(asset_model, asset_model.id == self.model.asset_id))
+        if direction:
+            statement = statement.where(self.model.last_direction == direction)
+        if unit_id:
+            statement = statement.where(self.model.last_unit_id == unit_id)
+        if asset_type:
+            statement = statement.where(asset_model.asset_type == asset_type)
+        if not include_deleted:
+            statement = statement.where(asset_model.is_active.is_(True))
+        return statement.order_by(self.model.asset_id)
+
+    def watermark(self):
+        """Latest upsert (index on last_received_at); the ETag watermark for presence reads."""
+        return self.db.execute(select(func.max(self.model.last_received_at))).scalar()
+
+
+if __name__ == '__main__':
+    # Example: three reads of one asset in a batch collapse into its newest sighting and newest crossing
+    test_rows = [{'unit_id': 'GATE_A', 'tag_id': 'E200', 'asset_id': 7, 'direction': 'egress',
+                  'event_time': datetime(2024, 5, 1, 6, 0, tzinfo=timezone.utc)},
+                 {'unit_id': 'GATE_A', 'tag_id': 'E200', 'asset_id': 7, 'direction': 'unknown',
+                  'event_time': datetime(2024, 5, 1, 6, 5, tzinfo=timezone.utc)},
+                 {'unit_id': 'GATE_B', 'tag_id': 'E200', 'asset_id': 7, 'direction': 'ingress',
+                  'event_time': datetime(2024, 5, 1, 5, 0, tzinfo=timezone.utc)}]
+    print(newest_sightings('guardian', test_rows, [(1, datetime.utcnow()), (2, datetime.utcnow()), (3, datetime.utcnow())]))
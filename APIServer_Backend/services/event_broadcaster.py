@@ -0,0 +1,176 @@
+# APIServer_Backend/services/event_broadcaster.py
+"""
+In-process fan-out of newly ingested events to live (server-sent events) dashboard clients.
+"""
+import json
+import select
+import threading
+import time
+from collections import deque
+
+
+class EventBroadcaster:
+    """
+    Keeps the most recent events in a ring buffer of pre-encoded SSE messages, numbered with a
+    sequence id. Publishing is O(1) and serializes each event once no matter how many clients are
+    connected; each client just remembers the last sequence id it sent and waits on a shared
+    condition. A client that falls further behind than the buffer skips ahead rather than
+    holding memory, and a reconnecting EventSource resumes from its Last-Event-ID.
+    """
+    def __init__(self, buffer_size=1000):
+        self._buffer = deque(maxlen=buffer_size) # (seq, sse_message)
+        self._seq = 0
+        self._condition = threading.Condition()
+        self.subscribers = 0
+        self.published = 0
+        print(f"Event Broadcaster Initialized (buffer_size={buffer_size}).")
+
+    def publish(self, event_type, payload):
+        data = json.dumps(payload)
+        with self._condition:
+            self._seq += 1
+            self._buffer.append((self._seq, f"id: {self._seq}\nevent: {event_type}\ndata: {data}\n\n"))
+            self.published += 1
+            self._condition.notify_all()
+
+    def latest_seq(self):
+        with self._condition:
+            return self._seq
+
+    def wait_for_messages(self, after_seq, timeout):
+        """
+        Blocks up to timeout seconds for messages newer than after_seq.
+        Returns (last_seq, [sse_message, ...]); the list is empty on timeout.
+        """
+        with self._condition:
+            if after_seq > self._seq: # Client saw a previous server process; start from now
+                after_seq = self._seq
+            if after_seq == self._seq:
+                self._condition.wait(timeout)
+            missing = min(self._seq - after_seq, len(self._buffer))
+            # Sequence ids in the buffer are contiguous, so the newest `missing` entries are the ones to send
+            messages = [self._buffer[-i][1] for i in range(missing, 0, -1)]
+            return self._seq, messages
+
+    def add_subscriber(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def remove_subscriber(self):
+        with self._condition:
+            self.subscribers -= 1
+
+    def stats(self):
+        with self._condition:
+            return {'subscribers': self.subscribers, 'published': self.published,
+                    'latest_seq': self._seq, 'buffered': len(self._buffer)}
+
+
+class PgNotifyBridge:
+    """
+    Feeds an EventBroadcaster from Postgres LISTEN/NOTIFY so every server process sees events
+    ingested by any other process. Ingestion sends pg_notify(channel, json) with
+    {"type": ..., "payload": ...}; one background thread per process listens on a dedicated
+    connection and republishes locally. handlers maps other message types to a callable that
+    takes the payload, for process-wide state that is not streamed (e.g. cache invalidation).
+    A notification that can't be handled is logged and skipped. When the connection drops (database
+    restart, failover) the thread reconnects with exponential backoff, up to max_backoff_seconds,
+    and calls on_reconnect(): notifications sent while it was away are lost, so state kept up to
+    date by handlers should be reset there. Started lazily by the first stream subscriber, or explicitly.
+    """
+    def __init__(self, broadcaster, channel, handlers=None, on_reconnect=None, max_backoff_seconds=60):
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.handlers = handlers or {}
+        self.on_reconnect = on_reconnect
+        self.max_backoff_seconds = max_backoff_seconds
+        self.reconnects = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, engine):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._listen, args=(engine,), name='pg-notify-bridge', daemon=True)
+            self._thread.start()
+
+    def _listen(self, engine):
+        backoff = 1
+        connected_before = False
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f'LISTEN "{self.channel}"')
+                print(f"PgNotifyBridge: listening on channel '{self.channel}'.")
+                backoff = 1
+                if connected_before:
+                    self.reconnects += 1
+                    self._call_on_reconnect()
+                connected_before = True
+                while True:
+                    if select.select([dbapi_connection], [], [], 5)[0]:
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            self._dispatch(dbapi_connection.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"PgNotifyBridge: listener connection lost ({e}); reconnecting in {backoff}s")
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate() # Closes it instead of returning a LISTENing autocommit connection to the pool
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    def _dispatch(self, payload):
+        try:
+            message = json.loads(payload)
+            handler = self.handlers.get(message['type'])
+            if handler:
+                handler(message['payload'])
+            else:
+                self.broadcaster.publish(message['type'], message['payload'])
+        except Exception as e:
+            print(f"PgNotifyBridge: skipped notification {payload[:200]!r}: {e}")
+
+    def _call_on_reconnect(self):
+        if not self.on_reconnect:
+            return
+        try:
+            self.on_reconnect()
+        except Exception as e:
+            print(f"PgNotifyBridge: on_reconnect failed: {e}")
+
+# Standalone test: resume by sequence id, slow clients skipping ahead, keepalive timeouts and waking waiters
+if __name__ == '__main__':
+    import time
+
+    broadcaster = EventBroadcaster(buffer_size=3)
+    for i in range(5):
+        broadcaster.publish('guardian', {'id': i})
+    seq, messages = broadcaster.wait_for_messages(after_seq=3, timeout=0)
+    checks = [("resume after Last-Event-ID", seq == 5 and [m.split('\n')[0] for m in messages] == ['id: 4', 'id: 5'])]
+    seq, messages = broadcaster.wait_for_messages(after_seq=0, timeout=0)
+    checks.append(("slow client skips to the 3 newest", [json.loads(m.split('data: ')[1])['id'] for m in messages] == [2, 3, 4]))
+    start = time.monotonic()
+    seq, messages = broadcaster.wait_for_messages(after_seq=5, timeout=0.1)
+    checks.append(("nothing new: times out empty", messages == [] and time.monotonic() - start >= 0.1))
+    checks.append(("id from a previous server process", broadcaster.wait_for_messages(after_seq=99, timeout=0)[0] == 5))
+
+    received = []
+    waiter = threading.Thread(target=lambda: received.append(broadcaster.wait_for_messages(after_seq=5, timeout=5)))
+    waiter.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    broadcaster.publish('subunit', {'id': 5})
+    waiter.join()
+    checks.append(("publish wakes a waiting client", received[0][0] == 6 and 'event: subunit' in received[0][1][0]
+                   and time.monotonic() - start < 1))
+    for description, passed in checks:
+        print(f"{'OK  ' if passed else 'FAIL'} {description}")
+    print(broadcaster.stats())
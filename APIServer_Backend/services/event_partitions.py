@@ -0,0 +1,204 @@
+# APIServer_Backend/services/event_partitions.py
+"""
+Monthly range partitions for the event tables (PostgreSQL).
+
+guardian_events and subunit_events are partitioned by RANGE on their server receive time
+(received_at / received_at_server), one partition per calendar month in UTC, named
+<table>_pYYYYMM. Ingest always lands in the current month, so index maintenance works on small,
+hot indexes instead of one ever-growing B-tree, and a query bounded on the receive time is planned
+and executed against only the months it covers. A database partitioned by the migration also
+has a <table>_legacy partition holding everything received before it ran.
+
+There is deliberately no DEFAULT partition: it would stop the planner from reading partitions in
+order for ORDER BY received_at ... LIMIT. Instead the manager keeps months_ahead future months
+created, at server start and every interval_hours after that. Server processes share the work
+through an advisory lock.
+
+Retention (retention_months > 0) removes partitions whose whole range is older than the cutoff.
+Before each one goes, before_drop(table, lower, upper) can preserve what has to outlive the raw
+events; the app uses it to make sure every tagged event in the range has its FSMA record, and
+fsma_traceability_log itself is never partitioned or purged.
+"""
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+MAINTENANCE_LOCK_KEY = 7262022 # pg_try_advisory_lock key: one server process maintains partitions at a time
+PARTITION_NAME = re.compile(r'^(guardian_events|subunit_events)_(p\d{6}|legacy)$')
+PARTITION_BOUND = re.compile(r"FROM \((MINVALUE|'[^']*')\) TO \((MAXVALUE|'[^']*')\)")
+
+
+def is_event_partition(name):
+    """True for the per-month (and legacy) partitions, which only exist in the database, not in models.py."""
+    return bool(PARTITION_NAME.match(name or ''))
+
+
+def month_start(value, offset_months=0):
+    """First instant of value's month shifted by offset_months, as a naive UTC datetime (the models' convention)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    month_index = value.year * 12 + value.month - 1 + offset_months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'")).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class EventPartitionManager:
+    """
+    get_engine() returns the SQLAlchemy engine; tables maps table name -> partition column.
+    Does nothing on other databases or on tables that are not partitioned (e.g. before the migration).
+    """
+    def __init__(self, get_engine, tables, months_ahead=3, retention_months=0, retention_action='drop',
+                 before_drop=None, interval_hours=6):
+        if retention_action not in ('drop', 'detach'):
+            raise ValueError("retention_action must be 'drop' or 'detach'")
+        self.get_engine = get_engine
+        self.tables = tables
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.retention_action = retention_action
+        self.before_drop = before_drop
+        self.interval_hours = interval_hours
+        self._partitions = {} # table -> [(name, lower, upper)] oldest first, as of the last maintenance run
+        self._lock = threading.Lock()
+        self.last_run_at = None
+        self.partitions_created = 0
+        self.partitions_removed = 0
+        print(f"Event Partition Manager Initialized ({months_ahead} month(s) ahead, "
+              f"retention {f'{retention_months} month(s), {retention_action}' if retention_months else 'off'}).")
+
+    def start(self):
+        threading.Thread(target=self._run, name='event-partitions', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"Event Partition Manager: maintenance failed: {e}")
+            time.sleep(self.interval_hours * 3600)
+
+    def run_maintenance(self, now=None):
+        """Creates upcoming partitions and applies retention (if this process gets the lock), then refreshes the cache."""
+        now = now or datetime.now(timezone.utc)
+        engine = self.get_engine()
+        if engine.dialect.name != 'postgresql':
+            return
+        with engine.connect() as connection:
+            locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': MAINTENANCE_LOCK_KEY}).scalar()
+            connection.commit()
+            try:
+                for table, column in self.tables.items():
+                    if not self._is_partitioned(connection, table):
+                        continue
+                    if locked:
+                        self._ensure_partitions(connection, table, now)
+                        if self.retention_months:
+                            self._apply_retention(connection, table, now)
+                    partitions = self._read_partitions(connection, table)
+                    with self._lock:
+                        self._partitions[table] = partitions
+            finally:
+                if locked:
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MAINTENANCE_LOCK_KEY})
+                    connection.commit()
+        self.last_run_at = now
+
+    @staticmethod
+    def _is_partitioned(connection, table):
+        return connection.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+                                  {'table': table}).first() is not None
+
+    @staticmethod
+    def _read_partitions(connection, table):
+        connection.execute(text("SET LOCAL TIME ZONE 'UTC'")) # Bounds are rendered in the session time zone
+        rows = connection.execute(text("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = CAST(:table AS regclass)
+        """), {'table': table}).all()
+        connection.commit()
+        partitions = []
+        for name, bound in rows:
+            match = PARTITION_BOUND.search(bound or '')
+            if match:
+                partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+        return sorted(partitions, key=lambda partition: partition[1] or datetime.min)
+
+    def _ensure_partitions(self, connection, table, now):
+        existing = self._read_partitions(connection, table)
+        for offset in range(self.months_ahead + 1):
+            lower, upper = month_start(now, offset), month_start(now, offset + 1)
+            if any((start is None or start < upper) and (end is None or end > lower) for _, start, end in existing):
+                continue # Already covered (possibly by the legacy partition)
+            name = f"{table}_p{lower:%Y%m}"
+            # Identifiers come from self.tables, bounds are generated: nothing user-supplied is interpolated
+            connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} "
+                                    f"FOR VALUES FROM ('{lower:%Y-%m-%d} 00:00:00+00') TO ('{upper:%Y-%m-%d} 00:00:00+00')"))
+            connection.commit()
+            self.partitions_created += 1
+            print(f"Event Partition Manager: created {name}")
+
+    def _apply_retention(self, connection, table, now):
+        cutoff = month_start(now, -self.retention_months)
+        for name, lower, upper in self._read_partitions(connection, table):
+            if upper is None or upper > cutoff:
+                break # Oldest first: everything after this is newer
+            try:
+                if self.before_drop:
+                    self.before_drop(table, lower, upper)
+                # DETACH briefly locks the parent; run maintenance off-peak on busy servers
+                connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                if self.retention_action == 'drop':
+                    connection.execute(text(f"DROP TABLE {name}"))
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                print(f"Event Partition Manager: kept {name}, could not remove it: {e}")
+                break # Never leave a gap: newer partitions wait until this one is gone
+            self.partitions_removed += 1
+            print(f"Event Partition Manager: {'dropped' if self.retention_action == 'drop' else 'detached'} {name} "
+                  f"(events received before {upper:%Y-%m-%d})")
+
+    def time_windows(self, table, now=None):
+        """
+        Contiguous [lower, upper) receive-time windows covering all of `table`, newest first, one
+        per partition (the current month and everything after it form the first, the oldest one
+        is open-ended), as naive UTC datetimes with None for unbounded. A query that walks these
+        windows in order touches one partition at a time. [(None, None)] if not partitioned.
+        """
+        with self._lock:
+            partitions = self._partitions.get(table)
+        if not partitions:
+            return [(None, None)]
+        boundary = month_start(now or datetime.now(timezone.utc))
+        lowers = sorted({lower for _, lower, _ in partitions if lower is not None and lower < boundary}, reverse=True)
+        windows = [(boundary, None)]
+        for lower in lowers:
+            windows.append((lower, boundary))
+            boundary = lower
+        windows.append((None, boundary)) # Legacy partition, and nothing is lost if the cache is out of date
+        return windows
+
+    def stats(self):
+        with self._lock:
+            partitions = {table: [{'name': name, 'from': lower.isoformat() if lower else None, 'to': upper.isoformat() if upper else None}
+                                  for name, lower, upper in table_partitions]
+                          for table, table_partitions in self._partitions.items()}
+        return {
+            'partitioned_tables': sorted(partitions),
+            'partitions': partitions,
+            'months_ahead': self.months_ahead,
+            'retention_months': self.retention_months,
+            'retention_action': self.retention_action,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'partitions_created': self.partitions_created,
+            'partitions_removed': self.partitions_removed
+        }
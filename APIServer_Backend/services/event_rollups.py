@@ -0,0 +1,188 @@
+# APIServer_Backend/services/event_rollups.py
+"""
+Hourly event counts for /api/stats, kept in event_rollups_hourly.
+
+A background job aggregates each source's events per (UTC hour of receipt, unit_id, asset type,
+direction) once the hour is complete, lag_seconds after it ends so that ingest transactions
+still in flight have committed. Each source's progress is a watermark in event_rollup_state;
+every step rolls up [watermark, watermark + chunk_hours) with one indexed, partition-pruned
+GROUP BY and moves the watermark in the same transaction, so the first run catches up on
+history a chunk at a time and a crash never counts an hour twice. Server processes share the
+work through an advisory lock.
+
+A stats query reads the rollups up to the watermark and counts the raw events only for the
+rest of the range (normally the current hour), so its cost doesn't grow with the range.
+Counts are by receive time: a Guardian outbox catching up lands in the hour it was received.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import DateTime, func, literal, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+ROLLUP_LOCK_KEY = 7262025 # pg_try_advisory_lock key: one server process rolls up at a time
+BUCKETS = ('hour', 'day')
+GROUP_BY_FIELDS = ('unit_id', 'asset_type', 'direction')
+NO_VALUE = '' # Primary key columns can't be NULL: events without an asset type/direction are grouped under ''
+
+
+def as_utc(value):
+    """Aware UTC datetime; naive values are UTC (the models' convention)."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def floor_bucket(value, bucket='hour'):
+    """Start of value's UTC hour or day, as an aware UTC datetime."""
+    value = as_utc(value).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if bucket == 'day' else value
+
+
+def ceil_bucket(value, bucket='hour'):
+    start = floor_bucket(value, bucket)
+    return start if start == as_utc(value) else start + (timedelta(days=1) if bucket == 'day' else timedelta(hours=1))
+
+
+class EventRollupService:
+    """
+    get_engine() returns the SQLAlchemy engine. sources maps a source name to (event model,
+    receive time column name, direction column name or None); asset_model supplies asset_type.
+    """
+    def __init__(self, get_engine, sources, asset_model, rollup_model, state_model, interval_seconds=300,
+                 lag_seconds=120, chunk_hours=24):
+        self.get_engine = get_engine
+        self.sources = sources
+        self.asset_model = asset_model
+        self.rollup_model = rollup_model
+        self.state_model = state_model
+        self.interval_seconds = interval_seconds
+        self.lag = timedelta(seconds=lag_seconds)
+        self.chunk = timedelta(hours=chunk_hours)
+        self.last_run_at = None
+        self.hours_rolled_up = 0
+        print(f"Event Rollup Service Initialized (every {interval_seconds}s, {lag_seconds}s lag, {chunk_hours}h chunks).")
+
+    def start(self):
+        threading.Thread(target=self._run, name='event-rollups', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Event Rollup Service: rollup failed: {e}")
+            time.sleep(self.interval_seconds)
+
+    def _grouped_events(self, source, bucket, since, until):
+        """SELECT (bucket start, source, unit_id, asset_type, direction, count) of raw events received in [since, until)."""
+        model, received_name, direction_name = self.sources[source]
+        received = getattr(model, received_name)
+        bucket_start = func.date_trunc(bucket, received, 'UTC', type_=DateTime(timezone=True))
+        asset_type = func.coalesce(self.asset_model.asset_type, NO_VALUE)
+        group_columns = [bucket_start, model.unit_id, asset_type]
+        if direction_name:
+            direction = func.coalesce(getattr(model, direction_name), NO_VALUE)
+            group_columns.append(direction)
+        else:
+            # A constant: inlined, and kept out of GROUP BY (PostgreSQL rejects one there)
+            direction = literal_column(f"'{NO_VALUE}'").label('direction')
+        return (select(bucket_start, literal(source), model.unit_id, asset_type, direction, func.count())
+                .select_from(model).outerjoin(self.asset_model, self.asset_model.id == model.asset_id)
+                .where(received >= since, received < until)
+                .group_by(*group_columns))
+
+    def run_once(self, now=None):
+        """Rolls every source up to the last complete hour (if this process gets the lock). Returns hours rolled up."""
+        rolled_until = floor_bucket((now or datetime.now(timezone.utc)) - self.lag)
+        engine = self.get_engine()
+        postgres = engine.dialect.name == 'postgresql'
+        hours = 0
+        with engine.connect() as connection:
+            if postgres:
+                locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': ROLLUP_LOCK_KEY}).scalar()
+                connection.commit()
+                if not locked:
+                    return 0
+            try:
+                for source in self.sources:
+                    hours += self._roll_up_source(connection, source, rolled_until)
+            finally:
+                if postgres:
+                    try:
+                        connection.rollback() # After a failed step the transaction is aborted and would refuse the unlock
+                        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': ROLLUP_LOCK_KEY})
+                        connection.commit()
+                    except Exception as e: # Don't mask the original error; closing the broken connection frees the lock
+                        print(f"Event Rollup Service: could not release the rollup lock: {e}")
+                        connection.invalidate()
+        self.last_run_at = now or datetime.now(timezone.utc)
+        self.hours_rolled_up += hours
+        return hours
+
+    def _roll_up_source(self, connection, source, rolled_until):
+        state, rollup = self.state_model, self.rollup_model
+        watermark = connection.execute(select(state.rolled_up_until).where(state.source == source)).scalar()
+        if watermark is None:
+            model, received_name, _ = self.sources[source]
+            oldest = connection.execute(select(func.min(getattr(model, received_name)))).scalar()
+            watermark = floor_bucket(oldest) if oldest else rolled_until
+            connection.execute(insert(state).values(source=source, rolled_up_until=watermark).on_conflict_do_nothing())
+            connection.commit()
+        watermark = floor_bucket(watermark)
+        hours = 0
+        while watermark < rolled_until:
+            chunk_until = min(watermark + self.chunk, rolled_until)
+            statement = insert(rollup).from_select(
+                ['bucket_start', 'source', 'unit_id', 'asset_type', 'direction', 'event_count'],
+                self._grouped_events(source, 'hour', watermark, chunk_until))
+            # Replaces rather than adds, so re-rolling an hour is harmless
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[rollup.bucket_start, rollup.source, rollup.unit_id, rollup.asset_type, rollup.direction],
+                set_={'event_count': statement.excluded.event_count}))
+            connection.execute(state.__table__.update().where(state.source == source).values(rolled_up_until=chunk_until))
+            connection.commit()
+            hours += int((chunk_until - watermark).total_seconds() // 3600)
+            watermark = chunk_until
+        return hours
+
+    def counts(self, session, bucket, since, until, sources=None, group_by=()):
+        """
+        Event counts per bucket ('hour' or 'day', UTC) in [since, until), which must be bucket-aligned,
+        grouped by source plus group_by (a subset of GROUP_BY_FIELDS). Returns ({(bucket_start, source,
+        *group values): count}, {source: rolled_up_until}); group values are None where there is none.
+        """
+        sources = list(sources or self.sources)
+        rollup, state = self.rollup_model, self.state_model
+        rolled_up = {source: floor_bucket(value) for source, value in
+                     session.execute(select(state.source, state.rolled_up_until).where(state.source.in_(sources))).all()}
+        totals = {}
+        def add(rows):
+            for bucket_start, source, *values, count in rows:
+                key = (floor_bucket(bucket_start), source) + tuple(value or None for value in values)
+                totals[key] = totals.get(key, 0) + int(count)
+
+        for source in sources:
+            watermark = rolled_up.get(source, since)
+            if since < min(until, watermark): # The rolled-up part of the range
+                bucket_start = func.date_trunc(bucket, rollup.bucket_start, 'UTC', type_=DateTime(timezone=True)) if bucket == 'day' else rollup.bucket_start
+                group_columns = [getattr(rollup, name) for name in group_by]
+                add(session.execute(
+                    select(bucket_start, rollup.source, *group_columns, func.sum(rollup.event_count))
+                    .where(rollup.source == source, rollup.bucket_start >= since, rollup.bucket_start < min(until, watermark))
+                    .group_by(bucket_start, rollup.source, *group_columns)).all())
+            if max(since, watermark) < until: # Not rolled up yet: count the raw events
+                grouped = self._grouped_events(source, bucket, max(since, watermark), until).subquery()
+                columns = list(grouped.c)
+                selected = [columns[2 + GROUP_BY_FIELDS.index(name)] for name in group_by]
+                add(session.execute(select(columns[0], columns[1], *selected, func.sum(columns[5]))
+                                    .group_by(columns[0], columns[1], *selected)).all())
+        return totals, rolled_up
+
+    def stats(self):
+        return {
+            'sources': sorted(self.sources),
+            'interval_seconds': self.interval_seconds,
+            'lag_seconds': int(self.lag.total_seconds()),
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'hours_rolled_up': self.hours_rolled_up
+        }
@@ -1,37 +1,229 @@
 # APIServer_Backend/services/fsma_processor.py
 """
 Business logic for processing data for FSMA 204 compliance.
+
+Every tag read is recorded as one Critical Tracking Event (CTE) with its Key Data Elements (KDEs):
+traceability lot code, event type, date/time, location and product description. Records are
+written at ingest, in the same transaction as the raw event, into fsma_traceability_log, which
+is indexed by (lot code | tag | asset, event_time). A traceability report is therefore a single
+index range scan over that table instead of a join across years of guardian_events and
+subunit_events, and is streamed out as a sortable spreadsheet (CSV) for the FDA's 24-hour window.
 """
+import csv
+import io
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+# 21 CFR 1.1455(c): traceability records must be kept for 2 years. When FSMA recording is off, the
+# raw events are the only record, so event retention never goes below this.
+RECORD_RETENTION_MONTHS = 24
+
+# Gate crossings map onto FSMA CTEs; reads without a direction are kept as location observations
+DIRECTION_CTES = {'egress': 'shipping', 'ingress': 'receiving'}
+OBSERVATION_CTE = 'observation'
+
+# (spreadsheet header, fsma_traceability_log column) in report order
+REPORT_COLUMNS = [
+    ('Traceability Lot Code', 'traceability_lot_code'),
+    ('Product Description', 'product_description'),
+    ('Critical Tracking Event', 'cte_type'),
+    ('Event Date (UTC)', None), # Both derived from event_time
+    ('Event Time (UTC)', None),
+    ('Location Identifier', 'location_id'),
+    ('Location Description', 'location_description'),
+    ('Tag ID', 'tag_id'),
+    ('Asset ID', 'asset_id'),
+    ('Reference Record Type', 'event_source'),
+    ('Reference Record Number', 'event_id'),
+]
+REPORT_FIELDS = ['traceability_lot_code', 'product_description', 'cte_type', 'event_time', 'location_id',
+                 'location_description', 'tag_id', 'asset_id', 'event_source', 'event_id']
+LOT_CODE_MAX_LENGTH = 100 # fsma_traceability_log.traceability_lot_code
+
+
+def lot_code_error(event_data):
+    """Why an event's optional traceability_lot_code can't be recorded, or None if it can (or is absent)."""
+    lot_code = event_data.get('traceability_lot_code')
+    if lot_code is None:
+        return None
+    if not isinstance(lot_code, str):
+        return "event.traceability_lot_code must be a string"
+    if len(lot_code) > LOT_CODE_MAX_LENGTH:
+        return f"event.traceability_lot_code is longer than {LOT_CODE_MAX_LENGTH} characters"
+    return None
+
+
+def event_time_from(value, fallback):
+    """Device time as an aware UTC datetime (naive values are UTC); fallback, likewise, when missing or unparseable."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        value = fallback
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
 class FSMAService:
-    def __init__(self, db_session): # Pass db session if needed for queries
+    """
+    record_model is the FSMARecord model (fsma_traceability_log). locations maps unit ids
+    (case-insensitively) to the location description reported as the CTE location.
+    """
+    def __init__(self, db_session, record_model, locations=None):
         self.db = db_session
-        print("FSMA Service Initialized (placeholder).")
+        self.model = record_model
+        self.locations = {unit_id.lower(): description for unit_id, description in (locations or {}).items()}
+        print(f"FSMA Service Initialized ({len(self.locations)} configured location(s)).")
+
+    def process_event_for_fsma(self, source, event_id, event_data, received_at, product_description=None):
+        """
+        Maps one stored event row (the dict written to guardian_events/subunit_events, plus the
+        raw payload's optional traceability_lot_code) to a fsma_traceability_log row, or None if
+        the event has no tag (SubUnit heartbeats).
+        """
+        tag_id = event_data.get('tag_id')
+        if not tag_id:
+            return None
+        raw_payload = event_data.get('raw_event_payload') or {}
+        if source == 'guardian':
+            cte_type = DIRECTION_CTES.get(event_data.get('direction'), OBSERVATION_CTE)
+            event_time = event_time_from(event_data.get('event_time'), received_at)
+        else:
+            cte_type = OBSERVATION_CTE
+            event_time = event_time_from(event_data.get('reported_at_device'), received_at)
+        unit_id = event_data['unit_id']
+        return {
+            # Lots default to the tag: the EPC on a bin/pallet identifies the lot it carries
+            'traceability_lot_code': raw_payload.get('traceability_lot_code') or tag_id,
+            'product_description': product_description,
+            'cte_type': cte_type,
+            'event_time': event_time or datetime.now(timezone.utc),
+            'location_id': unit_id,
+            'location_description': self.locations.get(unit_id.lower()) or event_data.get('location_description'),
+            'tag_id': tag_id,
+            'asset_id': event_data.get('asset_id'),
+            'event_source': source,
+            'event_id': event_id,
+        }
+
+    def record_events(self, source, rows, inserted, product_descriptions):
+        """
+        Adds the KDE records for freshly inserted events to the current transaction (one
+        executemany INSERT); the caller commits them together with the events.
+        inserted is [(event_id, received_at)] in `rows` order; product_descriptions maps tag_id -> name.
+        """
+        records = []
+        for row, (event_id, received_at) in zip(rows, inserted):
+            record = self.process_event_for_fsma(source, event_id, row, received_at, product_descriptions.get(row.get('tag_id')))
+            if record:
+                records.append(record)
+        if records:
+            self.db.execute(insert(self.model), records)
+        return len(records)
+
+    def generate_traceability_report(self, lot_code=None, tag_id=None, asset_id=None, since=None, until=None):
+        """
+        Returns the SELECT for a traceability report (REPORT_FIELDS, oldest first) narrowed by
+        exactly one of lot_code, tag_id or asset_id and an optional [since, until) on event_time.
+        Each key has its own (key, event_time, id) index, so this is one range scan.
+        """
+        keys = [(column, value) for column, value in (('traceability_lot_code', lot_code), ('tag_id', tag_id),
+                                                      ('asset_id', asset_id)) if value is not None]
+        if len(keys) != 1:
+            raise ValueError("Specify exactly one of lot_code, tag_id or asset_id")
+        column, value = keys[0]
+        statement = select(*[getattr(self.model, name) for name in REPORT_FIELDS]).where(getattr(self.model, column) == value)
+        if since:
+            statement = statement.where(self.model.event_time >= since)
+        if until:
+            statement = statement.where(self.model.event_time < until)
+        return statement.order_by(self.model.event_time, self.model.id)
+
+    @staticmethod
+    def iter_report_csv(result):
+        """Yields the report as CSV text, one chunk per result partition (use yield_per on the statement)."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([header for header, _ in REPORT_COLUMNS])
+        for partition in result.partitions():
+            for lot, product, cte, event_time, location_id, location, tag_id, asset_id, source, event_id in partition:
+                if event_time.tzinfo is None:
+                    event_time = event_time.replace(tzinfo=timezone.utc) # Naive values are UTC (the models' convention)
+                # timestamptz comes back in the session's time zone; 'YYYY-MM-DDTHH:MM:SS[.ffffff]+00:00' in UTC,
+                # much cheaper than two strftime() calls
+                event_time = event_time.astimezone(timezone.utc).isoformat()
+                writer.writerow([lot, product, cte, event_time[:10], event_time[11:19],
+                                 location_id, location, tag_id, asset_id, f"{source}_event", event_id])
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+        yield buffer.getvalue()
+
+    def _unrecorded_events(self, source, event_model, product_model, time_column_name):
+        """
+        (SELECT of tagged events that have no record yet, with what process_event_for_fsma needs, field
+        names, receive-time column). The NOT EXISTS is one probe per event on idx_fsma_source_event_id.
+        """
+        fields = ['unit_id', 'tag_id', 'asset_id', time_column_name] + (
+            ['direction', 'raw_event_payload'] if source == 'guardian' else ['location_description'])
+        received_column = event_model.received_at if source == 'guardian' else event_model.received_at_server
+        statement = (select(event_model.id, received_column, product_model.asset_name, *[getattr(event_model, name) for name in fields])
+                     .outerjoin(product_model, product_model.id == event_model.asset_id)
+                     .where(event_model.tag_id.isnot(None),
+                            ~select(self.model.id).where(self.model.event_source == source,
+                                                         self.model.event_id == event_model.id).exists()))
+        return statement, fields, received_column
+
+    def _insert_records(self, source, fields, batch):
+        records = [self.process_event_for_fsma(source, event_id, dict(zip(fields, values)), received_at, asset_name)
+                   for event_id, received_at, asset_name, *values in batch]
+        self.db.execute(insert(self.model), records)
+        self.db.commit()
+        return len(records)
 
-    def process_event_for_fsma(self, event_data):
+    def backfill(self, source, event_model, product_model, time_column_name, batch_size=5000):
         """
-        Takes event data (e.g., from Guardian Unit or SubUnit)
-        and extracts/maps Key Data Elements (KDEs).
+        Records every tagged event of `source` that has no record yet (stored before the log
+        existed, or skipped while recording was off), whatever was recorded around it. Walks the
+        events by id, committing each batch, so an interrupted run resumes at the first event still
+        unrecorded and a finished one is a no-op. Returns the number of records added.
         """
-        print(f"FSMA Service: Processing event - {event_data.get('tag_id', 'N/A')}")
-        # TODO: Implement logic to map event_data to FSMA KDEs
-        # e.g., identify location, timestamp, item
-        # Potentially create/update FSMA-specific records in the database.
-        return {"status": "processed_fsma_placeholder", "tag_id": event_data.get('tag_id')}
+        statement, fields, _ = self._unrecorded_events(source, event_model, product_model, time_column_name)
+        total, last_id = 0, None
+        while True:
+            batch_statement = statement.where(event_model.id > last_id) if last_id is not None else statement
+            batch = self.db.execute(batch_statement.order_by(event_model.id).limit(batch_size)).all()
+            if not batch:
+                return total
+            total += self._insert_records(source, fields, batch)
+            last_id = batch[-1][0]
+            print(f"FSMA Service: backfilled {total} {source} event(s) (up to id {last_id})")
 
-    def generate_traceability_report(self, asset_tag_id):
+    def record_missing(self, source, event_model, product_model, time_column_name, received_from=None, received_until=None,
+                       batch_size=5000):
         """
-        Generates a traceability report for a given asset.
+        Records every tagged event received in [received_from, received_until) that has no
+        record yet (None = unbounded). Run before raw events are purged, so the KDEs outlive
+        them. Bounded on the receive time, it only reads the event partitions being purged.
         """
-        print(f"FSMA Service: Generating traceability report for {asset_tag_id} (placeholder).")
-        # TODO: Query database for all events related to this asset_tag_id
-        # and format them into a FSMA 204 compliant report.
-        return {"report_for": asset_tag_id, "data": "Traceability data placeholder..."}
+        statement, fields, received_column = self._unrecorded_events(source, event_model, product_model, time_column_name)
+        if received_from is not None:
+            statement = statement.where(received_column >= received_from)
+        if received_until is not None:
+            statement = statement.where(received_column < received_until)
+        total = 0
+        while True:
+            batch = self.db.execute(statement.limit(batch_size)).all() # Recorded rows drop out of the next batch
+            if not batch:
+                return total
+            total += self._insert_records(source, fields, batch)
 
 if __name__ == '__main__':
-    # Example usage (would normally be called from API routes)
-    # Mock db_session for testing
-    # fsma_service = FSMAService(db_session=None)
-    # test_event = {"tag_id": "FSMA_TEST_TAG", "location": "Gate A", "timestamp_iso": "2023-01-01T12:00:00Z"}
-    # fsma_service.process_event_for_fsma(test_event)
-    # fsma_service.generate_traceability_report("FSMA_TEST_TAG")
-    pass
\ No newline at end of file
+    # Example mapping (reports and backfill run against the database, see app.py and benchmarks.py)
+    fsma_service = FSMAService(db_session=None, record_model=None, locations={'GATE_A': 'Packhouse gate A'})
+    test_event = {"unit_id": "GATE_A", "tag_id": "FSMA_TEST_TAG", "direction": "egress",
+                  "event_time": datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc), "raw_event_payload": {"traceability_lot_code": "LOT-2023-001"}}
+    print(fsma_service.process_event_for_fsma('guardian', 1, test_event, datetime.utcnow(), "Romaine, 24ct bin"))
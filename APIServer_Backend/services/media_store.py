@@ -0,0 +1,137 @@
+# APIServer_Backend/services/media_store.py
+"""
+Content-addressed storage for Guardian media (video clips, thumbnails) uploaded in chunks.
+
+Files are named by their SHA-256, so a file uploaded twice (a retry after a lost response, or
+the same clip referenced by several events) is stored once. An upload in progress lives in
+<root>/partial/<sha256>.part and its current size is the resume offset; every chunk is appended
+straight from the request stream, so memory use is one read block regardless of file size.
+The running SHA-256 of each partial file is kept in memory between chunks and rebuilt from
+disk only if it is missing (after a restart, when another worker process took the previous
+chunk, or after it was evicted), so completing an upload does not re-read the whole file. Only the
+max_cached_hashers most recently used are kept, so abandoned uploads don't hold memory forever.
+"""
+import fcntl
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+READ_BLOCK_BYTES = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """The chunk does not start where the partial file ends; .offset is where it does."""
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class DigestMismatch(Exception):
+    pass
+
+
+class MediaStore:
+    def __init__(self, root_dir, max_cached_hashers=64):
+        self.root_dir = root_dir
+        self.partial_dir = os.path.join(root_dir, 'partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._hashers = OrderedDict() # sha256 -> (offset the hasher has consumed up to, hashlib object), least recent first
+        self.max_cached_hashers = max_cached_hashers
+        self._lock = threading.Lock()
+        print(f"Media Store Initialized at {root_dir}")
+
+    def relative_path(self, sha256, extension=''):
+        return os.path.join(sha256[:2], sha256 + extension) # Two-level fan-out keeps directories small
+
+    def full_path(self, relative_path):
+        return os.path.join(self.root_dir, relative_path)
+
+    def _partial_path(self, sha256):
+        return os.path.join(self.partial_dir, sha256 + '.part')
+
+    def partial_size(self, sha256):
+        try:
+            return os.path.getsize(self._partial_path(sha256))
+        except FileNotFoundError:
+            return 0
+
+    def append_chunk(self, sha256, offset, stream, total_size):
+        """
+        Appends the bytes read from `stream` at `offset` and returns the new offset.
+        Raises OffsetMismatch if offset is not the current partial size, UploadTooLarge if the
+        chunk runs past total_size (the partial file is left as it was before the chunk).
+        """
+        with open(self._partial_path(sha256), 'ab') as part:
+            fcntl.flock(part, fcntl.LOCK_EX) # One writer per upload, across worker processes too
+            try:
+                current = part.seek(0, os.SEEK_END)
+                if offset != current:
+                    raise OffsetMismatch(current)
+                hasher = self._hasher_at(sha256, current)
+                written = 0
+                while True:
+                    block = stream.read(READ_BLOCK_BYTES)
+                    if not block:
+                        break
+                    written += len(block)
+                    if current + written > total_size:
+                        part.truncate(current)
+                        self._forget_hasher(sha256)
+                        raise UploadTooLarge(f"Chunk runs past the declared size of {total_size} bytes")
+                    part.write(block)
+                    hasher.update(block)
+                part.flush()
+                with self._lock:
+                    self._hashers[sha256] = (current + written, hasher)
+                    self._hashers.move_to_end(sha256)
+                    while len(self._hashers) > self.max_cached_hashers:
+                        self._hashers.popitem(last=False) # Rebuilt from the partial file if that upload resumes
+                return current + written
+            finally:
+                fcntl.flock(part, fcntl.LOCK_UN)
+
+    def _hasher_at(self, sha256, offset):
+        with self._lock:
+            cached = self._hashers.get(sha256)
+        if cached and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        with open(self._partial_path(sha256), 'rb') as part:
+            for block in iter(lambda: part.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher
+
+    def _forget_hasher(self, sha256):
+        with self._lock:
+            self._hashers.pop(sha256, None)
+
+    def finalize(self, sha256, extension=''):
+        """
+        Checks the completed partial file against its declared SHA-256 and moves it into place.
+        Returns the stored file's relative path. On a mismatch the partial file is discarded
+        (the client must start over) and DigestMismatch is raised.
+        """
+        hasher = self._hasher_at(sha256, self.partial_size(sha256))
+        self._forget_hasher(sha256)
+        partial_path = self._partial_path(sha256)
+        if hasher.hexdigest() != sha256:
+            os.remove(partial_path)
+            raise DigestMismatch(f"Uploaded content hashes to {hasher.hexdigest()}, not {sha256}")
+        relative_path = self.relative_path(sha256, extension)
+        os.makedirs(os.path.dirname(self.full_path(relative_path)), exist_ok=True)
+        os.replace(partial_path, self.full_path(relative_path))
+        return relative_path
+
+    def discard(self, sha256):
+        self._forget_hasher(sha256)
+        try:
+            os.remove(self._partial_path(sha256))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,461 @@
+# APIServer_Backend/services/notification_dispatcher.py
+"""
+Delivers alerts to people and systems without letting an alert storm block or overload the server.
+
+The alert engine calls enqueue_alerts() with each batch of new alerts; that only appends them to
+a per-recipient digest. A flusher thread sends a recipient's digest once its window
+(digest_window_seconds, counted from the first alert in it) has passed, as ONE message however
+many alerts it holds. Deliveries run on a small fixed thread pool, at most one at a time per
+recipient, so the work in flight is bounded by the number of recipients. Each channel has a token-bucket rate limit;
+a digest that has to wait for a token keeps absorbing new alerts, so a storm produces fewer,
+larger messages instead of a queue of thousands. A digest holds at most max_alerts_listed alerts
+(the ones its message lists); later ones are only counted, per severity, so memory stays bounded
+however long a recipient is rate limited or backing off. Failed deliveries are merged back into the
+recipient's digest and retried with exponential backoff, up to max_attempts.
+
+Channels keep their connections: SmtpChannel reuses authenticated SMTP sessions from a small
+pool, WebhookChannel posts through one requests.Session with a bounded connection pool.
+"""
+import smtplib
+import socketserver
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SEVERITY_ORDER = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+
+# channel is a key of the dispatcher's channels ('smtp', 'webhook'); address is an email address or URL
+Recipient = namedtuple('Recipient', ['name', 'channel', 'address', 'min_severity'])
+
+
+def parse_recipients(items):
+    """
+    Parses config entries `name = channel:address[, min_severity]`, e.g.
+    `ops = smtp:ops@example.com, high` or `dispatch = webhook:https://example.com/hook`.
+    """
+    recipients = []
+    for name, value in items:
+        target, _, min_severity = value.partition(',')
+        channel, _, address = target.strip().partition(':')
+        min_severity = min_severity.strip() or 'low'
+        if not address or min_severity not in SEVERITY_ORDER:
+            raise ValueError(f"Invalid notification recipient '{name} = {value}'")
+        recipients.append(Recipient(name, channel.strip().lower(), address.strip(), min_severity))
+    return recipients
+
+
+def format_digest(alerts, max_listed=50, overflow=None):
+    """
+    Returns (subject, text body) for a digest of alert dicts (as stored, with 'id'). overflow is
+    {severity: count} of further alerts that are counted but not listed.
+    """
+    overflow = dict(overflow or {})
+    for alert in alerts[max_listed:]:
+        overflow[alert['severity']] = overflow.get(alert['severity'], 0) + 1
+    alerts = alerts[:max_listed]
+    extra = sum(overflow.values())
+    total = len(alerts) + extra
+    worst = max([alert['severity'] for alert in alerts] + list(overflow),
+                key=lambda severity: SEVERITY_ORDER.get(severity, 0))
+    if len(alerts) == 1 and not extra:
+        subject = f"[FarmGuard {worst.upper()}] {alerts[0]['message']}"
+    else:
+        subject = f"[FarmGuard {worst.upper()}] {total} alerts"
+    lines = [f"{alert['first_seen_at']}  [{alert['severity'].upper()}] {alert['message']} (alert {alert['id']})"
+             for alert in alerts]
+    if extra:
+        by_severity = ', '.join(f"{count} {severity}" for severity, count in
+                                sorted(overflow.items(), key=lambda item: -SEVERITY_ORDER.get(item[0], 0)))
+        lines.append(f"... and {extra} more ({by_severity}) (see /api/alerts)")
+    return subject, "\n".join(lines) + "\n"
+
+
+class RateLimiter:
+    """Token bucket: rate_per_minute sustained, up to burst at once. try_acquire() never blocks."""
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = burst or max(1, min(10, rate_per_minute))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class SmtpChannel:
+    """Sends digests as plain-text email over a small pool of reused SMTP sessions."""
+    def __init__(self, host, port=25, username=None, password=None, starttls=False,
+                 from_address='farmguard@localhost', pool_size=2, timeout=10, rate_per_minute=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.from_address = from_address
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_per_minute)
+        self._idle = [] # Connected sessions not in use
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.messages_sent = 0
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        self.connections_opened += 1
+        return connection
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.quit()
+
+    def send(self, recipient, alerts, subject, body, alert_count):
+        message = EmailMessage()
+        message['From'] = self.from_address
+        message['To'] = recipient.address
+        message['Subject'] = subject
+        message.set_content(body)
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is not None:
+            try:
+                connection.send_message(message)
+                self.messages_sent += 1
+                self._release(connection)
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                connection.close() # Server dropped the idle session; retry once on a fresh one
+        connection = self._connect()
+        try:
+            connection.send_message(message)
+        except Exception:
+            connection.close()
+            raise
+        self.messages_sent += 1
+        self._release(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+
+
+class WebhookChannel:
+    """POSTs digests as JSON through one keep-alive session ({"subject", "alert_count", "alerts": [...]})."""
+    def __init__(self, timeout=10, pool_size=4, rate_per_minute=60, max_alerts_listed=500):
+        self.timeout = timeout
+        self.max_alerts_listed = max_alerts_listed
+        self.rate_limiter = RateLimiter(rate_per_minute)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.messages_sent = 0
+
+    def send(self, recipient, alerts, subject, body, alert_count):
+        response = self.session.post(recipient.address, timeout=self.timeout, json={
+            'subject': subject, 'alert_count': alert_count, 'alerts': alerts[:self.max_alerts_listed]})
+        response.raise_for_status()
+        self.messages_sent += 1
+
+    def close(self):
+        self.session.close()
+
+
+class _Digest:
+    __slots__ = ('alerts', 'overflow', 'opened_at', 'attempts', 'not_before')
+
+    def __init__(self, opened_at):
+        self.alerts = [] # The first max_alerts_listed alerts, oldest first
+        self.overflow = {} # severity -> count of alerts beyond those
+        self.opened_at = opened_at
+        self.attempts = 0
+        self.not_before = 0.0
+
+    @property
+    def count(self):
+        return len(self.alerts) + sum(self.overflow.values())
+
+    def add(self, alert, limit):
+        if len(self.alerts) < limit:
+            self.alerts.append(alert)
+        else:
+            self.overflow[alert['severity']] = self.overflow.get(alert['severity'], 0) + 1
+
+    def merge(self, other, limit):
+        """Appends a newer digest's alerts after this one's (for a failed delivery put back in front)."""
+        for alert in other.alerts:
+            self.add(alert, limit)
+        for severity, count in other.overflow.items():
+            self.overflow[severity] = self.overflow.get(severity, 0) + count
+
+
+class NotificationDispatcher:
+    def __init__(self, channels, recipients, digest_window_seconds=60, workers=4, max_attempts=5,
+                 max_alerts_listed=50, tick_seconds=0.5):
+        self.channels = channels # {'smtp': SmtpChannel, 'webhook': WebhookChannel}
+        self.recipients = [recipient for recipient in recipients if recipient.channel in channels]
+        for recipient in recipients:
+            if recipient.channel not in channels:
+                print(f"Notification Dispatcher: recipient {recipient.name} uses unknown channel '{recipient.channel}', ignored.")
+        self.digest_window_seconds = digest_window_seconds
+        self.max_attempts = max_attempts
+        self.max_alerts_listed = max_alerts_listed
+        self.tick_seconds = tick_seconds
+        self._digests = {} # recipient name -> _Digest waiting to be sent
+        self._in_flight = set() # recipient names with a delivery running
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._flush_now = False
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notify')
+        self._flusher = threading.Thread(target=self._run_flusher, name='notify-flusher', daemon=True)
+        self.alerts_enqueued = 0
+        self.digests_sent = 0
+        self.alerts_delivered = 0
+        self.delivery_failures = 0
+        self.alerts_dropped = 0
+        self.rate_limited = 0
+        print(f"Notification Dispatcher Initialized ({len(self.recipients)} recipient(s), "
+              f"digest window {digest_window_seconds}s, {workers} worker(s)).")
+
+    def start(self):
+        self._flusher.start()
+
+    def enqueue_alerts(self, alerts):
+        """Adds new alerts to the digests of every recipient whose min_severity they meet. Never blocks on I/O."""
+        now = time.monotonic()
+        with self._lock:
+            for alert in alerts:
+                severity = SEVERITY_ORDER.get(alert['severity'], 0)
+                for recipient in self.recipients:
+                    if severity < SEVERITY_ORDER[recipient.min_severity]:
+                        continue
+                    digest = self._digests.get(recipient.name)
+                    if digest is None:
+                        digest = self._digests[recipient.name] = _Digest(now)
+                    digest.add(alert, self.max_alerts_listed)
+                self.alerts_enqueued += 1
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.tick_seconds):
+            self._dispatch_ready()
+
+    def _dispatch_ready(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for recipient in self.recipients:
+                digest = self._digests.get(recipient.name)
+                if (digest is None or recipient.name in self._in_flight or now < digest.not_before
+                        or (not self._flush_now and now - digest.opened_at < self.digest_window_seconds)):
+                    continue
+                if not self.channels[recipient.channel].rate_limiter.try_acquire():
+                    self.rate_limited += 1 # Stays pending and keeps absorbing alerts
+                    continue
+                del self._digests[recipient.name]
+                self._in_flight.add(recipient.name)
+                ready.append((recipient, digest))
+        for recipient, digest in ready:
+            self._pool.submit(self._deliver, recipient, digest)
+
+    def _deliver(self, recipient, digest):
+        try:
+            alerts = [{name: value.isoformat() if hasattr(value, 'isoformat') else value for name, value in alert.items()}
+                      for alert in digest.alerts]
+            subject, body = format_digest(alerts, self.max_alerts_listed, digest.overflow)
+            self.channels[recipient.channel].send(recipient, alerts, subject, body, digest.count)
+            with self._lock:
+                self.digests_sent += 1
+                self.alerts_delivered += digest.count
+        except Exception as e:
+            with self._lock:
+                self.delivery_failures += 1
+                digest.attempts += 1
+                if digest.attempts >= self.max_attempts:
+                    self.alerts_dropped += digest.count
+                    print(f"Notification Dispatcher: giving up on {digest.count} alert(s) for {recipient.name} "
+                          f"after {digest.attempts} attempts: {e}")
+                else:
+                    # Merge back, oldest first, and back off before the next attempt
+                    pending = self._digests.pop(recipient.name, None)
+                    if pending:
+                        digest.merge(pending, self.max_alerts_listed)
+                    digest.not_before = time.monotonic() + min(300, 2 ** digest.attempts)
+                    self._digests[recipient.name] = digest
+                    print(f"Notification Dispatcher: delivery to {recipient.name} failed (attempt {digest.attempts}): {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(recipient.name)
+                self._idle.notify_all()
+
+    def flush(self, timeout=30):
+        """Sends every pending digest now, ignoring the window (not the rate limits); waits up to timeout."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._flush_now = True
+        try:
+            while time.monotonic() < deadline:
+                self._dispatch_ready()
+                with self._lock:
+                    if not self._digests and not self._in_flight:
+                        return True
+                    self._idle.wait(min(self.tick_seconds, max(0.0, deadline - time.monotonic())))
+            return False
+        finally:
+            with self._lock:
+                self._flush_now = False
+
+    def close(self, timeout=10):
+        self.flush(timeout)
+        self._stop.set()
+        self._pool.shutdown(wait=True)
+        for channel in self.channels.values():
+            channel.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'recipients': len(self.recipients),
+                'pending_digests': len(self._digests),
+                'pending_alerts': sum(digest.count for digest in self._digests.values()),
+                'in_flight': len(self._in_flight),
+                'alerts_enqueued': self.alerts_enqueued,
+                'digests_sent': self.digests_sent,
+                'alerts_delivered': self.alerts_delivered,
+                'delivery_failures': self.delivery_failures,
+                'alerts_dropped': self.alerts_dropped,
+                'rate_limited': self.rate_limited,
+                'smtp_connections_opened': getattr(self.channels.get('smtp'), 'connections_opened', None)
+            }
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    Minimal local SMTP server that accepts every message and keeps it, parsed, in memory; for the
+    standalone test below and the test suite. Run it with serve_forever() on a thread.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+        super().__init__(('127.0.0.1', 0), _SmtpSinkHandler)
+
+    def subjects_to(self, address):
+        return [message['Subject'] for message in self.messages if message['To'] == address]
+
+
+class _SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.sessions += 1
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply("221 bye")
+                return
+            if command == 'EHLO':
+                self.reply("250-sink")
+                self.reply("250 8BITMIME")
+            elif command == 'DATA':
+                self.reply("354 end with .")
+                data = []
+                while (data_line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.messages.append(message_from_bytes(b"".join(data), policy=policy.default))
+                self.reply("250 queued")
+            else: # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply("250 ok")
+
+
+# Standalone test: an alert storm delivered to an in-process SMTP sink and a local (slow) HTTP receiver
+if __name__ == '__main__':
+    import json
+    from datetime import datetime
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class SlowReceiver(BaseHTTPRequestHandler):
+        posts = []
+
+        def do_POST(self):
+            time.sleep(0.2) # A sluggish chat/incident webhook
+            SlowReceiver.posts.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    smtp_sink = SmtpSink()
+    threading.Thread(target=smtp_sink.serve_forever, daemon=True).start()
+    http_receiver = ThreadingHTTPServer(('127.0.0.1', 0), SlowReceiver)
+    threading.Thread(target=http_receiver.serve_forever, daemon=True).start()
+
+    STORM_ALERTS, STORM_SECONDS, WINDOW_SECONDS = 20000, 5.0, 1.0
+    recipients = parse_recipients([
+        ('ops', "smtp:ops@farm.example, low"), ('manager', "smtp:manager@farm.example, high"),
+        ('security', "smtp:security@farm.example, critical"),
+        ('dispatch', f"webhook:http://127.0.0.1:{http_receiver.server_address[1]}/hook, medium")])
+    channels = {'smtp': SmtpChannel('127.0.0.1', smtp_sink.server_address[1], pool_size=3, rate_per_minute=120),
+                'webhook': WebhookChannel(pool_size=2, rate_per_minute=60)}
+    dispatcher = NotificationDispatcher(channels, recipients, digest_window_seconds=WINDOW_SECONDS, workers=4,
+                                        tick_seconds=0.1)
+    dispatcher.start()
+
+    severities = ['low'] * 6 + ['medium'] * 3 + ['high', 'critical']
+    enqueue_seconds = 0.0
+    start = time.perf_counter()
+    for index in range(STORM_ALERTS // 100): # The alert engine hands over alerts in batches
+        batch = [{'id': index * 100 + i, 'severity': severities[(index * 100 + i) % len(severities)],
+                  'message': f"Unknown tag STORM{index * 100 + i:05d} seen by GATE_1", 'first_seen_at': datetime.utcnow()}
+                 for i in range(100)]
+        enqueue_start = time.perf_counter()
+        dispatcher.enqueue_alerts(batch)
+        enqueue_seconds += time.perf_counter() - enqueue_start
+        time.sleep(STORM_SECONDS / (STORM_ALERTS // 100))
+    storm_seconds = time.perf_counter() - start
+    dispatcher.close(timeout=60)
+    total_seconds = time.perf_counter() - start
+
+    stats = dispatcher.stats()
+    expected = sum(1 for i in range(STORM_ALERTS) for recipient in recipients
+                   if SEVERITY_ORDER[severities[i % len(severities)]] >= SEVERITY_ORDER[recipient.min_severity])
+    print(f"Storm: {STORM_ALERTS} alerts over {storm_seconds:.1f}s; enqueue_alerts() {enqueue_seconds / STORM_ALERTS * 1e6:.1f} us/alert "
+          f"on the alert engine's thread")
+    print(f"Delivered {stats['alerts_delivered']}/{expected} recipient-alerts in {stats['digests_sent']} messages "
+          f"({len(smtp_sink.messages)} emails, {len(SlowReceiver.posts)} webhook posts) by {total_seconds:.1f}s; "
+          f"{stats['delivery_failures']} failures, {stats['rate_limited']} rate-limit deferrals")
+    print(f"SMTP sessions opened: {stats['smtp_connections_opened']} (sink saw {smtp_sink.sessions}) for {len(smtp_sink.messages)} emails")
+    print(f"Without digests: {expected} messages; at the configured rate limits "
+          f"(120 emails/min, 60 posts/min) that backlog would take ~{expected / 120:.0f} minutes to drain")
@@ -0,0 +1,102 @@
+# APIServer_Backend/services/subunit_payload.py
+"""
+Codec for the compact binary LoRaWAN uplink sent by SubUnits (see SubUnit_LoRa/README_SubUnit.md).
+
+Payload v1, big-endian:
+    header  : version (u8), flags (u8), battery_mv (u16), scan_counter (u16), tag_count (u8), uid_len (u8)
+    tags    : tag_count x [uid (uid_len bytes), read_count (u8)]
+
+All tags in one uplink share uid_len (4, 7 or 10 byte ISO14443 UIDs). The header and the tag
+records are decoded with precompiled struct.Struct objects; tag records go through a single
+iter_unpack() pass instead of per-field slicing.
+"""
+import struct
+from collections import namedtuple
+
+PAYLOAD_VERSION = 1
+FLAG_LOW_BATTERY = 0x01
+
+HEADER = struct.Struct('>BBHHBB')
+_TAG_RECORDS = {uid_len: struct.Struct(f'>{uid_len}sB') for uid_len in (4, 7, 10)}
+
+SubUnitPayload = namedtuple('SubUnitPayload', ['version', 'flags', 'battery_mv', 'scan_counter', 'tags'])
+SubUnitTagRead = namedtuple('SubUnitTagRead', ['tag_id', 'read_count'])
+
+
+class PayloadDecodeError(ValueError):
+    pass
+
+
+def decode_subunit_payload(payload):
+    """Decodes raw uplink bytes into a SubUnitPayload. Raises PayloadDecodeError on malformed input."""
+    if len(payload) < HEADER.size:
+        raise PayloadDecodeError(f"Payload too short ({len(payload)} bytes)")
+    version, flags, battery_mv, scan_counter, tag_count, uid_len = HEADER.unpack_from(payload)
+    if version != PAYLOAD_VERSION:
+        raise PayloadDecodeError(f"Unsupported payload version {version}")
+    body = memoryview(payload)[HEADER.size:]
+    if tag_count == 0:
+        if len(body):
+            raise PayloadDecodeError("Trailing bytes after header with tag_count=0")
+        return SubUnitPayload(version, flags, battery_mv, scan_counter, [])
+    tag_record = _TAG_RECORDS.get(uid_len)
+    if tag_record is None:
+        raise PayloadDecodeError(f"Unsupported uid_len {uid_len}")
+    if len(body) != tag_count * tag_record.size:
+        raise PayloadDecodeError(f"Expected {tag_count} tag records of {tag_record.size} bytes, got {len(body)} bytes")
+    tags = [SubUnitTagRead(uid.hex(), read_count) for uid, read_count in tag_record.iter_unpack(body)]
+    return SubUnitPayload(version, flags, battery_mv, scan_counter, tags)
+
+
+def encode_subunit_payload(battery_mv, scan_counter, tags, flags=0):
+    """
+    Builds a v1 payload from [(tag_id_hex, read_count), ...]. Used by the network server
+    webhook stand-in in benchmarks.py and the standalone checks below.
+    """
+    uids = [bytes.fromhex(tag_id) for tag_id, _ in tags]
+    uid_len = len(uids[0]) if uids else 0
+    if any(len(uid) != uid_len for uid in uids):
+        raise ValueError("All tag UIDs in one payload must have the same length")
+    if uids and uid_len not in _TAG_RECORDS:
+        raise ValueError(f"Unsupported uid_len {uid_len}")
+    parts = [HEADER.pack(PAYLOAD_VERSION, flags, battery_mv, scan_counter, len(uids), uid_len)]
+    parts.extend(_TAG_RECORDS[uid_len].pack(uid, read_count) for uid, (_, read_count) in zip(uids, tags))
+    return b''.join(parts)
+
+
+# Standalone test: fixture round-trips, malformed payloads and a decoder micro-benchmark
+if __name__ == '__main__':
+    import timeit
+
+    fixtures = [
+        # (description, raw payload hex, expected decode)
+        ("heartbeat, no tags", "01000e7400070000",
+         SubUnitPayload(1, 0, 3700, 7, [])),
+        ("two 4-byte UIDs, low battery", "01010bb8002a0204" + "04a1b2c3" "01" + "03123456" "02",
+         SubUnitPayload(1, 1, 3000, 42, [SubUnitTagRead("04a1b2c3", 1), SubUnitTagRead("03123456", 2)])),
+        ("one 7-byte UID", "01000ce4ffff010704112233445566" + "05",
+         SubUnitPayload(1, 0, 3300, 65535, [SubUnitTagRead("04112233445566", 5)])),
+    ]
+    for description, raw_hex, expected in fixtures:
+        raw = bytes.fromhex(raw_hex)
+        try:
+            decoded = decode_subunit_payload(raw)
+        except PayloadDecodeError as e:
+            decoded = e
+        print(f"{'OK  ' if decoded == expected else 'FAIL'} {description}: {decoded}")
+
+    for description, raw_hex in [("truncated header", "0100"), ("bad version", "0200000000000000"),
+                                 ("record length mismatch", "010000000000010404a1b2c3"), ("bad uid_len", "01000000000001050102030405" + "01")]:
+        try:
+            decode_subunit_payload(bytes.fromhex(raw_hex))
+            print(f"FAIL {description}: no error raised")
+        except PayloadDecodeError as e:
+            print(f"OK   {description}: {e}")
+
+    tags = [(f"04{i:012x}", i % 256) for i in range(29)] # 29 x 7-byte UIDs = 240 bytes, fits a 242-byte uplink
+    payload = encode_subunit_payload(3600, 1234, tags)
+    assert decode_subunit_payload(payload).tags == [SubUnitTagRead(t, c) for t, c in tags]
+    runs = 100000
+    seconds = timeit.timeit(lambda: decode_subunit_payload(payload), number=runs)
+    print(f"Decoded {runs} payloads ({len(payload)} bytes, {len(tags)} tags) in {seconds:.2f}s: "
+          f"{runs / seconds:,.0f} payloads/s, {runs * len(tags) / seconds:,.0f} tags/s")
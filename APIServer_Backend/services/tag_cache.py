@@ -0,0 +1,110 @@
+# APIServer_Backend/services/tag_cache.py
+"""
+In-process RFID tag -> asset resolution cache used on the event ingestion path.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+TagAsset = namedtuple('TagAsset', ['asset_id', 'is_active', 'asset_name'])
+
+# Returned by get() when the tag is not cached at all (as opposed to cached as "no asset").
+MISS = object()
+
+
+class TagAssetCache:
+    """
+    Size-bounded LRU cache with TTL, mapping an RFID tag to a TagAsset or to None
+    (negative entry: the tag is not assigned to any asset). Negative entries get their own,
+    usually shorter, TTL so floods of unregistered tags are absorbed without hiding a newly
+    registered tag for long. Asset writes must call invalidate() for the affected tags.
+    Thread-safe; one instance is shared by all request threads of a worker process.
+    invalidate() only reaches this process's entries: other server processes keep a stale
+    entry until its TTL runs out, unless the write is relayed to them (app.py does that over
+    pg_notify when [Server] event_stream_pg_notify is on).
+    """
+    def __init__(self, max_entries=10000, ttl_seconds=300, negative_ttl_seconds=60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries = OrderedDict() # tag_id -> (expires_at, TagAsset or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        print(f"Tag Asset Cache Initialized (max_entries={max_entries}, ttl={ttl_seconds}s, negative_ttl={negative_ttl_seconds}s).")
+
+    def get(self, tag_id):
+        """Returns the cached TagAsset, None for a cached unknown tag, or MISS."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(tag_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[tag_id] # Expired
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(tag_id)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, tag_id, tag_asset):
+        """Caches a TagAsset for tag_id, or None to record that the tag has no asset."""
+        ttl = self.ttl_seconds if tag_asset is not None else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[tag_id] = (time.monotonic() + ttl, tag_asset)
+            self._entries.move_to_end(tag_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *tag_ids):
+        with self._lock:
+            for tag_id in tag_ids:
+                if tag_id and self._entries.pop(tag_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'negative_ttl_seconds': self.negative_ttl_seconds,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+# Standalone test: hits, negative entries and their shorter TTL, LRU eviction and invalidation
+if __name__ == '__main__':
+    cache = TagAssetCache(max_entries=2, ttl_seconds=5, negative_ttl_seconds=0.1)
+    tractor = TagAsset(1, True, "Tractor")
+    cache.put("TAG_A", tractor)
+    cache.put("TAG_UNKNOWN", None)
+    checks = [("cached asset", cache.get("TAG_A") == tractor),
+              ("cached unknown tag", cache.get("TAG_UNKNOWN") is None),
+              ("uncached tag", cache.get("TAG_B") is MISS)]
+    time.sleep(0.2)
+    checks.append(("negative entry expires first", cache.get("TAG_UNKNOWN") is MISS and cache.get("TAG_A") == tractor))
+    cache.put("TAG_B", TagAsset(2, False, "Trailer"))
+    cache.put("TAG_C", TagAsset(3, True, "Sprayer")) # Over max_entries: TAG_A is the least recently used
+    checks.append(("LRU eviction", cache.get("TAG_A") is MISS and cache.get("TAG_C") is not MISS))
+    cache.invalidate("TAG_C", None)
+    checks.append(("invalidate", cache.get("TAG_C") is MISS))
+    for description, passed in checks:
+        print(f"{'OK  ' if passed else 'FAIL'} {description}")
+    print(cache.stats())
@@ -8,18 +8,30 @@ document.addEventListener('DOMContentLoaded', function() {
         // console.log("Message from server:", welcomeMessageElement.dataset.message);
     }
 
+    // ETag of the events currently displayed. Refreshes send it as If-None-Match so an
+    // unchanged event list costs the server one watermark query and returns an empty 304.
+    let eventsEtag = null;
+
     async function fetchEvents() {
         if (!eventLogBody) return; // Guard if element not found
-        eventLogBody.innerHTML = '<tr><td colspan="4">Loading events...</td></tr>'; // Wider colspan
+        if (!eventsEtag) {
+            eventLogBody.innerHTML = '<tr><td colspan="4">Loading events...</td></tr>'; // Wider colspan
+        }
         try {
-            const response = await fetch('/api/events');
+            const headers = eventsEtag ? { 'If-None-Match': eventsEtag } : {};
+            const response = await fetch('/api/events', { headers: headers, cache: 'no-store' });
+            if (response.status === 304) {
+                return; // Nothing changed, keep the rendered table
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             const events = await response.json();
+            eventsEtag = response.headers.get('ETag');
             displayEvents(events);
         } catch (error) {
             console.error("Could not fetch events:", error);
+            eventsEtag = null;
             if (eventLogBody) eventLogBody.innerHTML = '<tr><td colspan="4">Error loading events. Please try again.</td></tr>';
         }
     }
@@ -33,23 +45,100 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
 
-        events.forEach(event => {
-            const row = eventLogBody.insertRow();
-            row.insertCell().textContent = event.id || 'N/A';
-            row.insertCell().textContent = event.timestamp ? new Date(event.timestamp).toLocaleString() : 'N/A';
-            row.insertCell().textContent = event.tag_id || 'N/A';
-            
-            const cellVideo = row.insertCell();
-            if (event.video_url) {
-                const videoLink = document.createElement('a');
-                videoLink.href = event.video_url;
-                videoLink.textContent = "View Video";
-                videoLink.target = "_blank";
-                cellVideo.appendChild(videoLink);
-            } else {
-                cellVideo.textContent = "No video";
+        events.forEach(event => renderEventRow(event, -1));
+    }
+
+    // Renders one event as a table row at the given index (-1 appends, 0 puts it on top)
+    function renderEventRow(event, index) {
+        const row = eventLogBody.insertRow(index);
+        row.insertCell().textContent = event.id || 'N/A';
+        row.insertCell().textContent = event.timestamp_iso ? new Date(event.timestamp_iso).toLocaleString() : 'N/A';
+        row.insertCell().textContent = event.tag_id || 'N/A';
+        
+        const cellVideo = row.insertCell();
+        if (event.thumbnail_url) {
+            // Thumbnail and proxy upload ahead of the full clip, so the row has a preview right away
+            const preview = document.createElement('a');
+            preview.href = event.proxy_url || event.thumbnail_url;
+            preview.target = "_blank";
+            const thumbnail = document.createElement('img');
+            thumbnail.src = event.thumbnail_url;
+            thumbnail.loading = "lazy";
+            thumbnail.width = 160;
+            thumbnail.alt = "Clip thumbnail";
+            preview.appendChild(thumbnail);
+            cellVideo.appendChild(preview);
+        }
+        if (event.video_url_remote) {
+            const videoLink = document.createElement('a');
+            videoLink.href = event.video_url_remote;
+            videoLink.textContent = event.thumbnail_url ? "Full resolution" : "View Video";
+            videoLink.target = "_blank";
+            const videoSha256 = originalVideoSha256(event);
+            if (videoSha256) {
+                videoLink.addEventListener('click', function(e) { openOriginalVideo(e, event, videoSha256); });
+            } // Legacy or external URLs open directly
+            if (cellVideo.firstChild) cellVideo.appendChild(document.createElement('br'));
+            cellVideo.appendChild(videoLink);
+        } else if (!event.thumbnail_url) {
+            cellVideo.textContent = "No video";
+        }
+        return row;
+    }
+
+    // The SHA-256 of an original uploaded to this server: named by the event itself, or read from a
+    // /api/media/<sha256> URL. Null for legacy events and clips hosted elsewhere.
+    const MEDIA_URL_PATTERN = /^\/api\/media\/([0-9a-f]{64})$/;
+    function originalVideoSha256(event) {
+        const payload = event.raw_event_payload || {};
+        if (typeof payload.video_sha256 === 'string' && /^[0-9a-f]{64}$/.test(payload.video_sha256)) {
+            return payload.video_sha256;
+        }
+        const match = MEDIA_URL_PATTERN.exec(event.video_url_remote || '');
+        return match ? match[1] : null;
+    }
+
+    // Full-resolution originals upload when the Guardian's link is idle; if this one is not on the
+    // server yet, ask the unit to send it now instead of opening a 404.
+    async function openOriginalVideo(clickEvent, event, sha256) {
+        clickEvent.preventDefault();
+        const mediaUrl = `/api/media/${sha256}`;
+        try {
+            const check = await fetch(mediaUrl, { method: 'HEAD' });
+            if (check.ok) {
+                window.open(mediaUrl, '_blank');
+                return;
+            }
+            await fetch(`${mediaUrl}/request`, {
+                method: 'POST', headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ unit_id: event.unit_id })
+            });
+        } catch (error) {
+            console.error('Error checking for the original clip:', error);
+            window.open(event.video_url_remote, '_blank');
+            return;
+        }
+        alert("The full-resolution clip is still on the Guardian unit. It has been asked to upload it; try again in a few minutes.");
+    }
+
+    // Live feed: new Guardian events are pushed by the server and prepended to the table,
+    // so the full list is only fetched on page load and on manual refresh.
+    const MAX_LIVE_ROWS = 500;
+    function startLiveFeed() {
+        if (!eventLogBody || !window.EventSource) return;
+        const source = new EventSource('/api/events/stream');
+        source.addEventListener('guardian', function(message) {
+            const event = JSON.parse(message.data);
+            if (eventLogBody.rows.length === 1 && eventLogBody.rows[0].cells.length === 1) {
+                eventLogBody.innerHTML = ''; // Drop the "No events found." placeholder row
+            }
+            renderEventRow(event, 0);
+            while (eventLogBody.rows.length > MAX_LIVE_ROWS) {
+                eventLogBody.deleteRow(-1);
             }
+            eventsEtag = null; // Table no longer matches the last full fetch
         });
+        // EventSource reconnects on its own (resuming from the last event id) after errors
     }
 
     if (refreshButton) {
@@ -59,5 +148,6 @@ document.addEventListener('DOMContentLoaded', function() {
     // Fetch events on initial page load if the table body exists
     if (eventLogBody) {
         fetchEvents();
+        startLiveFeed();
     }
 });
\ No newline at end of file
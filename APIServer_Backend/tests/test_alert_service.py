@@ -0,0 +1,111 @@
+# APIServer_Backend/tests/test_alert_service.py
+"""AlertService on its own (rules, storage and unit activity are plain callables), and with the app's storage in PostgreSQL."""
+from datetime import datetime, time, timedelta, timezone
+
+from APIServer_Backend.services.alert_service import AFTER_HOURS_EXIT, UNIT_SILENT, UNKNOWN_TAG, AlertEvent, AlertService, make_rule
+
+
+class StoredAlerts:
+    """persist_alerts stand-in that keeps new alerts and repeats in lists."""
+    def __init__(self):
+        self.new_alerts = []
+        self.repeats = []
+
+    def __call__(self, new_alerts, repeats):
+        self.new_alerts.extend(new_alerts)
+        self.repeats.extend(repeats)
+        return list(range(len(self.new_alerts) - len(new_alerts) + 1, len(self.new_alerts) + 1))
+
+
+def unknown_tag_event(tag_id):
+    return AlertEvent('guardian', 1, 'GATE_A', tag_id, None, None, None, 'egress', None, datetime.utcnow())
+
+
+def silence_service(last_seen, last_fired=None, silent_minutes=30):
+    stored = StoredAlerts()
+    service = AlertService(lambda: [make_rule(1, "Gate A silent", UNIT_SILENT, unit_id='GATE_A', silent_minutes=silent_minutes)],
+                           stored, load_unit_activity=lambda unit_ids: (last_seen, last_fired or {}))
+    service._load_rules()
+    return service, stored
+
+
+def test_silence_check_accepts_timezone_aware_activity():
+    # timestamptz columns come back aware; the engine's own clock is naive UTC
+    service, stored = silence_service({'GATE_A': datetime.now(timezone(timedelta(hours=2))) - timedelta(minutes=45)})
+    service.check_silent_units()
+    assert [alert['message'] for alert in stored.new_alerts] == ["Unit GATE_A has been silent for 45 minutes"]
+
+
+def test_silence_check_does_not_refire_for_the_same_silence():
+    seen_at = datetime.now(timezone.utc) - timedelta(minutes=45)
+    fired_at = datetime.utcnow() - timedelta(minutes=10) # Naive and aware values mixed
+    service, stored = silence_service({'GATE_A': seen_at}, {(1, 'GATE_A'): fired_at})
+    service.check_silent_units()
+    assert stored.new_alerts == []
+
+
+def test_unit_that_reported_recently_is_not_silent():
+    service, stored = silence_service({'GATE_A': datetime.now(timezone.utc) - timedelta(minutes=5)})
+    service.check_silent_units()
+    assert stored.new_alerts == []
+
+
+def test_worker_survives_a_failing_batch():
+    stored = StoredAlerts()
+    service = AlertService(lambda: [make_rule(None, "Unknown tags", UNKNOWN_TAG),
+                                    make_rule(None, "Night exits", AFTER_HOURS_EXIT, allowed_from=time(6), allowed_until=time(20))],
+                           stored, workers=1)
+    service._load_rules()
+    service.start()
+    garbled = unknown_tag_event('TAG0001')._replace(asset_id=7, event_time='05:00') # Not a datetime: evaluation raises
+    service.submit([garbled])
+    service.wait_until_idle()
+    assert service.stats()['queued'] == 0
+
+    service.submit([unknown_tag_event('TAG0002')])
+    service.wait_until_idle()
+    assert service.stats()['queued'] == 0
+    assert [alert['tag_id'] for alert in stored.new_alerts] == ['TAG0002']
+
+
+def test_alert_opened_by_another_process_gets_the_repeat():
+    stored, lookups = StoredAlerts(), []
+    def find_open_alerts(keys):
+        lookups.append(keys)
+        return {('unknown_tag', 'TAG0001'): 41} # Opened by another server process
+    service = AlertService(lambda: [make_rule(None, "Unknown tags", UNKNOWN_TAG, suppress_minutes=5)], stored, workers=1,
+                           find_open_alerts=find_open_alerts)
+    service._load_rules()
+    service.start()
+    service.submit([unknown_tag_event(tag_id) for tag_id in ('TAG0001', 'TAG0001', 'TAG0002')])
+    service.wait_until_idle()
+    assert lookups == [[(('unknown_tag', 'TAG0001'), 300), (('unknown_tag', 'TAG0002'), 300)]]
+    assert [alert['tag_id'] for alert in stored.new_alerts] == ['TAG0002']
+    assert [(alert_id, extra) for alert_id, extra, _ in stored.repeats] == [(41, 2)]
+
+    service.submit([unknown_tag_event('TAG0001')]) # Now this worker knows the alert itself
+    service.wait_until_idle()
+    assert len(lookups) == 1 and [alert_id for alert_id, _, _ in stored.repeats] == [41, 41]
+
+
+def test_two_server_processes_share_one_open_alert(server):
+    def process():
+        service = AlertService(lambda: [make_rule(None, "Unknown tags", UNKNOWN_TAG)], server.persist_alerts, workers=1,
+                               find_open_alerts=server.find_open_alerts)
+        service._load_rules()
+        service.start()
+        return service
+    first, second = process(), process()
+    for service in (first, second, first):
+        service.submit([unknown_tag_event('TAG0001')])
+        service.wait_until_idle()
+    assert (first.alerts_created, second.alerts_created) == (1, 0)
+    with server.app.app_context():
+        assert [(alert.tag_id, alert.occurrence_count) for alert in server.Alert.query.all()] == [('TAG0001', 3)]
+
+        server.Alert.query.update({'status': 'acknowledged'})
+        server.db.session.commit()
+    third = process() # A process that has not seen the tag: the stored alert is not open any more
+    third.submit([unknown_tag_event('TAG0001')])
+    third.wait_until_idle()
+    assert third.alerts_created == 1
@@ -0,0 +1,60 @@
+# APIServer_Backend/tests/test_event_broadcaster.py
+"""PgNotifyBridge against PostgreSQL: bad notifications are skipped, a dropped connection is re-established."""
+import json
+import time
+
+from sqlalchemy import text
+
+from APIServer_Backend.services.event_broadcaster import EventBroadcaster, PgNotifyBridge
+
+CHANNEL = 'farmguard_test_bridge'
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def notify(server, payload):
+    with server.app.app_context():
+        server.db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': CHANNEL, 'payload': payload})
+        server.db.session.commit()
+
+
+def listener_pids(server):
+    with server.app.app_context():
+        return server.db.session.execute(text("SELECT pid FROM pg_stat_activity WHERE query = :query"),
+                                         {'query': f'LISTEN "{CHANNEL}"'}).scalars().all()
+
+
+def test_bridge_survives_bad_notifications_and_reconnects(server):
+    invalidated, reconnects = [], []
+    def invalidate(tag_ids):
+        if tag_ids == ['BOOM']:
+            raise RuntimeError("handler failed")
+        invalidated.extend(tag_ids)
+    broadcaster = EventBroadcaster()
+    bridge = PgNotifyBridge(broadcaster, CHANNEL, handlers={'invalidate': invalidate},
+                            on_reconnect=lambda: reconnects.append(True), max_backoff_seconds=1)
+    with server.app.app_context():
+        bridge.ensure_started(server.db.engine)
+    assert wait_for(lambda: len(listener_pids(server)) == 1)
+
+    for payload in ("not json", json.dumps({'payload': ['TAG0001']}), json.dumps({'type': 'invalidate', 'payload': ['BOOM']}),
+                    json.dumps({'type': 'invalidate', 'payload': ['TAG0002']}), json.dumps({'type': 'guardian', 'payload': {'id': 1}})):
+        notify(server, payload)
+    assert wait_for(lambda: broadcaster.published == 1)
+    assert invalidated == ['TAG0002']
+
+    # A database restart or failover: the listener's backend goes away
+    with server.app.app_context():
+        server.db.session.execute(text("SELECT pg_terminate_backend(:pid)"), {'pid': listener_pids(server)[0]})
+        server.db.session.commit()
+    assert wait_for(lambda: reconnects and len(listener_pids(server)) == 1)
+    notify(server, json.dumps({'type': 'invalidate', 'payload': ['TAG0003']}))
+    assert wait_for(lambda: invalidated == ['TAG0002', 'TAG0003'])
+    assert bridge.reconnects == 1 and bridge._thread.is_alive()
@@ -0,0 +1,84 @@
+# APIServer_Backend/tests/test_events.py
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+
+def _ingest_tagged_events(server, client, count, distinct_assets=20):
+    """Creates distinct_assets assets and count Guardian events for their tags, through the batch endpoint."""
+    with server.app.app_context():
+        server.db.session.add_all([server.Asset(asset_name=f"Bin {i}", rfid_tag_assigned=f"TAG{i:04d}")
+                                   for i in range(distinct_assets)])
+        server.db.session.commit()
+    now_iso = datetime.now(timezone.utc).isoformat()
+    response = client.post('/api/guardian_events/batch', json=[
+        {"unit_id": "GATE_A", "event": {"timestamp_iso": now_iso, "tag_id": f"TAG{i % distinct_assets:04d}", "direction": "egress"}}
+        for i in range(count)])
+    assert response.status_code == 201, response.get_json()
+
+
+def test_event_listing_query_count_is_independent_of_page_size(server, client):
+    from APIServer_Backend.benchmarks import count_queries # Imports the app, so only once the database is configured
+    _ingest_tagged_events(server, client, 150)
+    with server.app.app_context():
+        engine = server.db.engine
+    counts = {}
+    for limit in (10, 100):
+        with count_queries(engine) as statements:
+            response = client.get('/api/events', query_string={'limit': limit})
+        assert response.status_code == 200
+        events = response.get_json()
+        assert len(events) == limit
+        assert all(event['asset_info'] and event['asset_info']['name'].startswith('Bin ') for event in events)
+        counts[limit] = len(statements)
+    assert counts[10] == counts[100], counts
+
+
+def test_event_listing_pages_with_cursor(server, client):
+    _ingest_tagged_events(server, client, 25)
+    first = client.get('/api/events', query_string={'limit': 20})
+    assert first.status_code == 200 and len(first.get_json()) == 20
+    second = client.get('/api/events', query_string={'limit': 20, 'cursor': first.headers['X-Next-Cursor']})
+    assert second.status_code == 200 and 'X-Next-Cursor' not in second.headers
+    ids = [event['id'] for event in first.get_json() + second.get_json()]
+    assert len(ids) == len(set(ids)) == 25
+
+
+def test_batch_rejects_values_the_columns_cannot_hold_per_item(server, client):
+    now_iso = datetime.now(timezone.utc).isoformat()
+    def item(unit_id="GATE_A", **event):
+        return {"unit_id": unit_id, "event": {"timestamp_iso": now_iso, "tag_id": "TAG0001", "direction": "egress", **event}}
+    response = client.post('/api/guardian_events/batch', json=[
+        item(), item(tag_id="E2" * 51), item(unit_id=1234), item(direction="x" * 21), item(tag_id=["TAG0001"]), item()])
+    assert response.status_code == 207, response.get_json()
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['success', 'error', 'error', 'error', 'error', 'success']
+    assert [result['message'] for result in results[1:5]] == [
+        "event.tag_id is longer than 100 characters", "unit_id must be a string",
+        "event.direction is longer than 20 characters", "event.tag_id must be a string"]
+    with server.app.app_context():
+        assert server.GuardianEvent.query.count() == 2
+
+    response = client.post('/api/guardian_event', json=item(tag_id="E2" * 51))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "event.tag_id is longer than 100 characters"
+
+
+def test_naive_utc_times_are_stored_as_utc_whatever_the_database_time_zone(server, client):
+    with server.app.app_context():
+        engine = server.db.engine
+        database = server.db.session.execute(text("SELECT current_database()")).scalar()
+        server.db.session.execute(text(f"ALTER DATABASE \"{database}\" SET timezone = 'America/Los_Angeles'"))
+        server.db.session.commit()
+    engine.dispose() # New connections start with the database's default
+    try:
+        _ingest_tagged_events(server, client, 1, distinct_assets=1) # received_at is the models' naive datetime.utcnow
+        with server.app.app_context():
+            assert server.db.session.execute(text("SHOW timezone")).scalar() == 'UTC'
+            received_at = server.GuardianEvent.query.one().received_at
+    finally:
+        with server.app.app_context():
+            server.db.session.execute(text(f"ALTER DATABASE \"{database}\" RESET timezone"))
+            server.db.session.commit()
+        engine.dispose()
+    assert abs(received_at - datetime.now(timezone.utc)) < timedelta(minutes=1)
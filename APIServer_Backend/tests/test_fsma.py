@@ -0,0 +1,78 @@
+# APIServer_Backend/tests/test_fsma.py
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+from APIServer_Backend.services.fsma_processor import FSMAService
+
+
+class PartitionedResult:
+    """Stands in for a yield_per Result: rows in REPORT_FIELDS order, in partitions."""
+    def __init__(self, *partitions):
+        self._partitions = partitions
+
+    def partitions(self):
+        return iter(self._partitions)
+
+
+def report_rows(chunks):
+    return list(csv.reader(io.StringIO(''.join(chunks))))
+
+
+def test_report_csv_dates_and_times_are_utc():
+    plus_two = timezone(timedelta(hours=2)) # timestamptz as returned for a non-UTC session time zone
+    rows = [('LOT-1', "Romaine bin", 'shipping', datetime(2024, 5, 1, 1, 30, 5, 250000, tzinfo=plus_two), 'GATE_A', "Gate A",
+             'TAG0001', 7, 'guardian', 11),
+            ('LOT-1', "Romaine bin", 'receiving', datetime(2024, 5, 1, 6, 45), 'DOCK', None, 'TAG0001', 7, 'subunit', 12)]
+    header, *lines = report_rows(FSMAService.iter_report_csv(PartitionedResult(rows[:1], rows[1:])))
+    assert header[3:5] == ['Event Date (UTC)', 'Event Time (UTC)']
+    assert [line[3:5] for line in lines] == [['2024-04-30', '23:30:05'], ['2024-05-01', '06:45:00']]
+    assert [line[9:] for line in lines] == [['guardian_event', '11'], ['subunit_event', '12']]
+
+
+def test_overlong_lot_code_rejects_only_its_own_item(server, client, auth_headers):
+    now_iso = datetime.now(timezone.utc).isoformat()
+    def item(tag_id, **event):
+        return {"unit_id": "GATE_A", "event": {"timestamp_iso": now_iso, "tag_id": tag_id, "direction": "egress", **event}}
+    response = client.post('/api/guardian_events/batch', json=[
+        item('TAG0001', traceability_lot_code="LOT-2024-001"), item('TAG0002', traceability_lot_code="L" * 101),
+        item('TAG0003', traceability_lot_code=42), item('TAG0004')])
+    assert response.status_code == 207, response.get_json()
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['success', 'error', 'error', 'success']
+    assert results[1]['message'] == "event.traceability_lot_code is longer than 100 characters"
+    assert results[2]['message'] == "event.traceability_lot_code must be a string"
+    with server.app.app_context():
+        assert [(record.tag_id, record.traceability_lot_code) for record in server.FSMARecord.query.order_by(server.FSMARecord.id)] == [
+            ('TAG0001', "LOT-2024-001"), ('TAG0004', 'TAG0004')]
+
+    response = client.post('/api/guardian_event', json=item('TAG0005', traceability_lot_code="L" * 101))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "event.traceability_lot_code is longer than 100 characters"
+
+
+def test_traceability_report_streams_utc_csv(server, client, auth_headers):
+    response = client.post('/api/guardian_events/batch', json=[
+        {"unit_id": "GATE_A", "event": {"timestamp_iso": "2024-05-01T01:30:00+02:00", "tag_id": "TAG0001",
+                                        "direction": "egress", "traceability_lot_code": "LOT-2024-001"}}])
+    assert response.status_code == 201, response.get_json()
+    response = client.get('/api/fsma/traceability_report', query_string={'lot_code': "LOT-2024-001"}, headers=auth_headers)
+    assert response.status_code == 200
+    header, *lines = report_rows([response.get_data(as_text=True)])
+    assert lines == [["LOT-2024-001", '', 'shipping', '2024-04-30', '23:30:00', 'GATE_A', '', 'TAG0001', '',
+                      'guardian_event', '1']]
+
+
+def test_backfill_records_every_unrecorded_event(server, client):
+    now_iso = datetime.now(timezone.utc).isoformat()
+    response = client.post('/api/guardian_events/batch', json=[
+        {"unit_id": "GATE_A", "event": {"timestamp_iso": now_iso, "tag_id": f"TAG000{n}", "direction": "egress"}} for n in range(1, 6)])
+    assert response.status_code == 201, response.get_json()
+    with server.app.app_context():
+        # Only the oldest event recorded (e.g. by record_missing before a purge): the others above it are not
+        server.FSMARecord.query.filter(server.FSMARecord.tag_id != 'TAG0001').delete()
+        server.db.session.commit()
+        added = server.fsma_service.backfill('guardian', server.GuardianEvent, server.Asset, 'event_time', batch_size=2)
+        assert added == 4
+        assert sorted(record.tag_id for record in server.FSMARecord.query) == [f"TAG000{n}" for n in range(1, 6)]
+        assert server.fsma_service.backfill('guardian', server.GuardianEvent, server.Asset, 'event_time') == 0
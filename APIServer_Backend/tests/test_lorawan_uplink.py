@@ -0,0 +1,79 @@
+# APIServer_Backend/tests/test_lorawan_uplink.py
+"""
+/api/lorawan_uplink driven by recorded The Things Stack v3 webhook messages (fixtures/lorawan),
+posted the way the network server's webhook integration would.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'lorawan')
+
+
+def load_uplink(name):
+    with open(os.path.join(FIXTURES, f'uplink_{name}.json')) as fixture:
+        return json.load(fixture)
+
+
+def stored_events(server):
+    with server.app.app_context():
+        return [(event.unit_id, event.tag_id, event.asset_id, event.battery_level_mv, event.rssi, event.snr,
+                 event.reported_at_device.astimezone(timezone.utc), event.raw_lorawan_payload)
+                for event in server.SubUnitEvent.query.order_by(server.SubUnitEvent.id)]
+
+
+@pytest.fixture
+def tagged_asset_id(server):
+    with server.app.app_context():
+        asset = server.Asset(asset_name="Harvest bin 12", rfid_tag_assigned="04a1b2c3")
+        server.db.session.add(asset)
+        server.db.session.commit()
+        return asset.id
+
+
+def test_tag_reads_become_one_event_per_tag(server, client, tagged_asset_id):
+    uplink = load_uplink('two_tags')
+    response = client.post('/api/lorawan_uplink', json=uplink)
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['results'] == [{"index": 0, "status": "success", "event_ids": [1, 2]}]
+    # Best gateway's RSSI/SNR, network server time, payload kept as received
+    received_at = datetime(2024, 5, 1, 6, 30, 0, 123456, tzinfo=timezone.utc)
+    payload = uplink['uplink_message']['frm_payload']
+    assert stored_events(server) == [("subunit-07", "04a1b2c3", tagged_asset_id, 3000, -84, 9.5, received_at, payload),
+                                     ("subunit-07", "03123456", None, 3000, -84, 9.5, received_at, payload)]
+
+
+def test_heartbeat_is_stored_as_one_tagless_event(server, client):
+    response = client.post('/api/lorawan_uplink', json=load_uplink('heartbeat'))
+    assert response.status_code == 201, response.get_json()
+    assert [event[:6] for event in stored_events(server)] == [("subunit-07", None, None, 3700, -101, -2.0)]
+
+
+@pytest.mark.parametrize('name, message', [('truncated', "Expected 1 tag records of 8 bytes, got 4 bytes"),
+                                           ('unknown_version', "Unsupported payload version 2")])
+def test_malformed_payload_is_rejected(server, client, name, message):
+    response = client.post('/api/lorawan_uplink', json=load_uplink(name))
+    assert response.status_code == 400
+    assert response.get_json()['results'] == [{"index": 0, "status": "error", "message": message}]
+    assert stored_events(server) == []
+
+
+def test_batch_stores_valid_uplinks_and_reports_the_rest(server, client, tagged_asset_id):
+    response = client.post('/api/lorawan_uplink', json=load_uplink('batch'))
+    assert response.status_code == 207
+    body = response.get_json()
+    assert [result['status'] for result in body['results']] == ['success', 'error', 'success', 'ignored']
+    assert (body['stored'], body['rejected'], body['events_stored']) == (2, 1, 3)
+    assert body['results'][2]['event_ids'] == [3]
+    assert [(unit_id, tag_id, asset_id) for unit_id, tag_id, asset_id, *_ in stored_events(server)] == [
+        ("subunit-07", "04a1b2c3", tagged_asset_id), ("subunit-07", "03123456", None), ("subunit-07", None, None)]
+
+
+def test_webhook_secret_is_enforced(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'LORAWAN_WEBHOOK_SECRET', 's3cret')
+    assert client.post('/api/lorawan_uplink', json=load_uplink('heartbeat')).status_code == 401
+    response = client.post('/api/lorawan_uplink', json=load_uplink('heartbeat'), headers={'X-Webhook-Secret': 's3cret'})
+    assert response.status_code == 201
+    assert len(stored_events(server)) == 1
@@ -0,0 +1,161 @@
+# APIServer_Backend/tests/test_media_upload.py
+"""
+Resumable media uploads end to end: the Guardian's real DataUploader (GuardianUnit_RPi/data_uploader.py)
+talking HTTP to the app on a local socket, with a scratch MediaStore.
+"""
+import hashlib
+import io
+import os
+import sys
+import threading
+
+import pytest
+import requests
+from werkzeug.serving import make_server
+
+from conftest import REPO_ROOT
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'GuardianUnit_RPi'))
+from data_uploader import MEDIA_REJECTED, DataUploader, file_sha256  # noqa: E402
+
+CHUNK_BYTES = 64 * 1024
+CLIP_BYTES = 5 * CHUNK_BYTES + 1000 # Last chunk is a short one
+
+
+class LinkDropLimiter:
+    """Passes bytes through until drop_after_bytes, then fails once, like a backhaul dropping mid-chunk."""
+    def __init__(self, drop_after_bytes):
+        self.remaining = drop_after_bytes
+        self.sent = 0
+
+    def consume(self, nbytes):
+        self.sent += nbytes
+        self.remaining -= nbytes
+        if self.remaining < 0:
+            self.remaining = float('inf')
+            raise requests.exceptions.ConnectionError("Simulated link drop")
+
+
+@pytest.fixture
+def media_store(server, tmp_path, monkeypatch):
+    from APIServer_Backend.services.media_store import MediaStore
+    store = MediaStore(str(tmp_path / 'media'))
+    monkeypatch.setattr(server, 'media_store', store)
+    return store
+
+
+@pytest.fixture
+def live_server(server, media_store):
+    """The app on a real socket in a background thread; yields its API base URL."""
+    http_server = make_server('127.0.0.1', 0, server.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_port}/api"
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def uploader(live_server, tmp_path):
+    config_path = tmp_path / 'config_guardian.ini'
+    config_path.write_text(f"[General]\napi_server_url = {live_server}\nguardian_unit_id = GATE_A\n"
+                           f"[Uploader]\nrequest_timeout_seconds = 10\nmedia_chunk_bytes = {CHUNK_BYTES}\n"
+                           f"media_bandwidth_kbps = 0\n")
+    uploader = DataUploader(config_path=str(config_path))
+    yield uploader
+    uploader.close()
+
+
+@pytest.fixture
+def clip_path(tmp_path):
+    path = tmp_path / 'CLIP_0001.h264'
+    path.write_bytes(os.urandom(CLIP_BYTES))
+    return str(path)
+
+
+def record_patches(uploader):
+    """Wraps the uploader's session so every PATCH status code is collected."""
+    statuses = []
+    patch = uploader.session.patch
+    def recording_patch(*args, **kwargs):
+        response = patch(*args, **kwargs)
+        statuses.append(response.status_code)
+        return response
+    uploader.session.patch = recording_patch
+    return statuses
+
+
+def stored_copy_sha256(server, media_store, sha256):
+    with server.app.app_context():
+        media_file = server.MediaFile.query.filter_by(sha256=sha256).one()
+        assert media_file.status == 'complete'
+        return file_sha256(media_store.full_path(media_file.storage_path))
+
+
+def test_upload_resumes_after_link_drops_mid_chunk(server, media_store, uploader, clip_path):
+    sha256 = file_sha256(clip_path)
+    uploader.bandwidth_limiter = LinkDropLimiter(2 * CHUNK_BYTES + CHUNK_BYTES // 2) # Halfway through the third chunk
+    assert uploader.upload_media_file(clip_path, sha256, 'video/h264') is None
+    assert 2 * CHUNK_BYTES <= media_store.partial_size(sha256) < CLIP_BYTES # The two whole chunks at least
+
+    resumed = LinkDropLimiter(float('inf'))
+    uploader.bandwidth_limiter = resumed
+    media_url = uploader.upload_media_file(clip_path, sha256, 'video/h264')
+    assert media_url == f"/api/media/{sha256}"
+    assert resumed.sent <= CLIP_BYTES - 2 * CHUNK_BYTES # Picked up from the server's offset, not from 0
+    assert stored_copy_sha256(server, media_store, sha256) == sha256
+
+
+def test_already_uploaded_clip_is_not_sent_again(server, media_store, uploader, clip_path):
+    media_url = uploader.upload_media_file(clip_path, content_type='video/h264')
+    assert media_url
+    patches = record_patches(uploader)
+    assert uploader.upload_media_file(clip_path, content_type='video/h264') == media_url
+    assert patches == []
+    with server.app.app_context():
+        assert server.MediaFile.query.count() == 1
+
+
+def test_stale_offset_continues_from_server_offset(server, media_store, uploader, clip_path):
+    sha256 = file_sha256(clip_path)
+    with open(clip_path, 'rb') as clip:
+        first_chunk = clip.read(CHUNK_BYTES)
+    post = uploader.session.post
+    def post_then_land_late_chunk(*args, **kwargs):
+        # An earlier attempt's first chunk reaches the server after this attempt asked for the offset
+        response = post(*args, **kwargs)
+        media_store.append_chunk(sha256, 0, io.BytesIO(first_chunk), CLIP_BYTES)
+        return response
+    uploader.session.post = post_then_land_late_chunk
+    patches = record_patches(uploader)
+
+    assert uploader.upload_media_file(clip_path, sha256, 'video/h264') == f"/api/media/{sha256}"
+    assert patches[0] == 409
+    assert patches[1:] == [200] * (len(patches) - 2) + [201]
+    assert len(patches) == 1 + 5 # The 409, then chunks 2..6 from the server's offset
+    assert stored_copy_sha256(server, media_store, sha256) == sha256
+
+
+def test_digest_mismatch_is_a_permanent_rejection(server, media_store, uploader, clip_path):
+    declared = file_sha256(clip_path)[::-1] # A well-formed SHA-256 the content does not hash to
+    patches = record_patches(uploader)
+    assert uploader.upload_media_file(clip_path, declared, 'video/h264') is MEDIA_REJECTED
+    assert patches[-1] == 422
+    assert media_store.partial_size(declared) == 0 # Discarded; a retry starts from offset 0
+    with server.app.app_context():
+        assert server.MediaFile.query.filter_by(sha256=declared).one().status != 'complete'
+
+
+def test_running_hashes_are_bounded_and_rebuilt_when_evicted(tmp_path):
+    from APIServer_Backend.services.media_store import MediaStore
+    store = MediaStore(str(tmp_path / 'media'), max_cached_hashers=2)
+    uploads = [os.urandom(2 * CHUNK_BYTES) for _ in range(3)]
+    sha256s = [hashlib.sha256(content).hexdigest() for content in uploads]
+    for sha256, content in zip(sha256s, uploads): # Three uploads left half done
+        store.append_chunk(sha256, 0, io.BytesIO(content[:CHUNK_BYTES]), len(content))
+    assert list(store._hashers) == sha256s[1:]
+
+    store.append_chunk(sha256s[0], CHUNK_BYTES, io.BytesIO(uploads[0][CHUNK_BYTES:]), len(uploads[0])) # Evicted one resumes
+    assert list(store._hashers) == sha256s[2:] + sha256s[:1] # Now the least recent one makes room
+    assert store.finalize(sha256s[0]) == store.relative_path(sha256s[0]) # Its hash was rebuilt from the partial file
+    assert list(store._hashers) == sha256s[2:]
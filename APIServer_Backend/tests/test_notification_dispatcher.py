@@ -0,0 +1,129 @@
+# APIServer_Backend/tests/test_notification_dispatcher.py
+"""
+NotificationDispatcher delivering through its real channels to an in-process SMTP sink and a
+local HTTP webhook receiver. No database.
+"""
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from APIServer_Backend.services.notification_dispatcher import (NotificationDispatcher, SmtpChannel, SmtpSink, WebhookChannel,
+                                                                parse_recipients)
+
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.posts.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def smtp_sink():
+    sink = SmtpSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    yield sink
+    sink.shutdown()
+    sink.server_close()
+
+
+@pytest.fixture
+def webhook_receiver():
+    receiver = ThreadingHTTPServer(('127.0.0.1', 0), WebhookReceiver)
+    receiver.posts = []
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    yield receiver
+    receiver.shutdown()
+    receiver.server_close()
+
+
+@pytest.fixture
+def make_dispatcher(smtp_sink, webhook_receiver):
+    dispatchers = []
+    def make(smtp_rate_per_minute=600, digest_window_seconds=0.5, max_alerts_listed=50):
+        recipients = parse_recipients([
+            ('ops', "smtp:ops@farm.example, low"), ('manager', "smtp:manager@farm.example, high"),
+            ('dispatch', f"webhook:http://127.0.0.1:{webhook_receiver.server_address[1]}/hook, medium")])
+        channels = {'smtp': SmtpChannel('127.0.0.1', smtp_sink.server_address[1], rate_per_minute=smtp_rate_per_minute),
+                    'webhook': WebhookChannel(rate_per_minute=600)}
+        dispatcher = NotificationDispatcher(channels, recipients, digest_window_seconds=digest_window_seconds,
+                                            max_alerts_listed=max_alerts_listed, tick_seconds=0.05)
+        dispatchers.append(dispatcher)
+        return dispatcher
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher._stop.set()
+        dispatcher._pool.shutdown(wait=True)
+        for channel in dispatcher.channels.values():
+            channel.close()
+
+
+def alerts(first_id, count, severity):
+    return [{'id': alert_id, 'severity': severity, 'message': f"Unknown tag T{alert_id:05d} seen by GATE_1",
+             'first_seen_at': datetime.utcnow()} for alert_id in range(first_id, first_id + count)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_alerts_in_one_window_become_one_message_per_recipient(make_dispatcher, smtp_sink, webhook_receiver):
+    dispatcher = make_dispatcher()
+    dispatcher.start()
+    for first_id in range(1, 41, 10): # The alert engine hands alerts over in batches
+        dispatcher.enqueue_alerts(alerts(first_id, 5, 'low') + alerts(first_id + 5, 5, 'high'))
+    assert wait_for(lambda: dispatcher.stats()['digests_sent'] == 3)
+    assert smtp_sink.subjects_to('ops@farm.example') == ["[FarmGuard HIGH] 40 alerts"]
+    assert smtp_sink.subjects_to('manager@farm.example') == ["[FarmGuard HIGH] 20 alerts"]
+    assert [(post['alert_count'], len(post['alerts'])) for post in webhook_receiver.posts] == [(20, 20)]
+
+    # A new window opens with the next alert after a digest went out
+    dispatcher.enqueue_alerts(alerts(100, 1, 'critical'))
+    assert wait_for(lambda: dispatcher.stats()['digests_sent'] == 6)
+    assert smtp_sink.subjects_to('ops@farm.example')[1] == "[FarmGuard CRITICAL] Unknown tag T00100 seen by GATE_1"
+    assert dispatcher.stats()['alerts_delivered'] == 40 + 20 + 20 + 3
+
+
+def test_rate_limit_is_per_channel_and_held_digests_keep_absorbing(make_dispatcher, smtp_sink, webhook_receiver):
+    dispatcher = make_dispatcher(smtp_rate_per_minute=1, digest_window_seconds=0.1) # One email, then one a minute
+    dispatcher.start()
+    dispatcher.enqueue_alerts(alerts(1, 10, 'high'))
+    assert wait_for(lambda: len(smtp_sink.messages) == 1 and len(webhook_receiver.posts) == 1)
+    assert wait_for(lambda: dispatcher.stats()['rate_limited'] > 0)
+    held = dispatcher.stats()
+    assert (held['pending_digests'], held['pending_alerts']) == (1, 10) # The other email recipient waits for a token
+
+    dispatcher.enqueue_alerts(alerts(11, 10, 'high'))
+    assert wait_for(lambda: len(webhook_receiver.posts) == 2) # Webhooks have their own budget
+    time.sleep(0.3)
+    held = dispatcher.stats()
+    assert (held['pending_digests'], held['pending_alerts']) == (2, 30) # No new email; the digests grew instead
+    assert len(smtp_sink.messages) == 1
+
+
+def test_pending_alerts_are_bounded_while_held(make_dispatcher, smtp_sink, webhook_receiver):
+    dispatcher = make_dispatcher(max_alerts_listed=5) # Not started: everything stays pending
+    for first_id in range(1, 1001, 100):
+        dispatcher.enqueue_alerts(alerts(first_id, 50, 'medium') + alerts(first_id + 50, 50, 'critical'))
+    assert dispatcher.stats()['pending_alerts'] == 1000 + 500 + 1000
+    assert all(len(digest.alerts) == 5 for digest in dispatcher._digests.values())
+
+    assert dispatcher.flush(timeout=5)
+    ops_email = next(message for message in smtp_sink.messages if message['To'] == 'ops@farm.example')
+    body = ops_email.get_content()
+    assert ops_email['Subject'] == "[FarmGuard CRITICAL] 1000 alerts"
+    assert len(body.splitlines()) == 5 + 1
+    assert body.splitlines()[-1] == "... and 995 more (500 critical, 495 medium) (see /api/alerts)"
+    assert [(post['alert_count'], len(post['alerts'])) for post in webhook_receiver.posts] == [(1000, 5)]
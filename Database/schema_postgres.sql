@@ -5,6 +5,14 @@
 DROP TABLE IF EXISTS guardian_events CASCADE;
 DROP TABLE IF EXISTS subunit_events CASCADE;
 DROP TABLE IF EXISTS assets CASCADE;
+DROP TABLE IF EXISTS media_files CASCADE;
+DROP TABLE IF EXISTS media_requests CASCADE;
+DROP TABLE IF EXISTS alerts CASCADE;
+DROP TABLE IF EXISTS alert_rules CASCADE;
+DROP TABLE IF EXISTS fsma_traceability_log CASCADE;
+DROP TABLE IF EXISTS asset_presence CASCADE;
+DROP TABLE IF EXISTS event_rollups_hourly CASCADE;
+DROP TABLE IF EXISTS event_rollup_state CASCADE;
 -- Add other tables to drop if they exist
 
 CREATE TABLE assets (
@@ -13,49 +21,194 @@ CREATE TABLE assets (
     description TEXT,
     rfid_tag_assigned VARCHAR(100) UNIQUE, -- EPC of the tag
     asset_type VARCHAR(100),
+    serial_number VARCHAR(100) UNIQUE,
     purchase_date DATE,
     current_status VARCHAR(50), -- e.g., 'in_field', 'in_storage', 'maintenance'
+    is_active BOOLEAN NOT NULL DEFAULT TRUE, -- Soft delete flag
+    deleted_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Both event tables are partitioned by month on their receive time (one partition per UTC calendar
+-- month, named <table>_pYYYYMM). The primary key has to include the partition key. There is no
+-- DEFAULT partition: the API server creates upcoming months ahead of time ([Partitioning] in
+-- config_server.ini); the DO block at the end creates the first few for a fresh database.
 CREATE TABLE guardian_events (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     unit_id VARCHAR(50) NOT NULL, -- ID of the RPi Guardian Unit
-    timestamp_iso VARCHAR(50) NOT NULL, -- ISO format timestamp string from Guardian
+    timestamp_iso VARCHAR(50) NOT NULL, -- ISO format timestamp string from Guardian, as sent (also in raw_event_payload)
+    event_time TIMESTAMP WITH TIME ZONE, -- timestamp_iso parsed at ingest; NULL only if it could not be parsed
     tag_id VARCHAR(100) NOT NULL,
     asset_id INTEGER REFERENCES assets(id) ON DELETE SET NULL, -- Link to an Asset
     video_url_remote VARCHAR(512),
+    thumbnail_url VARCHAR(512), -- JPEG keyframe, uploaded ahead of the video
+    proxy_url VARCHAR(512), -- Low-bitrate preview clip, uploaded ahead of the original
     direction VARCHAR(20), -- 'ingress', 'egress', 'unknown'
     raw_event_payload JSONB, -- Store the full JSON received from guardian unit
-    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP -- When API server received it
-);
+    received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- When API server received it; partition key
+    PRIMARY KEY (id, received_at)
+) PARTITION BY RANGE (received_at);
 
 CREATE TABLE subunit_events (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     unit_id VARCHAR(50) NOT NULL, -- ID of the LoRaWAN SubUnit
     tag_id VARCHAR(100),
     asset_id INTEGER REFERENCES assets(id) ON DELETE SET NULL,
     location_description VARCHAR(255), -- e.g., "Field_3_North_Entrance"
-    battery_level REAL,
-    rssi INTEGER,
+    battery_level_mv INTEGER, -- From the SubUnit binary payload
+    rssi INTEGER, -- Best gateway RSSI for the uplink
     snr REAL,
-    raw_lorawan_payload TEXT,
-    reported_at TIMESTAMP WITH TIME ZONE NOT NULL, -- Timestamp from LoRaWAN metadata or payload
-    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    raw_lorawan_payload TEXT, -- Base64 frm_payload as received from the network server
+    reported_at_device TIMESTAMP WITH TIME ZONE, -- Timestamp from LoRaWAN metadata or payload
+    received_at_server TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Partition key
+    PRIMARY KEY (id, received_at_server)
+) PARTITION BY RANGE (received_at_server);
+
+CREATE TABLE media_files (
+    id SERIAL PRIMARY KEY,
+    sha256 VARCHAR(64) UNIQUE NOT NULL, -- Content address; uploads of identical bytes are stored once
+    size_bytes BIGINT NOT NULL,
+    content_type VARCHAR(100),
+    original_filename VARCHAR(255),
+    unit_id VARCHAR(50), -- First Guardian unit that uploaded it
+    status VARCHAR(20) NOT NULL DEFAULT 'uploading', -- 'uploading' or 'complete'
+    storage_path VARCHAR(512), -- Relative to [Media] storage_path on the API server
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE media_requests (
+    sha256 VARCHAR(64) PRIMARY KEY, -- Original a user asked for; deleted once uploaded
+    unit_id VARCHAR(50) NOT NULL, -- Guardian unit holding the original
+    requested_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_media_requests_unit_id ON media_requests(unit_id);
+
+CREATE TABLE alert_rules (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(150) NOT NULL,
+    rule_type VARCHAR(50) NOT NULL, -- 'unknown_tag', 'inactive_asset', 'after_hours_exit', 'unit_silent'
+    unit_id VARCHAR(50), -- NULL = every unit
+    asset_id INTEGER REFERENCES assets(id) ON DELETE CASCADE, -- NULL = every asset
+    severity VARCHAR(20) NOT NULL DEFAULT 'medium',
+    allowed_from TIME, -- after_hours_exit: exits allowed from..until (wraps past midnight if from > until)
+    allowed_until TIME,
+    silent_minutes INTEGER, -- unit_silent threshold
+    suppress_minutes INTEGER NOT NULL DEFAULT 60, -- Repeats within this window fold into one alert
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE alerts (
+    id SERIAL PRIMARY KEY,
+    rule_id INTEGER REFERENCES alert_rules(id) ON DELETE SET NULL, -- NULL for built-in default rules
+    alert_type VARCHAR(50) NOT NULL,
+    severity VARCHAR(20) NOT NULL,
+    unit_id VARCHAR(50),
+    tag_id VARCHAR(100),
+    asset_id INTEGER REFERENCES assets(id) ON DELETE SET NULL,
+    event_source VARCHAR(20), -- 'guardian' or 'subunit'
+    event_id INTEGER, -- Triggering event; not a foreign key so events can be archived independently
+    message TEXT NOT NULL,
+    occurrence_count INTEGER NOT NULL DEFAULT 1, -- Repeats folded in by the suppression window
+    first_seen_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_seen_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR(20) NOT NULL DEFAULT 'open', -- 'open' or 'acknowledged'
+    acknowledged_by INTEGER, -- users.id (users is not in this placeholder schema yet, see TODO below)
+    acknowledged_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX idx_alerts_status_id ON alerts(status, id);
+CREATE INDEX idx_alerts_unit_id_id ON alerts(unit_id, id);
+CREATE INDEX idx_alerts_tag_id_id ON alerts(tag_id, id);
+
+-- FSMA 204 Key Data Elements, one row per Critical Tracking Event, written at ingest alongside the raw event
+CREATE TABLE fsma_traceability_log (
+    id SERIAL PRIMARY KEY,
+    traceability_lot_code VARCHAR(100) NOT NULL, -- From the event payload, else the tag EPC
+    product_description VARCHAR(150), -- Asset name when the event was recorded
+    cte_type VARCHAR(30) NOT NULL, -- 'shipping' (egress), 'receiving' (ingress), 'observation'
+    event_time TIMESTAMP WITH TIME ZONE NOT NULL, -- Device time of the read
+    location_id VARCHAR(50) NOT NULL, -- unit_id of the reader
+    location_description VARCHAR(255), -- From [FSMA_Locations] in config_server.ini
+    tag_id VARCHAR(100) NOT NULL,
+    asset_id INTEGER REFERENCES assets(id) ON DELETE SET NULL,
+    event_source VARCHAR(20) NOT NULL, -- 'guardian' or 'subunit'
+    event_id INTEGER NOT NULL, -- Row in event_source's table; not a foreign key so raw events can be archived
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- Traceability reports are one range scan on whichever key they are requested by
+CREATE INDEX idx_fsma_lot_event_time_id ON fsma_traceability_log(traceability_lot_code, event_time, id);
+CREATE INDEX idx_fsma_tag_event_time_id ON fsma_traceability_log(tag_id, event_time, id);
+CREATE INDEX idx_fsma_asset_event_time_id ON fsma_traceability_log(asset_id, event_time, id);
+CREATE INDEX idx_fsma_source_event_id ON fsma_traceability_log(event_source, event_id);
+
+-- Where each asset was last seen, one row per asset, upserted at ingest (INSERT ... ON CONFLICT)
+CREATE TABLE asset_presence (
+    asset_id INTEGER PRIMARY KEY REFERENCES assets(id) ON DELETE CASCADE,
+    tag_id VARCHAR(100) NOT NULL, -- Tag of the last sighting
+    last_source VARCHAR(20) NOT NULL, -- 'guardian' or 'subunit'
+    last_event_id INTEGER NOT NULL, -- Row in last_source's event table
+    last_unit_id VARCHAR(50) NOT NULL,
+    last_seen_at TIMESTAMP WITH TIME ZONE NOT NULL, -- Device time of the last sighting
+    last_received_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_rssi INTEGER, -- SubUnit reads only
+    last_location_description VARCHAR(255),
+    last_direction VARCHAR(20), -- Last gate crossing: 'ingress' or 'egress'
+    last_crossed_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX idx_asset_presence_direction_asset_id ON asset_presence(last_direction, asset_id);
+CREATE INDEX idx_asset_presence_unit_asset_id ON asset_presence(last_unit_id, asset_id);
+CREATE INDEX idx_asset_presence_received_at ON asset_presence(last_received_at); -- ETag watermark
+
+-- Events per UTC hour of receipt for /api/stats, maintained by the API server (services/event_rollups.py).
+-- '' stands for no asset type / no direction.
+CREATE TABLE event_rollups_hourly (
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    source VARCHAR(20) NOT NULL, -- 'guardian' or 'subunit'
+    unit_id VARCHAR(50) NOT NULL,
+    asset_type VARCHAR(100) NOT NULL,
+    direction VARCHAR(20) NOT NULL,
+    event_count BIGINT NOT NULL,
+    PRIMARY KEY (bucket_start, source, unit_id, asset_type, direction)
+);
+-- Per source, everything received before rolled_up_until is in event_rollups_hourly
+CREATE TABLE event_rollup_state (
+    source VARCHAR(20) PRIMARY KEY,
+    rolled_up_until TIMESTAMP WITH TIME ZONE NOT NULL
 );
 
 -- TODO: Add more tables:
 -- - users (for web app authentication)
 -- - geofences
--- - fsma_traceability_log (for specific KDEs)
--- - alerts
 
--- Indexes for performance
-CREATE INDEX idx_guardian_events_tag_id ON guardian_events(tag_id);
-CREATE INDEX idx_guardian_events_timestamp_iso ON guardian_events(timestamp_iso);
+-- Indexes for performance (indexes on the partitioned event tables are created on every partition)
+-- Device-time range queries (?event_since/?event_until) on the parsed timestamp, not the string
+CREATE INDEX idx_guardian_events_event_time_id ON guardian_events(event_time, id);
+-- Keyset pagination for /api/events: newest first on (received_at, id), optionally with one equality filter.
+-- The tag_id/asset_id composites also serve plain lookups on those columns.
+CREATE INDEX idx_guardian_events_received_at_id ON guardian_events(received_at, id);
+CREATE INDEX idx_guardian_events_unit_received_at_id ON guardian_events(unit_id, received_at, id);
+CREATE INDEX idx_guardian_events_tag_received_at_id ON guardian_events(tag_id, received_at, id);
+CREATE INDEX idx_guardian_events_asset_received_at_id ON guardian_events(asset_id, received_at, id);
+CREATE INDEX idx_guardian_events_direction_received_at_id ON guardian_events(direction, received_at, id);
 CREATE INDEX idx_subunit_events_tag_id ON subunit_events(tag_id);
+CREATE INDEX idx_subunit_events_asset_id ON subunit_events(asset_id);
+CREATE INDEX idx_subunit_events_received_at_server ON subunit_events(received_at_server);
+CREATE INDEX idx_subunit_events_unit_received_at ON subunit_events(unit_id, received_at_server); -- Latest event per unit (unit_silent)
 CREATE INDEX idx_assets_rfid_tag ON assets(rfid_tag_assigned);
+-- Keyset pagination for /api/assets (ordered by asset_name, id) with its filters
+-- max(updated_at) is the ETag watermark for asset and event reads
+CREATE INDEX idx_assets_updated_at ON assets(updated_at);
+CREATE INDEX idx_assets_active_name_id ON assets(is_active, asset_name, id);
+CREATE INDEX idx_assets_type_name_id ON assets(asset_type, asset_name, id);
+CREATE INDEX idx_assets_status_name_id ON assets(current_status, asset_name, id);
+-- Substring search (?search=) on name, tag and serial number
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_assets_name_trgm ON assets USING gin (asset_name gin_trgm_ops);
+CREATE INDEX idx_assets_rfid_tag_trgm ON assets USING gin (rfid_tag_assigned gin_trgm_ops);
+CREATE INDEX idx_assets_serial_trgm ON assets USING gin (serial_number gin_trgm_ops);
 
 -- Basic function to update 'updated_at' columns (optional)
 CREATE OR REPLACE FUNCTION trigger_set_timestamp()
@@ -71,4 +224,42 @@ BEFORE UPDATE ON assets
 FOR EACH ROW
 EXECUTE FUNCTION trigger_set_timestamp();
 
+-- Device timestamps as the API parses them: ISO 8601, UTC when there is no offset; NULL when unparseable
+CREATE OR REPLACE FUNCTION parse_device_time(value TEXT)
+RETURNS TIMESTAMP WITH TIME ZONE AS $$
+BEGIN
+  RETURN value::TIMESTAMP WITH TIME ZONE;
+EXCEPTION WHEN others THEN
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE SET timezone TO 'UTC';
+
+-- The API server sets event_time itself; this fills it for rows inserted any other way
+CREATE OR REPLACE FUNCTION trigger_set_event_time()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.event_time = parse_device_time(NEW.timestamp_iso);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER set_guardian_events_event_time
+BEFORE INSERT ON guardian_events
+FOR EACH ROW WHEN (NEW.event_time IS NULL)
+EXECUTE FUNCTION trigger_set_event_time();
+
+-- Event partitions for the current month and the next three (the API server keeps creating them)
+DO $$
+DECLARE
+    month_start TIMESTAMP; -- UTC wall time, converted explicitly so the session time zone doesn't matter
+BEGIN
+    FOR offset_months IN 0..3 LOOP
+        month_start := date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => offset_months);
+        EXECUTE format('CREATE TABLE IF NOT EXISTS guardian_events_p%s PARTITION OF guardian_events FOR VALUES FROM (%L) TO (%L)',
+                       to_char(month_start, 'YYYYMM'), month_start AT TIME ZONE 'UTC', (month_start + interval '1 month') AT TIME ZONE 'UTC');
+        EXECUTE format('CREATE TABLE IF NOT EXISTS subunit_events_p%s PARTITION OF subunit_events FOR VALUES FROM (%L) TO (%L)',
+                       to_char(month_start, 'YYYYMM'), month_start AT TIME ZONE 'UTC', (month_start + interval '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END $$;
+
 -- You might add more triggers or initial data seeding here.
\ No newline at end of file
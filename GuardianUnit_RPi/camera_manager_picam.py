@@ -5,97 +5,124 @@ import configparser
 from datetime import datetime
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
-from picamera2.outputs import FfmpegOutput
+from picamera2.outputs import Output
 import libcamera # For controls
 
+from video_ring_buffer import FrameSource, PreTriggerRecorder
+
+
+class _FrameCallbackOutput(Output):
+    """picamera2 Output that hands every encoded frame to a callback instead of a file."""
+    def __init__(self, on_frame):
+        super().__init__()
+        self.on_frame = on_frame
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        # The encoder reuses its buffer, so copy the frame before it goes into the ring buffer
+        self.on_frame(bytes(frame), keyframe, timestamp)
+
+
+class Picamera2FrameSource(FrameSource):
+    """
+    Configures the camera and H.264 encoder once and keeps them running, pushing encoded
+    frames to on_frame. Keyframes repeat SPS/PPS headers so a clip can start at any keyframe.
+    """
+    def __init__(self, picam2, size=(1920, 1080), framerate=30, bitrate=8000000, keyframe_interval=None):
+        self.picam2 = picam2
+        self.size = size
+        self.framerate = framerate
+        self.bitrate = bitrate
+        self.keyframe_interval = keyframe_interval or framerate # One GOP per second by default
+        self.encoder = None
+
+    def start(self, on_frame):
+        video_config = self.picam2.create_video_configuration(main={"size": self.size},
+                                                              controls={"FrameRate": self.framerate})
+        # Apply autofocus settings
+        video_config["controls"]["AfMode"] = libcamera.controls.AfModeEnum.Continuous # Continuous AutoFocus
+        video_config["controls"]["AfSpeed"] = libcamera.controls.AfSpeedEnum.Fast
+        # video_config["controls"]["AfRange"] = libcamera.controls.AfRangeEnum.Full # Or Normal, Macro
+        self.picam2.configure(video_config)
+        self.encoder = H264Encoder(bitrate=self.bitrate, repeat=True, iperiod=self.keyframe_interval)
+        self.picam2.start_recording(self.encoder, _FrameCallbackOutput(on_frame))
+
+    def stop(self):
+        if self.encoder is not None:
+            self.picam2.stop_recording()
+            self.encoder = None
+
+
 class CameraManager:
+    """
+    Records a clip per trigger from an always-running encoder: each clip holds
+    pre_trigger_seconds of video from before the tag was read plus capture_duration seconds
+    after it, with no camera reconfiguration or encoder start-up on the trigger path.
+    """
     def __init__(self, config_path='config_guardian.ini'):
         self.config = configparser.ConfigParser()
         self.config.read(config_path)
         self.media_path = self.config.get('General', 'media_save_path', fallback='./media_captures/')
         self.capture_duration = self.config.getint('Camera', 'capture_duration_seconds', fallback=10)
+        self.pre_trigger_seconds = self.config.getfloat('Camera', 'pre_trigger_seconds', fallback=3)
+        width = self.config.getint('Camera', 'width', fallback=1920)
+        height = self.config.getint('Camera', 'height', fallback=1080)
+        framerate = self.config.getint('Camera', 'framerate', fallback=30)
+        bitrate = self.config.getint('Camera', 'bitrate', fallback=8000000) # 8 Mbps, adjust as needed for quality/file size
         
         if not os.path.exists(self.media_path):
             os.makedirs(self.media_path)
         
         self.picam2 = None
+        self.frame_source = None
+        self.recorder = PreTriggerRecorder(pre_seconds=self.pre_trigger_seconds)
         try:
             self.picam2 = Picamera2()
-            print("PiCamera2 Initialized.")
+            self.frame_source = Picamera2FrameSource(self.picam2, size=(width, height), framerate=framerate, bitrate=bitrate)
+            self.frame_source.start(self.recorder.on_frame)
+            print(f"PiCamera2 Initialized. Encoder running with a {self.pre_trigger_seconds}s pre-trigger buffer.")
         except Exception as e:
             print(f"Error initializing PiCamera2: {e}. Camera functionality will be disabled.")
+            if self.picam2:
+                try: self.picam2.close()
+                except Exception: pass
             self.picam2 = None # Ensure it's None if initialization failed
+            self.frame_source = None
 
     def capture_video_for_tag(self, tag_id):
+        """
+        Saves the pre-trigger buffer plus capture_duration seconds of live video for tag_id.
+        Blocks until the clip is written (call it from the capture worker, not the RFID loop).
+        Returns the .h264 file path, or None on failure.
+        """
         if not self.picam2:
             print("Camera not available or failed to initialize.")
             return None
 
         try:
-            # Configure for video recording
-            # You can adjust resolution, framerate here if needed.
-            # main_stream_size = {"size": (1280, 720)} # Example 720p
-            main_stream_size = {"size": (1920, 1080)} # Example 1080p
-            video_config = self.picam2.create_video_configuration(main=main_stream_size)
-            # Apply autofocus settings
-            video_config["controls"]["AfMode"] = libcamera.controls.AfModeEnum.Continuous # Continuous AutoFocus
-            video_config["controls"]["AfSpeed"] = libcamera.controls.AfSpeedEnum.Fast 
-            # video_config["controls"]["AfRange"] = libcamera.controls.AfRangeEnum.Full # Or Normal, Macro
-            
-            self.picam2.configure(video_config)
-            
-            encoder = H264Encoder(bitrate=8000000) # 8 Mbps, adjust as needed for quality/file size
             timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_tag_id = "".join(c if c.isalnum() else "_" for c in tag_id) # Sanitize tag_id
-            
-            # FfmpegOutput will handle the .mp4 extension
-            filename_base = os.path.join(self.media_path, f"{safe_tag_id}_{timestamp_str}")
-            output_filename = f"{filename_base}.mp4"
-            output = FfmpegOutput(output_filename)
-
-            self.picam2.start_encoder(encoder) # Start encoder separately
-            self.picam2.start_recording(encoder, output) # Start recording
-            print(f"Recording video to {output_filename} for {self.capture_duration} seconds...")
-            
-            # Wait for the capture duration
-            # picamera2 records in a separate thread, so time.sleep() is fine.
-            time.sleep(self.capture_duration)
-            
-            self.picam2.stop_recording()
-            self.picam2.stop_encoder() # Stop encoder after recording
-            
+            output_filename = os.path.join(self.media_path, f"{safe_tag_id}_{timestamp_str}.h264")
+            print(f"Recording video to {output_filename}: {self.recorder.buffered_seconds():.1f}s buffered + {self.capture_duration}s live...")
+            if not self.recorder.record_clip(output_filename, self.capture_duration):
+                print("No frames received from the encoder; clip not saved.")
+                return None
             print(f"Video saved: {output_filename}")
             return output_filename
         except Exception as e:
             print(f"Error during video capture: {e}")
-            # Attempt to stop recording/encoder if an error occurs mid-way
-            try:
-                if self.picam2.started: # Check if picam2 object has 'started' attribute or similar check
-                    if self.picam2.encoder and self.picam2.encoder.recording: # Check encoder state
-                         self.picam2.stop_recording()
-                    if self.picam2.encoder:
-                        self.picam2.stop_encoder()
-            except Exception as e_stop:
-                print(f"Error trying to stop camera after capture error: {e_stop}")
             return None
-        # finally:
-            # It's generally better to keep the Picamera2 object alive if you plan to record again soon.
-            # Closing and re-initializing it for every capture can be slow.
-            # self.close_camera() # Only call this when the application is shutting down.
 
     def close_camera(self):
         if self.picam2:
             print("Closing PiCamera2.")
             try:
-                # Ensure recording is stopped if it was somehow left running
-                if self.picam2.started and self.picam2.encoder and self.picam2.encoder.recording:
-                    self.picam2.stop_recording()
-                if self.picam2.started and self.picam2.encoder:
-                    self.picam2.stop_encoder()
+                if self.frame_source:
+                    self.frame_source.stop()
                 self.picam2.close()
             except Exception as e:
                 print(f"Error closing camera: {e}")
             self.picam2 = None
+            self.frame_source = None
 
 
 # Standalone test
@@ -113,6 +140,7 @@ if __name__ == '__main__':
         cam_manager = CameraManager(config_path=config_file_path)
         if cam_manager.picam2: # Check if camera initialized successfully
             test_tag = "TEST_CAM_001"
+            time.sleep(cam_manager.pre_trigger_seconds) # Let the pre-trigger buffer fill
             print(f"Testing camera capture for tag: {test_tag}")
             video_file = cam_manager.capture_video_for_tag(test_tag)
             if video_file:
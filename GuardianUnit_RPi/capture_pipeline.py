@@ -0,0 +1,199 @@
+# GuardianUnit_RPi/capture_pipeline.py
+"""
+Runs video capture on a dedicated worker thread so the RFID read loop never waits for the camera.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class Clip:
+    """
+    One recording and every tag pass detected while it was being recorded. A pass is
+    (tag_id, detected_at), as reported by TagAggregator: a tag that leaves and comes back before
+    the clip ends is two passes, each with its own event (and direction) sharing the clip.
+    """
+    def __init__(self, primary_tag_id, detected_at):
+        self.primary_tag_id = primary_tag_id
+        self.tags = [(primary_tag_id, detected_at)] # (tag_id, detected_at) in detection order
+        self._passes = {(primary_tag_id, detected_at)}
+        self.video_filename = None
+
+    def attach(self, tag_id, detected_at):
+        """Adds a pass seen during this clip. Returns False if that same pass is already part of the clip."""
+        if (tag_id, detected_at) in self._passes:
+            return False
+        self._passes.add((tag_id, detected_at))
+        self.tags.append((tag_id, detected_at))
+        return True
+
+
+class CaptureWorker(threading.Thread):
+    """
+    Consumes tag detections from a job queue and records clips with a CameraManager.
+    A detection that arrives while a clip is recording is attached to that clip instead of
+    queueing another recording, so a truck carrying many tagged bins produces one clip that
+    all of their events reference. When the clip finishes (or immediately, without a camera)
+    on_clip_done(clip, status) is called on this thread for the caller to log/upload events.
+    status is 'ok', 'NO_VIDEO_CAM_INIT_FAIL' or 'NO_VIDEO_CAPTURE_FAIL'.
+    """
+    def __init__(self, camera, on_clip_done):
+        super().__init__(name='capture-worker', daemon=True)
+        self.camera = camera
+        self.on_clip_done = on_clip_done
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._current_clip = None
+        self.clips_recorded = 0
+        self.tags_attached = 0
+
+    def submit(self, tag_id, detected_at=None):
+        """Called from the RFID loop; returns immediately."""
+        detected_at = detected_at or datetime.now()
+        with self._lock:
+            if self._current_clip is not None:
+                if self._current_clip.attach(tag_id, detected_at):
+                    self.tags_attached += 1
+                return
+        self._jobs.put((tag_id, detected_at))
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            tag_id, detected_at = job
+            clip = Clip(tag_id, detected_at)
+            camera_available = bool(self.camera and self.camera.picam2)
+            if camera_available:
+                with self._lock:
+                    self._current_clip = clip
+                    # Detections queued while the previous clip was closing belong to this one
+                    self._drain_queued_into(clip)
+                try:
+                    clip.video_filename = self.camera.capture_video_for_tag(tag_id)
+                finally:
+                    with self._lock:
+                        self._current_clip = None
+                self.clips_recorded += 1
+                status = 'ok' if clip.video_filename else 'NO_VIDEO_CAPTURE_FAIL'
+            else:
+                status = 'NO_VIDEO_CAM_INIT_FAIL'
+            try:
+                self.on_clip_done(clip, status)
+            except Exception as e:
+                print(f"CaptureWorker: error handling finished clip for {tag_id}: {e}")
+
+    def _drain_queued_into(self, clip):
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is None: # Keep the stop marker for run()
+                self._jobs.put(None)
+                return
+            if clip.attach(*job):
+                self.tags_attached += 1
+
+    def stop(self, timeout=None):
+        """Finishes the clip in progress and any queued detections, then exits."""
+        self._jobs.put(None)
+        self.join(timeout)
+
+
+# Standalone test: simulated reader + camera through the main loop's read path (read_tags() ->
+# TagAggregator -> CaptureWorker.submit), over a burst that arrives while a clip records and a
+# second one that arrives as that clip closes. Every tag in range must end up in exactly one clip.
+if __name__ == '__main__':
+    import random
+
+    from tag_aggregator import TagAggregator
+
+    TIME_SCALE = 0.1 # Run the simulation 10x faster than real time
+    CAPTURE_SECONDS = 10
+    READ_TIMEOUT_SECONDS = 0.3
+    TAG_VISIBLE_SECONDS = 1.0 # How long a tag on a passing vehicle stays in antenna range
+    BURSTS = [(50, 0.0, 5.0), (20, CAPTURE_SECONDS - 1.0, 2.0)] # (tags, first arrival, spread) in simulated seconds
+
+    class SimulatedReader:
+        """Each inventory round blocks for the read timeout and reports every tag in range, like RFIDReader.read_tags()."""
+        def __init__(self, schedule, start):
+            self.schedule = schedule # [(epc, appears_at, disappears_at)] in simulated seconds
+            self.start = start
+        def read_tags(self):
+            time.sleep(READ_TIMEOUT_SECONDS * TIME_SCALE)
+            now = (time.monotonic() - self.start) / TIME_SCALE
+            return [(epc, -50, 1, 1) for epc, appears, disappears in self.schedule if appears <= now < disappears]
+        def read_tag(self):
+            """The old loop's single-tag read: the strongest tag of one round (random among equals)."""
+            reads = self.read_tags()
+            return random.choice(reads)[0].hex() if reads else None
+
+    class SimulatedCamera:
+        picam2 = True
+        def capture_video_for_tag(self, tag_id):
+            time.sleep(CAPTURE_SECONDS * TIME_SCALE)
+            return f"/tmp/{tag_id}.mp4"
+
+    schedule = [(bytes.fromhex(f"e2{burst:02x}{i:04x}"), first + i * spread / count, first + i * spread / count + TAG_VISIBLE_SECONDS)
+                for burst, (count, first, spread) in enumerate(BURSTS) for i in range(count)]
+    in_range = {epc.hex() for epc, _, _ in schedule}
+    run_seconds = max(disappears for _, _, disappears in schedule)
+
+    def run_inline():
+        """The previous main loop: one tag per read, capture inline, then sleep 1 s."""
+        reader, camera = SimulatedReader(schedule, time.monotonic()), SimulatedCamera()
+        recorded = set()
+        while time.monotonic() < reader.start + run_seconds * TIME_SCALE:
+            tag_id = reader.read_tag()
+            if tag_id:
+                camera.capture_video_for_tag(tag_id)
+                recorded.add(tag_id)
+                time.sleep(1 * TIME_SCALE)
+        return recorded, None
+
+    def run_pipelined():
+        """The current main loop: inventory rounds deduplicated into passes, capture on the worker."""
+        reader = SimulatedReader(schedule, time.monotonic())
+        aggregator = TagAggregator(window_seconds=5.0)
+        clips = []
+        worker = CaptureWorker(SimulatedCamera(), lambda clip, status: clips.append(clip))
+        worker.start()
+        detected = []
+        while time.monotonic() < reader.start + run_seconds * TIME_SCALE:
+            for epc in aggregator.observe_reads(reader.read_tags()):
+                detected.append(epc.hex())
+                worker.submit(epc.hex())
+        worker.stop()
+        return detected, clips
+
+    recorded, _ = run_inline()
+    print(f"{'inline capture (old loop)':<26} {len(recorded):>2}/{len(in_range)} tags recorded, "
+          f"missed-tag rate {1 - len(recorded) / len(in_range):.0%}")
+    detected, clips = run_pipelined()
+    clip_events = [tag_id for clip in clips for tag_id, _ in clip.tags]
+    print(f"{'capture worker':<26} {len(set(clip_events)):>2}/{len(in_range)} tags recorded, "
+          f"missed-tag rate {1 - len(set(clip_events) & in_range) / len(in_range):.0%}, "
+          f"{len(clips)} clip(s) covering {len(clip_events)} tag events")
+    checks = [("the read loop detected every tag in range", set(detected) == in_range),
+              ("one pass per tag (no duplicate detections)", len(detected) == len(set(detected))),
+              ("every detection is in exactly one clip", sorted(clip_events) == sorted(detected)),
+              ("tags still arriving after a clip closes start the next one", len(clips) == 2)]
+
+    # A tag that leaves and comes back while one clip records: two passes, two events, one clip
+    clips = []
+    worker = CaptureWorker(SimulatedCamera(), lambda clip, status: clips.append(clip))
+    worker.start()
+    first_pass, second_pass = datetime(2024, 5, 1, 6, 0, 0), datetime(2024, 5, 1, 6, 0, 4)
+    worker.submit('e2000001', first_pass)
+    time.sleep(0.2 * CAPTURE_SECONDS * TIME_SCALE)
+    worker.submit('e2000002', first_pass)
+    worker.submit('e2000001', second_pass)
+    worker.submit('e2000001', second_pass) # The same pass reported twice is still one event
+    worker.stop()
+    checks.append(("out-and-back within one clip keeps both passes",
+                   len(clips) == 1 and clips[0].tags == [('e2000001', first_pass), ('e2000002', first_pass), ('e2000001', second_pass)]))
+    for description, passed in checks:
+        print(f"{'OK  ' if passed else 'FAIL'} {description}")
@@ -3,9 +3,80 @@
 Handles uploading event data and media files to the central server or cloud storage.
 """
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import configparser
+import hashlib
 import os
+import random
+import threading
+import time
+
+MEDIA_REJECTED = 'rejected' # upload_media_file: the server refused the file for good, retrying can't help
+RETRYABLE_CLIENT_ERRORS = (401, 403, 408, 429) # Auth/config problems, timeouts and rate limits clear up on their own
+
+
+def is_permanent_rejection(status_code):
+    return 400 <= status_code < 500 and status_code not in RETRYABLE_CLIENT_ERRORS
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    """SHA-256 of a file, read in blocks so a 10 MB clip never sits in memory at once."""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as media:
+        for block in iter(lambda: media.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class BandwidthLimiter:
+    """
+    Token bucket in bytes/second, shared by every media upload so together they stay under the
+    cap and leave the rest of the link to event batches. consume() sleeps off any deficit.
+    bytes_per_second of 0 disables the limit.
+    """
+    def __init__(self, bytes_per_second, burst_bytes=64 * 1024):
+        self.rate = bytes_per_second
+        self.burst = burst_bytes
+        self._tokens = burst_bytes
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - nbytes
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class _ThrottledChunk:
+    """
+    File-like request body for one chunk: `length` bytes from the file's current position,
+    read in the small blocks http.client asks for and paced by the limiter. Having __len__
+    makes requests send a Content-Length instead of chunked transfer encoding.
+    """
+    def __init__(self, media, length, limiter):
+        self.media = media
+        self.remaining = length
+        self.limiter = limiter
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        block = self.media.read(size)
+        self.remaining -= len(block)
+        self.limiter.consume(len(block))
+        return block
+
 
 class DataUploader:
     def __init__(self, config_path='config_guardian.ini'):
@@ -13,7 +84,14 @@ class DataUploader:
         self.config.read(config_path)
         self.api_server_url = self.config.get('General', 'api_server_url')
         self.guardian_unit_id = self.config.get('General', 'guardian_unit_id')
-        # TODO: Add cloud storage client initialization if uploading media directly
+        self.request_timeout = self.config.getfloat('Uploader', 'request_timeout_seconds', fallback=10)
+        self.media_chunk_bytes = self.config.getint('Uploader', 'media_chunk_bytes', fallback=1024 * 1024)
+        self.bandwidth_limiter = BandwidthLimiter(self.config.getint('Uploader', 'media_bandwidth_kbps', fallback=0) * 1000 // 8)
+        # One pooled keep-alive session for all uploads: avoids a TCP (and TLS) handshake per request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0) # Retries are the worker's job
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         print("Data Uploader Initialized.")
 
     def upload_event_data(self, event_data):
@@ -27,7 +105,7 @@ class DataUploader:
             "event": event_data
         }
         try:
-            response = requests.post(endpoint, json=payload, timeout=10)
+            response = self.session.post(endpoint, json=payload, timeout=self.request_timeout)
             response.raise_for_status() # Raises an HTTPError for bad responses (4XX or 5XX)
             print(f"Event data uploaded successfully: {response.status_code}")
             return True
@@ -35,20 +113,245 @@ class DataUploader:
             print(f"Error uploading event data: {e}")
             return False
 
-    def upload_media_file(self, file_path, tag_id, timestamp_str):
+    def upload_event_batch(self, events):
+        """
+        Uploads a list of event dicts in one request to the batch endpoint.
+        Returns the server's per-item results (list, same order as `events`) once the server has
+        processed the batch, or None if it should be retried (network error, 5xx, auth/config error).
+        """
+        endpoint = f"{self.api_server_url}/guardian_events/batch"
+        payload = [{"unit_id": self.guardian_unit_id, "event": event_data} for event_data in events]
+        try:
+            response = self.session.post(endpoint, json=payload, timeout=self.request_timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Error uploading event batch: {e}")
+            return None
+        # 201 all stored, 207 partially stored, 400 all items rejected: either way the batch was processed
+        if response.status_code in (201, 207, 400):
+            try:
+                results = response.json().get('results')
+            except ValueError:
+                results = None
+            if isinstance(results, list) and len(results) == len(events):
+                return results
+        print(f"Event batch upload failed: HTTP {response.status_code}")
+        return None
+
+    def close(self):
+        self.session.close()
+
+    def upload_media_file(self, file_path, sha256=None, content_type=None, should_pause=None):
         """
-        Uploads a media file.
-        Returns the public URL of the uploaded file, or None on failure.
-        This is a placeholder. Implement based on your cloud storage choice.
-        Alternatively, the API server can handle the file upload if the RPi POSTs it.
+        Uploads a media file to the API server in chunks of media_chunk_bytes, resuming from
+        whatever the server already has (from an interrupted earlier attempt, or all of it if
+        another event already uploaded the same clip). Returns the server's media URL, None if the
+        upload should be retried later (the next call picks up where this one stopped), or
+        MEDIA_REJECTED if the server refused the file itself (too large, bad digest, conflicting size).
+        should_pause() is checked between chunks; returning True stops early (also None), so a
+        long original can give way to more urgent uploads and resume afterwards.
         """
-        print(f"DataUploader: Pretending to upload {file_path}...")
-        # TODO: Implement actual file upload to S3, GCS, Azure, or via API server
-        # For now, return a mock URL based on filename
-        filename = os.path.basename(file_path)
-        mock_url = f"https://mock-storage.com/videos/{self.guardian_unit_id}/{filename}"
-        print(f"DataUploader: Mock URL for {filename} is {mock_url}")
-        return mock_url
+        endpoint = f"{self.api_server_url}/media/uploads"
+        size_bytes = os.path.getsize(file_path)
+        sha256 = sha256 or file_sha256(file_path)
+        try:
+            response = self.session.post(endpoint, timeout=self.request_timeout, json={
+                "unit_id": self.guardian_unit_id, "sha256": sha256, "size_bytes": size_bytes,
+                "filename": os.path.basename(file_path), "content_type": content_type})
+            upload = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error starting media upload for {file_path}: {e}")
+            return None
+        if not upload:
+            print(f"Media upload for {file_path} refused: HTTP {response.status_code}")
+            return MEDIA_REJECTED if is_permanent_rejection(response.status_code) else None
+        if upload['complete']:
+            print(f"DataUploader: {os.path.basename(file_path)} already on the server")
+            return upload['media_url']
+
+        offset = upload['offset']
+        with open(file_path, 'rb') as media:
+            while True:
+                media.seek(offset)
+                chunk = _ThrottledChunk(media, min(self.media_chunk_bytes, size_bytes - offset), self.bandwidth_limiter)
+                try:
+                    response = self.session.patch(f"{endpoint}/{sha256}", data=chunk, timeout=self.request_timeout, headers={
+                        'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream'})
+                    result = response.json()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"Media upload of {file_path} interrupted at byte {offset}: {e}")
+                    return None
+                if response.status_code in (200, 201) and result.get('complete'):
+                    print(f"DataUploader: uploaded {os.path.basename(file_path)} ({size_bytes} bytes)")
+                    return result['media_url']
+                if response.status_code in (200, 201, 409): # 409: our offset was stale, continue from the server's
+                    offset = result['offset']
+                    if should_pause and should_pause():
+                        return None
+                    continue
+                print(f"Media upload of {file_path} failed: HTTP {response.status_code} {result.get('message')}")
+                return MEDIA_REJECTED if is_permanent_rejection(response.status_code) else None
+
+    def fetch_media_requests(self):
+        """SHA-256s of originals that dashboard users asked this unit for (empty list on error)."""
+        try:
+            response = self.session.get(f"{self.api_server_url}/media/requests", params={"unit_id": self.guardian_unit_id},
+                                        timeout=self.request_timeout)
+            response.raise_for_status()
+            return response.json().get('sha256', [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error fetching media requests: {e}")
+            return []
+
+
+class MediaUploadWorker(threading.Thread):
+    """
+    Uploads queued media files one at a time in the background. Queues are EventOutbox instances
+    holding {"path", "sha256", "content_type"} entries, so pending uploads survive reboots.
+    media_queue (thumbnails, proxies, and originals that have no preview) is always drained first.
+    deferred_queue holds full-resolution originals: one goes out when a dashboard user requests it
+    (polled every request_poll_seconds), or, in 'idle' mode, when is_link_idle() says nothing else
+    is waiting. An original in progress pauses between chunks as soon as media_queue gets work and,
+    unless a user requested it, as soon as the link is busy again (event batches pending).
+    Failures back off exponentially like OutboxUploadWorker; files that no longer exist, and files the
+    server rejects for good, are dropped from the queue (the file itself stays on disk), so one
+    bad file can't hold up everything queued behind it.
+    """
+    def __init__(self, media_queue, uploader, config_path='config_guardian.ini', deferred_queue=None, is_link_idle=None):
+        super().__init__(name='media-upload-worker', daemon=True)
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        self.media_queue = media_queue
+        self.deferred_queue = deferred_queue
+        self.uploader = uploader
+        self.is_link_idle = is_link_idle or (lambda: True)
+        self.original_upload = config.get('Uploader', 'original_upload', fallback='idle').lower() # idle | on_demand
+        self.request_poll_seconds = config.getfloat('Uploader', 'request_poll_seconds', fallback=30)
+        self.backoff_initial = config.getfloat('Uploader', 'backoff_initial_seconds', fallback=1.0)
+        self.backoff_max = config.getfloat('Uploader', 'backoff_max_seconds', fallback=300.0)
+        self._stop_event = threading.Event()
+        self._requested = set()
+        self._next_request_poll = 0
+        self.uploaded_count = 0
+        self.rejected_count = 0
+
+    def _next_job(self):
+        batch = self.media_queue.peek_batch(1)
+        if batch:
+            return self.media_queue, batch[0]
+        if not self.deferred_queue:
+            return None
+        if time.monotonic() >= self._next_request_poll:
+            self._requested = set(self.uploader.fetch_media_requests())
+            self._next_request_poll = time.monotonic() + self.request_poll_seconds
+        if self._requested:
+            for queue_id, media in self.deferred_queue.peek_batch(1000):
+                if media.get('sha256') in self._requested:
+                    return self.deferred_queue, (queue_id, media)
+        if self.original_upload == 'idle' and self.is_link_idle():
+            batch = self.deferred_queue.peek_batch(1)
+            if batch:
+                return self.deferred_queue, batch[0]
+        return None
+
+    def run(self):
+        backoff = self.backoff_initial
+        while not self._stop_event.is_set():
+            self.media_queue.has_pending.clear()
+            job = self._next_job()
+            if job is None:
+                self.media_queue.has_pending.wait(min(5, self.request_poll_seconds))
+                continue
+            source, (queue_id, media) = job
+            if not os.path.exists(media['path']):
+                print(f"Media upload: {media['path']} no longer exists. Dropping it.")
+                source.remove([queue_id])
+                continue
+            should_pause = None
+            if source is self.deferred_queue:
+                requested = media.get('sha256') in self._requested
+                should_pause = lambda: (self.media_queue.has_pending.is_set() or self._stop_event.is_set()
+                                        or (not requested and not self.is_link_idle()))
+            result = self.uploader.upload_media_file(media['path'], media.get('sha256'), media.get('content_type'), should_pause)
+            if result == MEDIA_REJECTED:
+                self.rejected_count += 1
+                print(f"Media upload: server rejected {media['path']}. Dropping it.")
+                self._requested.discard(media.get('sha256'))
+                source.remove([queue_id])
+                continue
+            if result is None:
+                if should_pause and should_pause():
+                    continue # Paused for more urgent uploads; resumes from the server's offset later
+                source.record_attempt([queue_id])
+                delay = backoff * random.uniform(0.5, 1.0)
+                self._stop_event.wait(delay)
+                backoff = min(backoff * 2, self.backoff_max)
+                continue
+            backoff = self.backoff_initial
+            self.uploaded_count += 1
+            self._requested.discard(media.get('sha256'))
+            source.remove([queue_id])
+        self.media_queue.close() # This thread's SQLite connections
+        if self.deferred_queue:
+            self.deferred_queue.close()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self.media_queue.has_pending.set()
+        self.join(timeout)
+
+
+class OutboxUploadWorker(threading.Thread):
+    """
+    Background thread that drains an EventOutbox through DataUploader.upload_event_batch.
+    Batches up to batch_size events per request. On failure it keeps the events and retries with
+    exponential backoff (with jitter) capped at backoff_max_seconds, so a backhaul outage costs
+    the RFID loop nothing. Items the server rejects as invalid are dropped, not retried forever.
+    """
+    def __init__(self, outbox, uploader, config_path='config_guardian.ini'):
+        super().__init__(name='outbox-upload-worker', daemon=True)
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        self.outbox = outbox
+        self.uploader = uploader
+        self.batch_size = config.getint('Uploader', 'batch_size', fallback=100)
+        self.flush_interval = config.getfloat('Uploader', 'flush_interval_seconds', fallback=1.0)
+        self.backoff_initial = config.getfloat('Uploader', 'backoff_initial_seconds', fallback=1.0)
+        self.backoff_max = config.getfloat('Uploader', 'backoff_max_seconds', fallback=300.0)
+        self._stop_event = threading.Event()
+        self.uploaded_count = 0
+        self.rejected_count = 0
+
+    def run(self):
+        backoff = self.backoff_initial
+        while not self._stop_event.is_set():
+            self.outbox.has_pending.clear() # Cleared before reading, so an append during the read re-sets it
+            batch = self.outbox.peek_batch(self.batch_size)
+            if not batch:
+                self.outbox.has_pending.wait(self.flush_interval)
+                continue
+            outbox_ids = [outbox_id for outbox_id, _ in batch]
+            results = self.uploader.upload_event_batch([event_data for _, event_data in batch])
+            if results is None:
+                self.outbox.record_attempt(outbox_ids)
+                delay = backoff * random.uniform(0.5, 1.0)
+                print(f"Outbox: upload failed, {self.outbox.pending_count()} events pending. Retrying in {delay:.1f}s")
+                self._stop_event.wait(delay)
+                backoff = min(backoff * 2, self.backoff_max)
+                continue
+            backoff = self.backoff_initial
+            for (outbox_id, event_data), result in zip(batch, results):
+                if result.get('status') == 'success':
+                    self.uploaded_count += 1
+                else:
+                    self.rejected_count += 1
+                    print(f"Outbox: server rejected event {event_data.get('tag_id')}: {result.get('message')}. Dropping it.")
+            self.outbox.remove(outbox_ids)
+        self.outbox.close() # This thread's SQLite connection
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self.outbox.has_pending.set() # Wake the thread if it is idle
+        self.join(timeout)
 
 
 if __name__ == '__main__':
@@ -61,7 +364,4 @@ if __name__ == '__main__':
         "direction": "ingress" # Example
     }
     uploader.upload_event_data(test_event)
-    # To test media upload, you'd need a dummy file
-    # with open("dummy.mp4", "w") as f: f.write("dummy video")
-    # uploader.upload_media_file("dummy.mp4", "TEST_TAG_UPLOAD", "20230101_120000")
-    # os.remove("dummy.mp4")
\ No newline at end of file
+    # Media upload against a running server: python -m APIServer_Backend.benchmarks media_upload
\ No newline at end of file
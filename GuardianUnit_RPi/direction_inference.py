@@ -0,0 +1,249 @@
+# GuardianUnit_RPi/direction_inference.py
+"""
+Crossing-direction inference from two-antenna RSSI timelines.
+
+The gate has an outer antenna (facing the road) and an inner antenna (facing the yard). A tag
+carried into the yard is heard strongest on the outer antenna first and on the inner antenna
+later; leaving, the order is reversed. For every tag pass we keep its recent (time, RSSI,
+antenna) samples and, once the tag has left range, compare the RSSI-weighted mean time of the
+reads on each antenna: outer before inner is ingress, inner before outer is egress.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+INGRESS, EGRESS, UNKNOWN = 'ingress', 'egress', 'unknown'
+
+
+class DirectionTracker:
+    """
+    Per-EPC RSSI history in preallocated NumPy arrays: one row (slot) per tag in range, each row a
+    fixed-size ring buffer of buffer_samples reads, so memory is fixed at max_tags x buffer_samples
+    and recording a read is three scalar stores. A tag that lingers overwrites its oldest samples;
+    what remains describes how it left, which is what the direction is about.
+    classify() handles all tags leaving in one expiry pass with array operations over their rows
+    and frees their slots. record() and classify() are meant to be called from the same (main) thread.
+    """
+    def __init__(self, outer_antenna=1, inner_antenna=2, max_tags=512, buffer_samples=256,
+                 min_reads_per_antenna=3, min_separation_seconds=0.15):
+        self.outer_antenna = outer_antenna
+        self.inner_antenna = inner_antenna
+        self.buffer_samples = buffer_samples
+        self.min_reads_per_antenna = min_reads_per_antenna
+        self.min_separation_seconds = min_separation_seconds
+        self._times = np.zeros((max_tags, buffer_samples), dtype=np.float64)
+        self._rssi = np.zeros((max_tags, buffer_samples), dtype=np.float32)
+        self._antenna = np.zeros((max_tags, buffer_samples), dtype=np.int8) # 0 marks an empty sample
+        self._written = [0] * max_tags # Reads written per slot; write position is this modulo buffer_samples
+        self._slots = {} # epc bytes -> row index
+        self._free_slots = list(range(max_tags - 1, -1, -1))
+        self.tags_dropped = 0 # Tags not tracked because all slots were in use
+
+    def record(self, epc, rssi, antenna, now):
+        if antenna != self.outer_antenna and antenna != self.inner_antenna:
+            return
+        slot = self._slots.get(epc)
+        if slot is None:
+            if not self._free_slots:
+                self.tags_dropped += 1
+                return
+            slot = self._free_slots.pop()
+            self._slots[epc] = slot
+            self._antenna[slot] = 0
+            self._written[slot] = 0
+        position = self._written[slot] % self.buffer_samples
+        self._written[slot] += 1
+        self._times[slot, position] = now
+        self._rssi[slot, position] = rssi
+        self._antenna[slot, position] = antenna
+
+    def record_reads(self, reads, now):
+        """
+        Feeds one read cycle of (epc, rssi, antenna, read_count[, monotonic time]) tuples, as passed to
+        TagAggregator. Continuous reads carry the time they arrived (ContinuousReadQueue), which is
+        kept even when the main loop drains them late; polling reads have none and get now.
+        """
+        for read in reads:
+            self.record(read[0], read[1], read[2], read[4] if len(read) > 4 else now)
+
+    def classify(self, epcs):
+        """Returns {epc: 'ingress' | 'egress' | 'unknown'} for tags that left range and frees their slots."""
+        directions = {epc: UNKNOWN for epc in epcs}
+        tracked = [epc for epc in epcs if epc in self._slots]
+        if not tracked:
+            return directions
+        rows = np.fromiter((self._slots.pop(epc) for epc in tracked), dtype=np.intp, count=len(tracked))
+        times = self._times[rows]
+        antennas = self._antenna[rows]
+        times -= times.min(axis=1, where=antennas != 0, initial=np.inf)[:, None] # Relative times keep the sums well-conditioned
+        weights = np.power(10.0, self._rssi[rows] / 10.0) # dBm -> mW, so strong reads dominate
+        outer = antennas == self.outer_antenna
+        inner = antennas == self.inner_antenna
+        outer_weights = np.where(outer, weights, 0.0)
+        inner_weights = np.where(inner, weights, 0.0)
+        outer_center = (outer_weights * times).sum(axis=1) / np.maximum(outer_weights.sum(axis=1), 1e-30)
+        inner_center = (inner_weights * times).sum(axis=1) / np.maximum(inner_weights.sum(axis=1), 1e-30)
+        separation = inner_center - outer_center
+        decided = ((outer.sum(axis=1) >= self.min_reads_per_antenna) & (inner.sum(axis=1) >= self.min_reads_per_antenna)
+                   & (np.abs(separation) >= self.min_separation_seconds))
+        for epc, is_decided, is_ingress in zip(tracked, decided.tolist(), (separation > 0).tolist()):
+            if is_decided:
+                directions[epc] = INGRESS if is_ingress else EGRESS
+        self._free_slots.extend(rows.tolist())
+        return directions
+
+    def active_count(self):
+        return len(self._slots)
+
+
+class DirectionJoin:
+    """
+    Pairs event payloads with directions. A clip (and so its events) can finish before or after
+    the tag's pass ends, so whichever side arrives first waits for the other; emit(payload) is
+    called with the direction filled in. Passes are keyed on (tag_id, detected_at) so a tag that
+    comes back never picks up the direction of its previous pass. Safe to call from any thread.
+    """
+    def __init__(self, emit, max_waiting=4096):
+        self.emit = emit
+        self.max_waiting = max_waiting
+        self._lock = threading.Lock()
+        self._events = OrderedDict() # pass key -> payload waiting for its direction
+        self._directions = OrderedDict() # pass key -> direction waiting for its payload
+
+    def submit(self, pass_key, payload):
+        with self._lock:
+            direction = self._directions.pop(pass_key, None)
+            if direction is None:
+                self._events[pass_key] = payload
+                overflow = []
+                while len(self._events) > self.max_waiting: # Never drop an event; send the oldest without a direction
+                    overflow.append(self._events.popitem(last=False)[1])
+            else:
+                payload['direction'] = direction
+                overflow = [payload]
+        for ready in overflow:
+            ready.setdefault('direction', UNKNOWN)
+            self.emit(ready)
+
+    def resolve(self, directions):
+        """directions: {pass_key: direction} for passes that just ended."""
+        ready = []
+        with self._lock:
+            for pass_key, direction in directions.items():
+                payload = self._events.pop(pass_key, None)
+                if payload is None:
+                    self._directions[pass_key] = direction # No event yet (clip still recording, or none will come)
+                else:
+                    payload['direction'] = direction
+                    ready.append(payload)
+            while len(self._directions) > self.max_waiting:
+                self._directions.popitem(last=False)
+        for payload in ready:
+            self.emit(payload)
+
+    def flush(self):
+        """Emits events still waiting for a direction as 'unknown' (used at shutdown)."""
+        with self._lock:
+            waiting = list(self._events.values())
+            self._events.clear()
+            self._directions.clear()
+        for payload in waiting:
+            payload['direction'] = UNKNOWN
+            self.emit(payload)
+
+
+# Standalone test: replay of synthetic two-antenna traces for 200 tags crossing at once
+if __name__ == '__main__':
+    import random
+    import time
+
+    TAGS, READ_HZ = 200, 20 # Reads per second per antenna while a tag is in range
+    ANTENNA_SPACING_M, READ_THRESHOLD_DBM = 2.0, -72.0
+
+    def synthetic_trace(start_s):
+        """One tag crossing the gate at walking-to-driving speed; returns (direction, [(t, rssi, antenna), ...])."""
+        direction = random.choice([INGRESS, EGRESS])
+        speed = random.uniform(0.8, 4.0) # m/s
+        offset = random.uniform(-0.8, 0.8) # Lateral offset from the antennas' axis
+        path_m = 8.0
+        positions = {1: -ANTENNA_SPACING_M / 2, 2: ANTENNA_SPACING_M / 2} # Outer antenna on the road side (x < 0)
+        reads = []
+        t = 0.0
+        while t * speed < path_m:
+            x = -path_m / 2 + t * speed
+            if direction == EGRESS:
+                x = -x
+            for antenna, antenna_x in positions.items():
+                distance = max(0.3, ((x - antenna_x) ** 2 + offset ** 2) ** 0.5)
+                rssi = -45.0 - 20.0 * np.log10(distance / 0.3) + random.gauss(0, 3.0) # Log-distance path loss + fading
+                if rssi > READ_THRESHOLD_DBM and random.random() < 0.85:
+                    reads.append((start_s + t + random.uniform(0, 1 / READ_HZ), int(rssi), antenna))
+            t += 1 / READ_HZ
+        return direction, reads
+
+    # 200 tags (e.g. a truck of tagged bins plus foot traffic) all entering within 3 s of each other
+    traces = {random.randbytes(12): synthetic_trace(random.uniform(0, 3.0)) for _ in range(TAGS)}
+    stream = sorted((t, epc, rssi, antenna) for epc, (_, reads) in traces.items() for t, rssi, antenna in reads)
+    last_read = {}
+    for t, epc, _, _ in stream:
+        last_read[epc] = t
+    duration = stream[-1][0] - stream[0][0]
+    print(f"Trace: {len(stream)} reads from {TAGS} tags over {duration:.1f}s ({len(stream) / duration:,.0f} reads/s, "
+          f"{TAGS} tags crossing within 3s)")
+
+    tracker = DirectionTracker(max_tags=512)
+    leave_after = 1.0 # Seconds without reads before a tag counts as gone (TagAggregator's window in production)
+    directions, classify_times, peak_tracked = {}, [], 0
+    start = time.perf_counter()
+    record_time = 0.0
+    next_expire = stream[0][0] + 0.1
+    for t, epc, rssi, antenna in stream:
+        record_start = time.perf_counter()
+        tracker.record(epc, rssi, antenna, t)
+        record_time += time.perf_counter() - record_start
+        if t >= next_expire: # Expiry pass every 100 ms of trace time, as the main loop would
+            leaving = [e for e in tracker._slots if last_read[e] < t - leave_after]
+            if leaving:
+                classify_start = time.perf_counter()
+                directions.update(tracker.classify(leaving))
+                classify_times.append((time.perf_counter() - classify_start, len(leaving)))
+            peak_tracked = max(peak_tracked, tracker.active_count())
+            next_expire = t + 0.1
+    classify_start = time.perf_counter()
+    remaining = list(tracker._slots)
+    directions.update(tracker.classify(remaining))
+    classify_times.append((time.perf_counter() - classify_start, len(remaining)))
+    total = time.perf_counter() - start
+
+    correct = sum(directions.get(epc) == truth for epc, (truth, _) in traces.items())
+    unknown = sum(directions.get(epc, UNKNOWN) == UNKNOWN for epc in traces)
+    worst_seconds, worst_batch = max(classify_times)
+    print(f"Peak tags tracked at once: {peak_tracked}")
+    print(f"Accuracy {correct}/{TAGS} ({correct / TAGS:.1%}), unknown {unknown}, wrong {TAGS - correct - unknown}")
+    print(f"record(): {record_time / len(stream) * 1e6:.2f} us/read; classify(): worst {worst_seconds * 1000:.2f} ms "
+          f"for {worst_batch} tags over {len(classify_times)} expiry passes")
+    print(f"Replayed {duration:.1f}s of trace in {total:.3f}s ({duration / total:.0f}x real time)")
+
+    # Worst case for one expiry pass: all 200 tags leave range together
+    for t, epc, rssi, antenna in stream:
+        tracker.record(epc, rssi, antenna, t)
+    classify_start = time.perf_counter()
+    bulk = tracker.classify(list(traces))
+    print(f"classify() of all {len(bulk)} tags in one pass: {(time.perf_counter() - classify_start) * 1000:.2f} ms")
+
+    # A lagging main loop drains a whole pass at once: the per-read times must still decide it
+    epc = b'\x01' * 12
+    lagged_reads = [(epc, -50, antenna, 1, 100.0 + i * 0.05) for i, antenna in enumerate([1] * 5 + [2] * 5)]
+    tracker.record_reads(lagged_reads, now=101.0)
+    print(f"{'OK  ' if tracker.classify([epc])[epc] == INGRESS else 'FAIL'} reads drained in one batch keep their own times")
+
+    # DirectionJoin: the event can arrive before or after its pass's direction
+    emitted = []
+    join = DirectionJoin(emitted.append)
+    join.submit(('aa', 1), {"tag_id": 'aa', "direction": UNKNOWN}) # Clip finished first
+    join.resolve({('aa', 1): INGRESS, ('bb', 2): EGRESS})
+    join.submit(('bb', 2), {"tag_id": 'bb', "direction": UNKNOWN}) # Pass ended first
+    join.submit(('cc', 3), {"tag_id": 'cc', "direction": UNKNOWN}) # Still in range at shutdown
+    join.flush()
+    print(f"DirectionJoin emitted: {[(payload['tag_id'], payload['direction']) for payload in emitted]}")
@@ -0,0 +1,317 @@
+# GuardianUnit_RPi/event_log.py
+"""
+Append-only local record of every tag event this unit logged, whether or not it reached the server.
+
+Events are CSV lines (timestamp,tag_id,video_filename) in a directory of segments named
+events_<sequence>_<opened at>.csv. The active segment stays open for the life of the process
+and every append is one buffered write. Once it reaches max_segment_bytes or max_segment_seconds
+it is sealed: a background thread rewrites it as events_....csv.gz, one gzip member per block of
+BLOCK_LINES lines (the file is still an ordinary gzip that zcat/zgrep read), and writes a small
+sidecar events_....idx.json holding each block's byte range and time span plus, per tag_id, a
+hex bitmap of the blocks it appears in. Tag IDs are stored and looked up in lowercase hex (what
+the unit logs), so an EPC typed as printed on the tag still matches. A lookup by tag or time decompresses only the blocks that can match; the
+active (and any not-yet-sealed) segment, bounded by max_segment_bytes, is scanned directly.
+
+Field techs can query a unit from a shell:
+    python event_log.py --tag e2801160600002... [--since "2024-05-01 00:00:00"] [--until ...]
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+
+HEADER = b'timestamp,tag_id,video_filename\n'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S" # Sorts lexicographically, so lookups compare strings
+BLOCK_LINES = 1024
+SEGMENT_PATTERN = re.compile(r'^events_(\d{6})_\d{8}T\d{6}\.csv(\.gz)?$')
+
+
+def _timestamp_str(value):
+    return value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+
+
+def normalize_tag_id(tag_id):
+    return tag_id.strip().lower() if tag_id else tag_id
+
+
+def _matching_rows(data, tag_id, since, until):
+    """Parses complete CSV lines from data and returns (timestamp, tag_id, video_filename) tuples that match."""
+    if tag_id and tag_id.encode() not in data: # Cheap rejection before splitting lines
+        return []
+    rows = []
+    for line in data.split(b'\n'):
+        if not line or line == HEADER[:-1]:
+            continue
+        timestamp, tag, video_filename = line.decode().split(',', 2)
+        if tag_id and tag != tag_id:
+            continue
+        if (since and timestamp < since) or (until and timestamp > until):
+            continue
+        rows.append((timestamp, tag, video_filename))
+    return rows
+
+
+class LocalEventLog:
+    def __init__(self, log_dir, max_segment_bytes=8 * 1024 * 1024, max_segment_seconds=7 * 24 * 3600, read_only=False):
+        self.log_dir = log_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        os.makedirs(log_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active = None # Open file object; created on the first append
+        self._active_path = None
+        self._active_bytes = 0
+        self._active_opened_at = 0.0
+        self._indexes = {} # Sealed segment path -> loaded index (sealed segments never change)
+        self._seal_queue = None
+        self._sealer = None
+        if not read_only:
+            # Segments left unsealed by a previous run (crash, power loss) are sealed now
+            self._seal_queue = queue.Queue()
+            self._sealer = threading.Thread(target=self._seal_loop, name='event-log-sealer', daemon=True)
+            self._sealer.start()
+            for path in self._segment_paths():
+                if path.endswith('.csv'):
+                    self._seal_queue.put(path)
+        print(f"Local Event Log Initialized at {log_dir} ({len(self._segment_paths())} segment(s)).")
+
+    def _segment_paths(self):
+        segments = []
+        for name in os.listdir(self.log_dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((int(match.group(1)), 0 if match.group(2) else 1, os.path.join(self.log_dir, name)))
+        segments.sort()
+        # A segment that is both sealed and plain was interrupted mid-seal: the plain file is authoritative
+        plain = {path for _, is_plain, path in segments if is_plain}
+        return [path for _, _, path in segments if not (path.endswith('.gz') and path[:-3] in plain)]
+
+    def append(self, tag_id, timestamp_dt, video_filename):
+        """Writes one event and returns its timestamp string. Called from the capture worker thread."""
+        timestamp_str = _timestamp_str(timestamp_dt)
+        line = f"{timestamp_str},{normalize_tag_id(tag_id)},{video_filename}\n".encode()
+        with self._lock:
+            if self._active is None:
+                self._open_segment()
+            elif (self._active_bytes >= self.max_segment_bytes
+                  or time.time() - self._active_opened_at >= self.max_segment_seconds):
+                self._rotate_locked()
+                self._open_segment()
+            self._active.write(line)
+            self._active.flush() # To the OS on every event; a crash loses at most a torn last line
+            self._active_bytes += len(line)
+        return timestamp_str
+
+    def _open_segment(self):
+        sequences = [int(SEGMENT_PATTERN.match(os.path.basename(path)).group(1)) for path in self._segment_paths()]
+        name = f"events_{max(sequences, default=0) + 1:06d}_{datetime.now().strftime('%Y%m%dT%H%M%S')}.csv"
+        self._active_path = os.path.join(self.log_dir, name)
+        self._active = open(self._active_path, 'ab')
+        self._active.write(HEADER)
+        self._active_bytes = len(HEADER)
+        self._active_opened_at = time.time()
+
+    def _rotate_locked(self):
+        self._active.close()
+        self._seal_queue.put(self._active_path)
+        self._active = None
+        self._active_path = None
+
+    def rotate(self):
+        """Seals the active segment now (the next append opens a new one)."""
+        with self._lock:
+            if self._active is not None:
+                self._rotate_locked()
+
+    def _seal_loop(self):
+        while True:
+            path = self._seal_queue.get()
+            try:
+                if path is None:
+                    return
+                self._seal(path)
+            except Exception as e:
+                print(f"LocalEventLog: error sealing {os.path.basename(path)}: {e}")
+            finally:
+                self._seal_queue.task_done()
+
+    def _seal(self, path):
+        with open(path, 'rb') as plain:
+            data = plain.read()
+        lines = data[:data.rfind(b'\n') + 1].splitlines(keepends=True) # Drops a torn last line
+        base = path[:-len('.csv')]
+        blocks, tags = [], {}
+        with open(base + '.csv.gz.tmp', 'wb') as sealed:
+            for start in range(0, len(lines), BLOCK_LINES):
+                chunk = lines[start:start + BLOCK_LINES]
+                timestamps = []
+                for line in chunk:
+                    if line == HEADER:
+                        continue
+                    timestamp, tag, _ = line.split(b',', 2)
+                    timestamps.append(timestamp)
+                    tags[tag] = tags.get(tag, 0) | (1 << len(blocks))
+                if not timestamps:
+                    continue
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: a complete gzip member per block
+                member = compressor.compress(b''.join(chunk)) + compressor.flush()
+                blocks.append([sealed.tell(), len(member), min(timestamps).decode(), max(timestamps).decode()])
+                sealed.write(member)
+        if not blocks: # Header only
+            os.remove(base + '.csv.gz.tmp')
+            os.remove(path)
+            return
+        index = {"count": sum(1 for line in lines if line != HEADER), "first": min(block[2] for block in blocks),
+                 "last": max(block[3] for block in blocks), "blocks": blocks,
+                 "tags": {tag.decode(): format(bitmap, 'x') for tag, bitmap in tags.items()}}
+        with open(base + '.idx.json.tmp', 'w') as index_file:
+            json.dump(index, index_file, separators=(',', ':'))
+        os.replace(base + '.idx.json.tmp', base + '.idx.json')
+        os.replace(base + '.csv.gz.tmp', base + '.csv.gz')
+        os.remove(path) # Last, so an interrupted seal is simply redone from the plain file
+
+    def _load_index(self, sealed_path):
+        index = self._indexes.get(sealed_path)
+        if index is None:
+            with open(sealed_path[:-len('.csv.gz')] + '.idx.json') as index_file:
+                index = json.load(index_file)
+            self._indexes[sealed_path] = index
+        return index
+
+    def lookup(self, tag_id=None, since=None, until=None):
+        """
+        Returns [(timestamp, tag_id, video_filename), ...] sorted by time for events matching the tag
+        and/or the inclusive time range (datetimes or 'YYYY-MM-DD HH:MM:SS' strings). tag_id is case-insensitive.
+        """
+        tag_id = normalize_tag_id(tag_id)
+        since, until = _timestamp_str(since), _timestamp_str(until)
+        rows = []
+        for path in self._segment_paths():
+            if path.endswith('.gz'):
+                rows.extend(self._lookup_sealed(path, tag_id, since, until))
+            else:
+                try:
+                    with open(path, 'rb') as plain:
+                        data = plain.read()
+                except FileNotFoundError: # Sealed since the directory was listed
+                    rows.extend(self._lookup_sealed(path + '.gz', tag_id, since, until))
+                    continue
+                rows.extend(_matching_rows(data[:data.rfind(b'\n') + 1], tag_id, since, until))
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def _lookup_sealed(self, path, tag_id, since, until):
+        index = self._load_index(path)
+        if (since and index['last'] < since) or (until and index['first'] > until):
+            return []
+        if tag_id:
+            bitmap = int(index['tags'].get(tag_id, '0'), 16)
+            block_ids = [block_id for block_id in range(bitmap.bit_length()) if bitmap >> block_id & 1]
+        else:
+            block_ids = range(len(index['blocks']))
+        rows = []
+        with open(path, 'rb') as sealed:
+            for block_id in block_ids:
+                offset, length, first, last = index['blocks'][block_id]
+                if (since and last < since) or (until and first > until):
+                    continue
+                sealed.seek(offset)
+                rows.extend(_matching_rows(zlib.decompress(sealed.read(length), 31), tag_id, since, until))
+        return rows
+
+    def wait_for_sealing(self):
+        self._seal_queue.join()
+
+    def close(self):
+        """Closes the active segment (it is sealed on the next start) and stops the sealing thread."""
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+        if self._sealer:
+            self._seal_queue.put(None)
+            self._sealer.join()
+
+
+def _benchmark(entries, log_dir):
+    import gzip
+    import random
+    import statistics
+    import tempfile
+    from datetime import timedelta
+
+    log_dir = log_dir or tempfile.mkdtemp()
+    tags = [random.randbytes(12).hex() for _ in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(tags))] # A few bins pass daily, most rarely
+    event_log = LocalEventLog(log_dir)
+    start_time = datetime(2014, 1, 1)
+    step = timedelta(seconds=30)
+    batch = 100000
+    start = time.perf_counter()
+    for batch_start in range(0, entries, batch):
+        for index, tag_id in enumerate(random.choices(tags, weights, k=min(batch, entries - batch_start))):
+            event_log.append(tag_id, start_time + step * (batch_start + index), f"{tag_id}_clip.h264")
+    append_seconds = time.perf_counter() - start
+    event_log.rotate()
+    event_log.wait_for_sealing()
+    total_seconds = time.perf_counter() - start
+    segments = event_log._segment_paths()
+    stored = sum(os.path.getsize(os.path.join(log_dir, name)) for name in os.listdir(log_dir))
+    print(f"Appended {entries:,} events in {append_seconds:.1f}s ({entries / append_seconds:,.0f}/s, "
+          f"{append_seconds / entries * 1e6:.1f} us each); sealed {len(segments)} segments by {total_seconds:.1f}s, "
+          f"{stored / 1e6:.0f} MB on disk ({stored / entries:.1f} bytes/event)")
+
+    def timed(label, runs, **query):
+        durations, found = [], 0
+        for _ in range(runs):
+            lookup_start = time.perf_counter()
+            found = len(event_log.lookup(**query))
+            durations.append((time.perf_counter() - lookup_start) * 1000)
+        print(f"{label:<44} {found:>7,} rows, median {statistics.median(durations):8.1f} ms, max {max(durations):8.1f} ms")
+
+    event_log._indexes.clear()
+    timed("tag lookup, rarest tag (cold index cache)", 1, tag_id=tags[-1])
+    timed("tag lookup, rarest tag", 5, tag_id=tags[-1])
+    timed("tag lookup, median-frequency tag", 5, tag_id=tags[len(tags) // 2])
+    timed("tag lookup, most frequent tag (~10% of log)", 3, tag_id=tags[0])
+    middle = start_time + step * (entries // 2)
+    timed("time range, one hour", 5, since=middle, until=middle + timedelta(hours=1))
+    timed("tag + time range, one month", 5, tag_id=tags[100], since=middle, until=middle + timedelta(days=30))
+
+    # What a lookup used to cost: decompressing and scanning the whole history
+    scan_start = time.perf_counter()
+    rows = 0
+    for path in segments:
+        with open(path, 'rb') as sealed:
+            rows += len(_matching_rows(gzip.decompress(sealed.read()), tags[-1], None, None))
+    print(f"{'full scan of every segment, rarest tag':<44} {rows:>7,} rows, {(time.perf_counter() - scan_start) * 1000:8.1f} ms")
+    event_log.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query a Guardian unit's local event log.")
+    parser.add_argument('--dir', help="Event log directory (default: [EventLog] path from config_guardian.ini)")
+    parser.add_argument('--tag', help="Tag ID (EPC hex, any case)")
+    parser.add_argument('--since', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    parser.add_argument('--until', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    parser.add_argument('--benchmark', type=int, metavar='N', help="Append N synthetic events to a scratch log and time lookups")
+    arguments = parser.parse_args()
+    if arguments.benchmark:
+        _benchmark(arguments.benchmark, arguments.dir)
+    else:
+        log_dir = arguments.dir
+        if not log_dir:
+            import configparser
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            config_parser = configparser.ConfigParser()
+            config_parser.read(os.path.join(script_dir, 'config_guardian.ini'))
+            log_dir = os.path.join(script_dir, config_parser.get('EventLog', 'path', fallback='./local_event_log'))
+        for timestamp, tag_id, video_filename in LocalEventLog(log_dir, read_only=True).lookup(
+                arguments.tag, arguments.since, arguments.until):
+            print(f"{timestamp}  {tag_id}  {video_filename}")
@@ -0,0 +1,99 @@
+# GuardianUnit_RPi/event_outbox.py
+"""
+Durable on-device queue (outbox) for events waiting to be uploaded to the API server.
+The RFID loop appends to it; OutboxUploadWorker in data_uploader.py drains it in batches.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class EventOutbox:
+    """
+    SQLite-backed FIFO in WAL mode. An append is one small INSERT + commit (tens of microseconds
+    on a Pi's SD card with synchronous=NORMAL), so it is safe to call inline in the read loop.
+    Rows stay in the file until the uploader confirms them, so pending events survive a
+    power cycle or reboot and are sent when the worker starts again. (With synchronous=NORMAL,
+    a power cut can lose only the last few commits; an application crash loses nothing.)
+    Each thread gets its own connection; SQLite handles the locking between them.
+    """
+    def __init__(self, db_path='./event_outbox.sqlite3'):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.has_pending = threading.Event() # Set on append so the worker wakes up immediately
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL
+            )
+        """)
+        connection.commit()
+        pending = self.pending_count()
+        if pending:
+            self.has_pending.set()
+        print(f"Event Outbox Initialized at {db_path} ({pending} events pending from previous runs).")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, event_data):
+        """Queues one event payload (a JSON-serializable dict) for upload."""
+        connection = self._connection()
+        connection.execute("INSERT INTO outbox (created_at, payload) VALUES (?, ?)", (time.time(), json.dumps(event_data)))
+        connection.commit()
+        self.has_pending.set()
+
+    def peek_batch(self, limit):
+        """Returns up to `limit` of the oldest pending events as [(outbox_id, event_data), ...]."""
+        rows = self._connection().execute("SELECT id, payload FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(outbox_id, json.loads(payload)) for outbox_id, payload in rows]
+
+    def remove(self, outbox_ids):
+        """Drops events once the server has accepted (or permanently rejected) them."""
+        connection = self._connection()
+        connection.executemany("DELETE FROM outbox WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+        connection.commit()
+
+    def record_attempt(self, outbox_ids):
+        connection = self._connection()
+        connection.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+        connection.commit()
+
+    def pending_count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+# Standalone test
+if __name__ == '__main__':
+    import os
+    import tempfile
+    test_path = os.path.join(tempfile.mkdtemp(), 'outbox_test.sqlite3')
+    outbox = EventOutbox(db_path=test_path)
+    count = 5000
+    start = time.perf_counter()
+    for i in range(count):
+        outbox.append({"timestamp_iso": "2023-01-01T12:00:00", "tag_id": f"TEST_TAG_{i % 50}", "direction": "unknown"})
+    elapsed = time.perf_counter() - start
+    print(f"Appended {count} events in {elapsed:.3f}s ({elapsed / count * 1e6:.1f} us/event)")
+    batch = outbox.peek_batch(100)
+    outbox.remove([outbox_id for outbox_id, _ in batch])
+    print(f"Drained one batch of {len(batch)}; {outbox.pending_count()} pending")
+    outbox.close()
+    reopened = EventOutbox(db_path=test_path) # Simulates a restart: pending events are still there
+    reopened.close()
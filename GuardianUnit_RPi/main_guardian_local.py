@@ -1,26 +1,21 @@
 # GuardianUnit_RPi/main_guardian_local.py
 import time
-import csv
 import os
 from datetime import datetime
 import configparser
 
-from rfid_reader_ufr import RFIDReader # Stays the same
 from camera_manager_picam import CameraManager # <<<< CHANGED HERE
+from data_uploader import DataUploader, OutboxUploadWorker, MediaUploadWorker, file_sha256
+from event_outbox import EventOutbox
+from capture_pipeline import CaptureWorker
+from tag_aggregator import TagAggregator
+from rfid_stream import ContinuousReadQueue, open_rfid_reader
+from direction_inference import DirectionTracker, DirectionJoin
+from media_processing import MediaProcessor, processing_settings
+from event_log import LocalEventLog
 
-# data_uploader import is for later phases
-# from data_uploader import DataUploader 
-
-def log_local_event(log_file_path, tag_id, timestamp_dt, video_filename):
-    # (Content of this function remains the same)
-    file_exists = os.path.isfile(log_file_path)
-    timestamp_str = timestamp_dt.strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_file_path, 'a', newline='') as csvfile:
-        fieldnames = ['timestamp', 'tag_id', 'video_filename']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow({'timestamp': timestamp_str, 'tag_id': tag_id, 'video_filename': video_filename})
+def log_local_event(event_log, tag_id, timestamp_dt, video_filename):
+    timestamp_str = event_log.append(tag_id, timestamp_dt, video_filename)
     print(f"Local event logged: {timestamp_str}, {tag_id}, {video_filename}")
 
 
@@ -36,17 +31,34 @@ def main():
         return
     config_parser.read(config_file)
     
-    log_file = config_parser.get('General', 'log_file_path', fallback='./local_event_log.csv')
-    # If log_file_path is relative, make it relative to the script's dir too, or GuardianUnit_RPi
-    if not os.path.isabs(log_file):
-        log_file = os.path.join(script_dir, log_file)
+    event_log_path = config_parser.get('EventLog', 'path', fallback='./local_event_log')
+    # If the path is relative, make it relative to the script's dir too, or GuardianUnit_RPi
+    if not os.path.isabs(event_log_path):
+        event_log_path = os.path.join(script_dir, event_log_path)
 
     guardian_id = config_parser.get('General', 'guardian_unit_id', fallback='GUARDIAN_DEFAULT')
+    dedup_window_seconds = config_parser.getfloat('RFID', 'dedup_window_seconds', fallback=5.0)
+    read_mode = config_parser.get('RFID', 'read_mode', fallback='continuous').lower()
+    record_stream_path = config_parser.get('RFID', 'record_stream_path', fallback='') or None
+    if record_stream_path and not os.path.isabs(record_stream_path):
+        record_stream_path = os.path.join(script_dir, record_stream_path)
+    direction_enabled = config_parser.getboolean('Direction', 'enabled', fallback=False)
+    upload_enabled = config_parser.getboolean('Uploader', 'enabled', fallback=False)
+    outbox_path = config_parser.get('Uploader', 'outbox_path', fallback='./event_outbox.sqlite3')
+    if not os.path.isabs(outbox_path):
+        outbox_path = os.path.join(script_dir, outbox_path)
+    media_upload_enabled = config_parser.getboolean('Uploader', 'media_enabled', fallback=False)
+    media_outbox_path = config_parser.get('Uploader', 'media_outbox_path', fallback='./media_outbox.sqlite3')
+    if not os.path.isabs(media_outbox_path):
+        media_outbox_path = os.path.join(script_dir, media_outbox_path)
+    originals_outbox_path = config_parser.get('Uploader', 'originals_outbox_path', fallback='./originals_outbox.sqlite3')
+    if not os.path.isabs(originals_outbox_path):
+        originals_outbox_path = os.path.join(script_dir, originals_outbox_path)
+    processing_enabled = config_parser.getboolean('Processing', 'enabled', fallback=False)
 
     # Initialize components
-    rfid = RFIDReader(config_path=config_file)
+    rfid = open_rfid_reader(config_parser, config_file) # ThingMagic hardware, or a recorded stream for replay
     camera = CameraManager(config_path=config_file) # Using the new camera manager
-    # uploader = DataUploader(config_path=config_file) # For later
 
     if not rfid.connected:
         print("Failed to connect to RFID reader. Check configuration and connections. Exiting.")
@@ -57,51 +69,154 @@ def main():
         # Decide if you want to exit or continue without camera
         # return # Or just let it run for RFID
 
-    print(f"Guardian Unit '{guardian_id}' Started. Scanning for RFID tags...")
+    # Kept open for the whole run; full segments are compressed and indexed in the background
+    event_log = LocalEventLog(event_log_path,
+                              max_segment_bytes=config_parser.getint('EventLog', 'max_segment_mb', fallback=8) * 1024 * 1024,
+                              max_segment_seconds=config_parser.getfloat('EventLog', 'max_segment_hours', fallback=168) * 3600)
+
+    outbox = None
+    upload_worker = None
+    media_queue = None
+    originals_queue = None
+    media_upload_worker = None
+    if upload_enabled:
+        # Events are queued locally in microseconds; the worker uploads them in batches in the background
+        outbox = EventOutbox(db_path=outbox_path)
+        uploader = DataUploader(config_path=config_file)
+        upload_worker = OutboxUploadWorker(outbox, uploader, config_path=config_file)
+        upload_worker.start()
+        if media_upload_enabled:
+            # Clips upload separately, chunked and bandwidth-capped, so they never hold up event batches
+            media_queue = EventOutbox(db_path=media_outbox_path)
+            if processing_enabled:
+                # With previews uploading first, full-resolution originals wait for an idle link or a request
+                originals_queue = EventOutbox(db_path=originals_outbox_path)
+            media_upload_worker = MediaUploadWorker(media_queue, uploader, config_path=config_file, deferred_queue=originals_queue,
+                                                    is_link_idle=lambda: outbox.pending_count() == 0)
+            media_upload_worker.start()
+
+    direction_tracker = None
+    direction_join = None
+    pass_started = {} # epc -> detected_at of its current pass; (tag_id, detected_at) identifies the pass
+    if direction_enabled:
+        direction_tracker = DirectionTracker(
+            outer_antenna=config_parser.getint('Direction', 'outer_antenna', fallback=1),
+            inner_antenna=config_parser.getint('Direction', 'inner_antenna', fallback=2),
+            max_tags=config_parser.getint('Direction', 'max_tags', fallback=512),
+            buffer_samples=config_parser.getint('Direction', 'buffer_samples', fallback=256),
+            min_reads_per_antenna=config_parser.getint('Direction', 'min_reads_per_antenna', fallback=3),
+            min_separation_seconds=config_parser.getfloat('Direction', 'min_separation_seconds', fallback=0.15))
+        if outbox:
+            # The direction is known only once the tag leaves range, so events wait here for it
+            direction_join = DirectionJoin(outbox.append)
+
+    def resolve_directions(epcs):
+        # Classifies passes that ended and hands the directions to the events waiting for them
+        ended = {}
+        for epc, direction in direction_tracker.classify(epcs).items():
+            detected_at = pass_started.pop(epc, None)
+            if detected_at is not None:
+                print(f"Tag {epc.hex()} (pass from {detected_at.strftime('%H:%M:%S')}) direction: {direction}")
+                ended[(epc.hex(), detected_at)] = direction
+        if direction_join and ended:
+            direction_join.resolve(ended)
+
+    def handle_clip_done(clip, status):
+        # Runs on the capture worker thread once a clip is finished (or right away without a camera).
+        # Every tag seen during the clip gets its own event referencing the shared video file.
+        video_filename_local = os.path.basename(clip.video_filename) if clip.video_filename else None
+        for tag_id, detected_at in clip.tags:
+            if video_filename_local:
+                log_local_event(event_log, tag_id, detected_at, video_filename_local)
+            elif status == 'NO_VIDEO_CAM_INIT_FAIL':
+                print(f"Camera not available. Event logged without video for tag {tag_id}.")
+                log_local_event(event_log, tag_id, detected_at, "NO_VIDEO_CAM_INIT_FAIL")
+            else:
+                print(f"Failed to capture video for tag {tag_id}. Event logged without video.")
+                log_local_event(event_log, tag_id, detected_at, "NO_VIDEO_CAPTURE_FAIL")
+        if media_processor:
+            media_processor.submit(clip, status) # Thumbnail + proxy first; events follow in queue_clip_events
+        else:
+            queue_clip_events(clip, status, None)
+
+    def queue_clip_events(clip, status, processed):
+        # processed: media_processing.process_clip() result, or None (no processing, or it failed)
+        media_references = {}
+        if media_queue and clip.video_filename:
+            # The server derives URLs from these hashes, so events can reference media before it is uploaded
+            original = processed['original'] if processed else {
+                "path": clip.video_filename, "sha256": file_sha256(clip.video_filename), "content_type": "video/h264"}
+            previews = {name: processed[name] for name in ('thumbnail', 'proxy') if processed and processed[name]}
+            for preview in previews.values():
+                media_queue.append(preview)
+            (originals_queue if previews and originals_queue else media_queue).append(original)
+            media_references = {"video_sha256": original['sha256'],
+                                **{f"{name}_sha256": preview['sha256'] for name, preview in previews.items()}}
+        if not outbox:
+            return
+        video_filename_local = os.path.basename(clip.video_filename) if clip.video_filename else None
+        for tag_id, detected_at in clip.tags:
+            event_payload = {
+                "timestamp_iso": detected_at.astimezone().isoformat(), # With the unit's UTC offset
+                "tag_id": tag_id,
+                "video_filename_local": video_filename_local,
+                "video_url_remote": None,
+                "direction": "unknown",
+                **media_references
+            }
+            if direction_join:
+                direction_join.submit((tag_id, detected_at), event_payload) # Sent once the tag's pass ends
+            else:
+                outbox.append(event_payload) # Never blocks on the network
+
+    media_processor = None
+    if processing_enabled and media_queue:
+        media_processor = MediaProcessor(processing_settings(config_parser), queue_clip_events,
+                                         max_workers=config_parser.getint('Processing', 'workers', fallback=1),
+                                         niceness=config_parser.getint('Processing', 'niceness', fallback=10))
+
+    # Video capture runs on its own thread so the read loop below keeps polling while a clip records
+    capture_worker = CaptureWorker(camera if camera.picam2 else None, handle_clip_done)
+    capture_worker.start()
+
+    # A tag triggers an event once per pass; re-reads within the dedup window only update its stats
+    tag_aggregator = TagAggregator(window_seconds=dedup_window_seconds)
+    next_expire_at = time.monotonic() + dedup_window_seconds
+
+    # Continuous mode: the reader streams reads into a queue with no gaps between inventory rounds.
+    # Polling mode: one blocking read_tags() round per loop iteration (the previous behaviour).
+    read_queue = None
+    if read_mode == 'continuous':
+        read_queue = ContinuousReadQueue(rfid, record_path=record_stream_path)
+        if not read_queue.start():
+            print("Continuous reading unavailable; falling back to polling.")
+            read_queue = None
+
+    print(f"Guardian Unit '{guardian_id}' Started ({'continuous' if read_queue else 'polling'} read mode). Scanning for RFID tags...")
     print("Press Ctrl+C to stop.")
 
     try:
         while True:
-            tag_id = rfid.read_tag()
-            if tag_id:
+            reads = read_queue.get_reads(timeout=0.1) if read_queue else rfid.read_tags()
+            now = time.monotonic()
+            if now >= next_expire_at:
+                finished = tag_aggregator.expire(now) # Forget tags that left, bounding memory
+                if direction_tracker and finished:
+                    resolve_directions([finished_pass[0] for finished_pass in finished])
+                next_expire_at = now + dedup_window_seconds
+            if reads:
                 current_time_dt = datetime.now()
-                current_timestamp_iso = current_time_dt.isoformat() # For potential future API use
-                print(f"--- Tag Detected: {tag_id} at {current_time_dt.strftime('%Y-%m-%d %H:%M:%S')} ---")
-                
-                video_filename_local = None
-                if camera.picam2: # Only try to capture if camera is available
-                    video_filename_local = camera.capture_video_for_tag(tag_id)
-                
-                if video_filename_local:
-                    log_local_event(log_file, tag_id, current_time_dt, os.path.basename(video_filename_local))
-                elif not camera.picam2:
-                     print(f"Camera not available. Event logged without video for tag {tag_id}.")
-                     log_local_event(log_file, tag_id, current_time_dt, "NO_VIDEO_CAM_INIT_FAIL")
-                else:
-                    print(f"Failed to capture video for tag {tag_id}. Event logged without video.")
-                    log_local_event(log_file, tag_id, current_time_dt, "NO_VIDEO_CAPTURE_FAIL")
-                
-                # --- Placeholder for Phase 2+ data upload ---
-                # if video_filename_local:
-                #     video_url_remote = uploader.upload_media_file(video_filename_local, tag_id, current_time_dt.strftime("%Y%m%d_%H%M%S"))
-                # else:
-                #     video_url_remote = None
-                # event_payload = {
-                #     "timestamp_iso": current_timestamp_iso,
-                #     "tag_id": tag_id,
-                #     "video_filename_local": os.path.basename(video_filename_local) if video_filename_local else None,
-                #     "video_url_remote": video_url_remote,
-                #     "direction": "unknown" 
-                # }
-                # print(f"Prepared event payload for upload: {event_payload}")
-                # uploader.upload_event_data(event_payload)
-                # --- End Placeholder ---
-
-                print("----------------------------------------------------")
-                # Brief pause after processing a tag. Might need adjustment based on vehicle speed
-                # and how quickly you want to be able to detect the *next* distinct tag.
-                time.sleep(1) 
-            else:
+                for epc in tag_aggregator.observe_reads(reads, now):
+                    tag_id = epc.hex()
+                    print(f"--- Tag Detected: {tag_id} at {current_time_dt.strftime('%Y-%m-%d %H:%M:%S')} ---")
+                    if direction_tracker:
+                        if epc in pass_started: # Previous pass ended but was not expired yet
+                            resolve_directions([epc])
+                        pass_started[epc] = current_time_dt
+                    capture_worker.submit(tag_id, current_time_dt) # Returns immediately
+                if direction_tracker:
+                    direction_tracker.record_reads(reads, now)
+            elif not read_queue:
                 # How often to attempt a read when no tag is present.
                 # Shorter makes it more responsive but uses slightly more CPU.
                 time.sleep(0.05) # 50ms
@@ -109,10 +224,31 @@ def main():
     except KeyboardInterrupt:
         print("\nStopping Guardian Unit...")
     finally:
+        if read_queue:
+            read_queue.stop()
         if 'rfid' in locals() and rfid: # Check if rfid object exists
             rfid.close()
+        capture_worker.stop() # Finish the clip in progress so its events are logged
+        event_log.close()
+        if media_processor:
+            media_processor.shutdown() # Clips already recorded still get previews and events
+        if direction_tracker:
+            resolve_directions(list(pass_started)) # Tags still in range get a direction from what was seen so far
+        if direction_join:
+            direction_join.flush()
         if 'camera' in locals() and camera: # Check if camera object exists
             camera.close_camera()
+        if media_upload_worker:
+            media_upload_worker.stop() # An interrupted clip resumes from the server's offset next start
+        if media_queue:
+            media_queue.close()
+        if originals_queue:
+            originals_queue.close()
+        if upload_worker:
+            upload_worker.stop() # Anything not yet uploaded stays in the outbox for the next start
+            upload_worker.uploader.close()
+        if outbox:
+            outbox.close()
         print("Guardian Unit stopped.")
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+# GuardianUnit_RPi/media_processing.py
+"""
+Post-capture processing: every full-resolution clip gets a JPEG thumbnail (its first frame,
+which the pre-trigger recorder guarantees is a keyframe) and a low-bitrate proxy clip. Those two
+upload first so the dashboard can show the event within seconds; the 1080p original waits for
+an idle link or an explicit request (see MediaUploadWorker in data_uploader.py).
+The work is done by ffmpeg in a separate process pool at lowered CPU priority, so transcoding
+never competes with the RFID loop or the capture worker for the GIL.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import subprocess
+
+from data_uploader import file_sha256
+
+
+def _lower_priority(niceness):
+    os.nice(niceness)
+
+
+def _describe(path, content_type):
+    return {"path": path, "sha256": file_sha256(path), "size_bytes": os.path.getsize(path), "content_type": content_type}
+
+
+def process_clip(clip_path, settings):
+    """
+    Runs in a pool worker. Returns {"original": ..., "thumbnail": ..., "proxy": ..., "errors": [...]},
+    each media entry {"path", "sha256", "size_bytes", "content_type"} or None if it failed.
+    """
+    ffmpeg = [settings['ffmpeg_path'], '-hide_banner', '-loglevel', 'error', '-y',
+              '-f', 'h264', '-framerate', str(settings['source_framerate']), '-i', clip_path] # Raw .h264 has no timestamps
+    stem = os.path.splitext(clip_path)[0]
+    result = {"original": _describe(clip_path, 'video/h264'), "thumbnail": None, "proxy": None, "errors": []}
+    jobs = [
+        ('thumbnail', stem + '_thumb.jpg', 'image/jpeg',
+         ['-frames:v', '1', '-vf', f"scale={settings['thumbnail_width']}:-2", '-q:v', '4']),
+        ('proxy', stem + '_proxy.mp4', 'video/mp4',
+         ['-an', '-vf', f"scale={settings['proxy_width']}:-2,fps={settings['proxy_framerate']}",
+          '-c:v', settings['proxy_encoder'], '-b:v', f"{settings['proxy_bitrate_kbps']}k",
+          '-maxrate', f"{settings['proxy_bitrate_kbps']}k", '-bufsize', f"{settings['proxy_bitrate_kbps'] * 2}k",
+          '-pix_fmt', 'yuv420p', '-threads', str(settings['ffmpeg_threads']), '-movflags', '+faststart']),
+    ]
+    for name, output_path, content_type, arguments in jobs:
+        try:
+            subprocess.run(ffmpeg + arguments + [output_path], check=True, capture_output=True, timeout=settings['timeout_seconds'])
+            result[name] = _describe(output_path, content_type)
+        except (OSError, subprocess.SubprocessError) as e:
+            stderr = getattr(e, 'stderr', None)
+            result["errors"].append(f"{name}: {stderr.decode(errors='replace').strip() if stderr else e}")
+    return result
+
+
+def processing_settings(config_parser):
+    """Reads [Processing] (and the source frame rate from [Camera]) into the dict process_clip() takes."""
+    return {
+        'ffmpeg_path': config_parser.get('Processing', 'ffmpeg_path', fallback='ffmpeg'),
+        'ffmpeg_threads': config_parser.getint('Processing', 'ffmpeg_threads', fallback=2),
+        'source_framerate': config_parser.getint('Camera', 'framerate', fallback=30),
+        'thumbnail_width': config_parser.getint('Processing', 'thumbnail_width', fallback=480),
+        'proxy_width': config_parser.getint('Processing', 'proxy_width', fallback=640),
+        'proxy_framerate': config_parser.getint('Processing', 'proxy_framerate', fallback=10),
+        'proxy_bitrate_kbps': config_parser.getint('Processing', 'proxy_bitrate_kbps', fallback=400),
+        'proxy_encoder': config_parser.get('Processing', 'proxy_encoder', fallback='libx264'),
+        'timeout_seconds': config_parser.getint('Processing', 'timeout_seconds', fallback=300),
+    }
+
+
+class MediaProcessor:
+    """
+    Submits finished clips to a process pool and calls on_processed(clip, status, result) when
+    done, from the pool's result thread. result is process_clip()'s dict, or None if the clip has
+    no video or the worker crashed; callers then fall back to uploading the original directly.
+    Workers are spawned rather than forked, so they don't inherit the camera or reader threads.
+    """
+    def __init__(self, settings, on_processed, max_workers=1, niceness=10):
+        self.settings = settings
+        self.on_processed = on_processed
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_lower_priority, initargs=(niceness,))
+        print(f"Media Processor Initialized ({max_workers} worker(s), proxy {settings['proxy_width']}px "
+              f"@ {settings['proxy_bitrate_kbps']} kbps).")
+
+    def submit(self, clip, status):
+        if not clip.video_filename:
+            self._deliver(clip, status, None)
+            return
+        future = self._pool.submit(process_clip, clip.video_filename, self.settings)
+        future.add_done_callback(lambda done: self._finished(clip, status, done))
+
+    def _finished(self, clip, status, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"MediaProcessor: processing {clip.video_filename} failed: {e}")
+            result = None
+        if result and result['errors']:
+            print(f"MediaProcessor: {os.path.basename(clip.video_filename)}: {'; '.join(result['errors'])}")
+        self._deliver(clip, status, result)
+
+    def _deliver(self, clip, status, result):
+        try:
+            self.on_processed(clip, status, result)
+        except Exception as e:
+            print(f"MediaProcessor: error handling processed clip for {clip.primary_tag_id}: {e}")
+
+    def shutdown(self):
+        """Finishes clips already submitted (their events still go out), then stops the workers."""
+        self._pool.shutdown(wait=True)
+
+
+# Standalone test: synthetic 1080p / 8 Mbps clips through the pool (needs ffmpeg on PATH or FFMPEG_PATH)
+if __name__ == '__main__':
+    import tempfile
+    import threading
+    import time
+
+    CLIPS, CLIP_SECONDS = 3, 13 # 3 s pre-trigger + 10 s capture
+    settings = {'ffmpeg_path': os.environ.get('FFMPEG_PATH', 'ffmpeg'), 'ffmpeg_threads': 2, 'source_framerate': 30,
+                'thumbnail_width': 480, 'proxy_width': 640, 'proxy_framerate': 10, 'proxy_bitrate_kbps': 400,
+                'proxy_encoder': 'libx264', 'timeout_seconds': 300}
+    work_dir = tempfile.mkdtemp()
+    clip_paths = []
+    for index in range(CLIPS):
+        clip_path = os.path.join(work_dir, f"TAG{index}_20240101_120000.h264")
+        subprocess.run([settings['ffmpeg_path'], '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', f"testsrc2=size=1920x1080:rate=30:duration={CLIP_SECONDS}", '-c:v', 'libx264',
+                        '-b:v', '8M', '-g', '30', '-pix_fmt', 'yuv420p', '-f', 'h264', clip_path], check=True)
+        clip_paths.append(clip_path)
+
+    class TestClip:
+        def __init__(self, path):
+            self.video_filename, self.primary_tag_id = path, os.path.basename(path)
+
+    results, all_done = [], threading.Event()
+    def on_processed(clip, status, result):
+        results.append((time.perf_counter(), result))
+        if len(results) == CLIPS:
+            all_done.set()
+
+    processor = MediaProcessor(settings, on_processed, max_workers=1)
+    start = time.perf_counter()
+    for clip_path in clip_paths:
+        processor.submit(TestClip(clip_path), 'ok')
+    submit_seconds = time.perf_counter() - start
+    all_done.wait()
+    processor.shutdown()
+
+    print(f"submit() for {CLIPS} clips returned in {submit_seconds * 1000:.1f} ms (work happens in the pool)")
+    for finished_at, result in results:
+        original, thumbnail, proxy = result['original'], result['thumbnail'], result['proxy']
+        preview_bytes = (thumbnail['size_bytes'] if thumbnail else 0) + (proxy['size_bytes'] if proxy else 0)
+        print(f"{os.path.basename(original['path'])}: done at {finished_at - start:.1f}s, original {original['size_bytes'] / 1e6:.1f} MB, "
+              f"thumbnail {thumbnail['size_bytes'] / 1e3 if thumbnail else 0:.0f} kB, proxy {proxy['size_bytes'] / 1e6 if proxy else 0:.2f} MB "
+              f"-> previews are {preview_bytes / original['size_bytes']:.1%} of the original's bytes"
+              + (f" (errors: {result['errors']})" if result['errors'] else ""))
+    at_2_mbps = preview_bytes * 8 / 2e6
+    print(f"At a 2 Mbps cap: preview of one clip in {at_2_mbps:.1f}s vs {original['size_bytes'] * 8 / 2e6:.0f}s for the original")
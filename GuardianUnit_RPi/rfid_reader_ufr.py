@@ -9,6 +9,9 @@ class RFIDReader:
         self.config.read(config_path)
         self.reader_type = self.config.get('RFID', 'reader_type', fallback='MOCK').upper()
         self.reader_uri = self.config.get('RFID', 'reader_uri', fallback='tmr:///dev/ttyUSB0')
+        # Continuous mode: the reader inventories for on_time ms, pauses off_time ms, and repeats (0 = no gaps)
+        self.continuous_on_time_ms = self.config.getint('RFID', 'continuous_on_time_ms', fallback=250)
+        self.continuous_off_time_ms = self.config.getint('RFID', 'continuous_off_time_ms', fallback=0)
         self.reader = None
         self.connected = False
 
@@ -28,20 +31,19 @@ class RFIDReader:
                 self.reader.set_region(region)
                 print(f"Set RFID region to: {region}")
 
+            # Two antennas (outer and inner side of the gate) let direction_inference.py tell ingress from egress
+            antennas = [int(port) for port in self.config.get('RFID', 'antennas', fallback='1').split(',')]
             if self.config.has_option('RFID', 'read_power'):
                 power = self.config.getint('RFID', 'read_power')
-                # For ThingMagic USB Pro, antenna port is typically 1.
-                # Some readers might have multiple physical antennas mapped to logical ports.
                 # The set_read_plan is more versatile if you have complex antenna setups.
-                # For a single antenna on USB Pro, setting power on antenna 1 is common.
                 # self.reader.set_read_powers([1], [power]) # Older method
-                self.reader.set_read_plan([1], "GEN2", read_power=power) # Antenna 1, GEN2, specific power
-                print(f"Set RFID read power to: {power} cBdm on antenna 1")
+                self.reader.set_read_plan(antennas, "GEN2", read_power=power) # GEN2, same power on every antenna
+                print(f"Set RFID read power to: {power} cBdm on antenna(s) {antennas}")
             else:
                 # Default sensible plan if not specified
-                self.reader.set_read_plan([1], "GEN2")
-                print("Set RFID to default read plan (Antenna 1, GEN2, default power)")
-            
+                self.reader.set_read_plan(antennas, "GEN2")
+                print(f"Set RFID to default read plan (antenna(s) {antennas}, GEN2, default power)")
+
             # Example: Setting GEN2 session (helps with reading tags in motion or dense tag populations)
             # Consult ThingMagic Gen2 documentation for optimal settings for your use case.
             # self.reader.param_set("/reader/gen2/session", "S1") # S0, S1, S2, S3
@@ -53,31 +55,56 @@ class RFIDReader:
             self.reader = None
             self.connected = False
 
-    def read_tag(self):
-        """Reads tags. Returns the EPC of the first tag found as a hex string, or None."""
+    def read_tags(self):
+        """
+        Runs one inventory round and returns every tag seen as a list of
+        (epc_bytes, rssi, antenna, read_count) tuples (empty list if none or on error).
+        EPCs stay raw bytes so callers can key on them without hex-encoding every read.
+        """
         if not self.connected or not self.reader:
-            # print("RFID Reader not connected.") # Can be noisy
-            return None
-        
+            return []
         try:
             # Read for a short duration to capture tags quickly.
             # Timeout in milliseconds. Adjust as needed for moving vehicles.
             # 200-500ms is a common starting point.
-            tags = self.reader.read(timeout=300) 
-            if tags:
-                # Log all tags found for debugging, but return the first one for simplicity in Phase 1
-                # for i, tag in enumerate(tags):
-                #     print(f"  Tag {i+1}: EPC={tag.epc.hex()}, RSSI={tag.rssi}, Antenna={tag.antenna}, ReadCount={tag.read_count}")
-                
-                # Return the EPC of the first tag. 
-                # In a more advanced setup, you might select based on RSSI or other criteria.
-                return tags[0].epc.hex()
-            return None
+            tags = self.reader.read(timeout=300)
+            return [(tag.epc, tag.rssi, tag.antenna, tag.read_count) for tag in tags] if tags else []
         except Exception as e:
             print(f"Error during RFID read: {e}")
             # Potentially attempt to reconnect or handle specific errors
-            # For now, just return None
+            return []
+
+    def read_tag(self):
+        """Reads tags. Returns the EPC of the strongest tag found as a hex string, or None."""
+        reads = self.read_tags()
+        if not reads:
             return None
+        return max(reads, key=lambda read: read[1])[0].hex()
+
+    def start_continuous(self, on_read):
+        """
+        Starts the reader's background (streaming) inventory. on_read(epc_bytes, rssi, antenna, read_count)
+        is called on the reader library's thread for every tag report, so it must return quickly;
+        rfid_stream.ContinuousReadQueue hands the reads over to the main loop.
+        """
+        if not self.connected or not self.reader:
+            return False
+        try:
+            self.reader.start_reading(lambda tag: on_read(tag.epc, tag.rssi, tag.antenna, tag.read_count),
+                                      on_time=self.continuous_on_time_ms, off_time=self.continuous_off_time_ms)
+            print(f"Continuous RFID reading started (on {self.continuous_on_time_ms} ms / off {self.continuous_off_time_ms} ms).")
+            return True
+        except Exception as e:
+            print(f"Error starting continuous RFID read: {e}")
+            return False
+
+    def stop_continuous(self):
+        if not self.connected or not self.reader:
+            return
+        try:
+            self.reader.stop_reading()
+        except Exception as e:
+            print(f"Error stopping continuous RFID read: {e}")
 
     def close(self):
         if self.reader and self.connected:
@@ -108,9 +135,8 @@ if __name__ == '__main__':
             print("Testing RFID Reader (Ctrl+C to stop)...")
             try:
                 while True:
-                    tag_epc = reader.read_tag()
-                    if tag_epc:
-                        print(f"Tag Detected: EPC = {tag_epc}")
+                    for epc, rssi, antenna, read_count in reader.read_tags():
+                        print(f"Tag Detected: EPC = {epc.hex()}, RSSI={rssi}, Antenna={antenna}, ReadCount={read_count}")
                     time.sleep(0.1) # Brief pause between read attempts
             except KeyboardInterrupt:
                 print("Stopping test.")
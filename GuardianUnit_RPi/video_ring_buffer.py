@@ -0,0 +1,148 @@
+# GuardianUnit_RPi/video_ring_buffer.py
+"""
+Pre-trigger video recording: a continuously running encoder feeds encoded frames into an
+in-memory ring buffer, and each trigger writes the buffered past plus the following seconds
+to disk (the idea behind picamera2's CircularOutput). Nothing here depends on picamera2; the
+camera side is a FrameSource, so FakeFrameSource can drive it on any Linux box.
+"""
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+EncodedFrame = namedtuple('EncodedFrame', ['timestamp_us', 'keyframe', 'data'])
+
+
+class FrameSource:
+    """Interface for something that pushes encoded frames: calls on_frame(data, keyframe, timestamp_us)."""
+    def start(self, on_frame):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class PreTriggerRecorder:
+    """
+    Keeps at least pre_seconds of encoded video in memory, stored as whole GOPs (a keyframe and
+    the frames that depend on it) so every clip starts on a keyframe and decodes cleanly.
+    record_clip() dumps the buffer to a file, keeps appending live frames until post_seconds after
+    the trigger, then returns. on_frame() is called on the encoder's thread; writes to an open
+    clip happen there too, so recording never copies or re-encodes frames.
+    Clips are raw H.264 elementary streams (.h264); the encoder must repeat SPS/PPS headers on
+    every keyframe for a clip cut mid-stream to be playable.
+    """
+    def __init__(self, pre_seconds=3.0):
+        self.pre_us = int(pre_seconds * 1_000_000)
+        self._gops = deque() # deque of lists of EncodedFrame, each list starting with a keyframe
+        self._lock = threading.Lock()
+        self._clip_file = None
+        self._clip_end_us = None
+        self._clip_done = threading.Event()
+        self.latest_timestamp_us = None
+        self.frames_received = 0
+
+    def on_frame(self, data, keyframe, timestamp_us=None):
+        if timestamp_us is None:
+            timestamp_us = time.monotonic_ns() // 1000
+        frame = EncodedFrame(timestamp_us, keyframe, data)
+        with self._lock:
+            self.frames_received += 1
+            self.latest_timestamp_us = timestamp_us
+            if keyframe or not self._gops:
+                if not keyframe:
+                    return # Can't start the buffer on a delta frame
+                self._gops.append([frame])
+            else:
+                self._gops[-1].append(frame)
+            # Drop the oldest GOP once the next one alone still covers the pre-trigger window
+            cutoff_us = timestamp_us - self.pre_us
+            while len(self._gops) > 1 and self._gops[1][0].timestamp_us <= cutoff_us:
+                self._gops.popleft()
+
+            if self._clip_file is not None:
+                self._clip_file.write(data)
+                if timestamp_us >= self._clip_end_us:
+                    self._close_clip()
+
+    def buffered_seconds(self):
+        with self._lock:
+            if not self._gops: return 0.0
+            return (self.latest_timestamp_us - self._gops[0][0].timestamp_us) / 1_000_000
+
+    def record_clip(self, output_path, post_seconds, timeout_margin_seconds=5.0):
+        """
+        Writes the pre-trigger buffer plus post_seconds of live video to output_path.
+        Blocks until the clip is complete. Returns output_path, or None if no frames arrived.
+        """
+        with self._lock:
+            if self._clip_file is not None:
+                raise RuntimeError("A clip is already being recorded")
+            if not self._gops:
+                return None
+            self._clip_file = open(output_path, 'wb')
+            for gop in self._gops:
+                for frame in gop:
+                    self._clip_file.write(frame.data)
+            self._clip_end_us = self.latest_timestamp_us + int(post_seconds * 1_000_000)
+            self._clip_done.clear()
+        if not self._clip_done.wait(post_seconds + timeout_margin_seconds):
+            with self._lock: # Frames stopped arriving; keep what we have
+                if self._clip_file is not None:
+                    self._close_clip()
+        return output_path
+
+    def _close_clip(self):
+        self._clip_file.close()
+        self._clip_file = None
+        self._clip_done.set()
+
+
+class FakeFrameSource(FrameSource):
+    """Synthetic encoder output: fixed-size frames at `fps`, a keyframe every `keyframe_interval` frames."""
+    def __init__(self, fps=30, bitrate=8_000_000, keyframe_interval=30):
+        self.fps = fps
+        self.frame_size = bitrate // 8 // fps
+        self.keyframe_interval = keyframe_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, on_frame):
+        def run():
+            index = 0
+            next_frame_at = time.monotonic()
+            while not self._stop_event.is_set():
+                keyframe = index % self.keyframe_interval == 0
+                header = b'\x00\x00\x00\x01' + (b'\x65' if keyframe else b'\x41') # NAL start code + IDR/non-IDR slice
+                on_frame(header + bytes(self.frame_size - len(header)), keyframe, time.monotonic_ns() // 1000)
+                index += 1
+                next_frame_at += 1 / self.fps
+                self._stop_event.wait(max(0.0, next_frame_at - time.monotonic()))
+        self._thread = threading.Thread(target=run, name='fake-frame-source', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+
+# Standalone test: fake 30 fps / 8 Mbps source, 3 s pre-trigger + 2 s post-trigger clip
+if __name__ == '__main__':
+    import tempfile
+    pre_seconds, post_seconds, fps = 3.0, 2.0, 30
+    recorder = PreTriggerRecorder(pre_seconds=pre_seconds)
+    source = FakeFrameSource(fps=fps, keyframe_interval=fps)
+    source.start(recorder.on_frame)
+    time.sleep(pre_seconds + 1.5) # Let the buffer fill past the pre-trigger window
+    print(f"Buffered {recorder.buffered_seconds():.2f}s before trigger (pre window {pre_seconds}s + up to one GOP)")
+    clip_path = os.path.join(tempfile.mkdtemp(), 'TEST_TAG.h264')
+    trigger_time = time.monotonic()
+    recorder.record_clip(clip_path, post_seconds)
+    print(f"record_clip returned after {time.monotonic() - trigger_time:.2f}s (post window {post_seconds}s)")
+    source.stop()
+    with open(clip_path, 'rb') as clip:
+        data = clip.read()
+    frames = data.count(b'\x00\x00\x00\x01')
+    starts_on_keyframe = data[4:5] == b'\x65'
+    print(f"Clip: {len(data) / 1e6:.2f} MB, {frames} frames = {frames / fps:.2f}s, starts on keyframe: {starts_on_keyframe}")